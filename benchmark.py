@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for Fast Goggles.
+
+Usage:
+    python3 benchmark.py startup [--runs 5]
+    python3 benchmark.py backends --images <dir> --stage object [--runs 3]
+
+Modes:
+    startup  - How long the CLI takes to start (`main --help`, importing the
+               pipeline) and which modules dominate the import time.
+    backends - Speed of every detector backend of a stage on a folder of
+               images, and how well each agrees with the configured one.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+REPO_DIR = Path(__file__).resolve().parent
+
+# Modules that must only be imported once the stage that needs them runs
+HEAVY_MODULES = ['cv2', 'numpy', 'pandas', 'mediapipe', 'deepface', 'tensorflow', 'torch', 'ultralytics', 'rawpy']
+
+STARTUP_COMMANDS = {
+    'main --help': [sys.executable, '-m', 'main', '--help'],
+    'import src.pipeline': [sys.executable, '-c', 'import src.pipeline'],
+    'python (baseline)': [sys.executable, '-c', 'pass'],
+}
+
+
+def time_command(cmd, runs=5):
+    """Run a command `runs` times and return the wall-clock durations in seconds."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def imported_heavy_modules(statement='import main'):
+    """Return the heavy modules that end up in sys.modules after running `statement`."""
+    code = (
+        f"import sys\n{statement}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout.strip()
+    return [m for m in output.split(',') if m]
+
+
+def import_time_breakdown(statement='import main', top=10):
+    """
+    Use `python -X importtime` to find the slowest modules imported by `statement`.
+
+    Returns:
+        list: (module, cumulative seconds) tuples, slowest first
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=REPO_DIR,
+                            capture_output=True, text=True, env=dict(os.environ, PYTHONWARNINGS='ignore'))
+    entries = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Keep the modules imported directly by the statement (one level of nesting)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth != 1:
+            continue
+        entries.append((name.strip(), int(cumulative) / 1e6))
+    entries.sort(key=lambda entry: entry[1], reverse=True)
+    return entries[:top]
+
+
+def run_startup(console, runs):
+    table = Table(title="CLI Startup Time", box=box.ROUNDED)
+    table.add_column("Command", style="cyan")
+    table.add_column("Median (s)", justify="right", style="green")
+    table.add_column("Min (s)", justify="right")
+    table.add_column("Max (s)", justify="right")
+    for label, cmd in STARTUP_COMMANDS.items():
+        durations = time_command(cmd, runs)
+        table.add_row(label, f"{statistics.median(durations):.3f}",
+                      f"{min(durations):.3f}", f"{max(durations):.3f}")
+    console.print(table)
+
+    import_table = Table(title="Slowest Imports (import main)", box=box.ROUNDED)
+    import_table.add_column("Module", style="cyan")
+    import_table.add_column("Cumulative (s)", justify="right", style="green")
+    for module, seconds in import_time_breakdown():
+        import_table.add_row(module, f"{seconds:.3f}")
+    console.print(import_table)
+
+    heavy = imported_heavy_modules()
+    if heavy:
+        console.print(f"[red]Heavy modules imported at startup: {', '.join(heavy)}[/red]")
+    else:
+        console.print("[green]No heavy modules are imported at startup[/green]")
+
+
+def backend_inputs(stage, images):
+    """What a stage's backends are run on: whole images, or face crops for emotion."""
+    if stage != 'emotion':
+        return images
+    from src import backends
+    crops = []
+    for image in images:
+        height, width = image.shape[:2]
+        for xmin, ymin, box_width, box_height in backends.get('face').locate(image):
+            x1, y1 = max(0, int(xmin * width)), max(0, int(ymin * height))
+            x2, y2 = min(width, int((xmin + box_width) * width)), min(height, int((ymin + box_height) * height))
+            if x2 - x1 >= 20 and y2 - y1 >= 20:
+                crops.append(image[y1:y2, x1:x2])
+    return crops
+
+
+def run_backend(stage, backend, item):
+    """Run one backend on one input and normalize its output for comparison."""
+    if stage == 'object':
+        return [(d['label'], d['box']) for d in backend.detect(item)]
+    if stage == 'face':
+        return [('face', (x, y, x + w, y + h)) for x, y, w, h in backend.locate(item)]
+    return backend.classify(item)
+
+
+def run_backends(console, image_dir, stage, names, runs, limit):
+    from src import backends
+    from src.agreement import match_f1
+    from src.image_loader import SUPPORTED_FORMATS, load_image
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in SUPPORTED_FORMATS)[:limit]
+    images = []
+    for path in paths:
+        try:
+            images.append(load_image(path))
+        except Exception as e:
+            console.print(f"[yellow]Skipping {path.name}: {str(e)}[/yellow]")
+    inputs = backend_inputs(stage, images)
+    if not inputs:
+        console.print(f"[red]Nothing to run the {stage} backends on in {image_dir}[/red]")
+        return
+    names = names or list(backends.BACKENDS[stage])
+    reference_name = backends.selected(stage)
+    names.sort(key=lambda name: name != reference_name)
+
+    table = Table(title=f"{stage.capitalize()} Backends ({len(inputs)} inputs, {runs} runs)", box=box.ROUNDED)
+    table.add_column("Backend", style="cyan")
+    table.add_column("Load (s)", justify="right")
+    table.add_column("Median (ms)", justify="right", style="green")
+    table.add_column("Mean (ms)", justify="right")
+    table.add_column(f"Agreement with {reference_name}", justify="right")
+
+    reference = None
+    for name in names:
+        start = time.perf_counter()
+        try:
+            backend = backends.get(stage, name)
+        except Exception as e:
+            table.add_row(name, "-", "-", "-", f"[red]unavailable: {str(e)}[/red]")
+            continue
+        load_seconds = time.perf_counter() - start
+
+        durations, outputs = [], []
+        for item in inputs:
+            item_durations = []
+            for run in range(runs):
+                start = time.perf_counter()
+                output = run_backend(stage, backend, item)
+                item_durations.append(time.perf_counter() - start)
+            durations.append(statistics.median(item_durations))
+            outputs.append(output)
+
+        if name == reference_name:
+            reference = outputs
+        if reference is None:
+            agreement = "-"
+        elif stage == 'emotion':
+            agreement = f"{sum(a == b for a, b in zip(reference, outputs)) / len(outputs):.1%}"
+        else:
+            agreement = f"{statistics.mean(match_f1(a, b) for a, b in zip(reference, outputs)):.1%} F1"
+        table.add_row(name, f"{load_seconds:.2f}", f"{statistics.median(durations) * 1000:.1f}",
+                      f"{statistics.mean(durations) * 1000:.1f}", agreement)
+    console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fast Goggles benchmark suite')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    startup_parser = subparsers.add_parser('startup', help='Measure CLI startup and import time')
+    startup_parser.add_argument('--runs', type=int, default=5, help='Number of runs per command')
+
+    backends_parser = subparsers.add_parser('backends', help='Compare detector backends on speed and output agreement')
+    backends_parser.add_argument('--images', required=True, help='Folder of test images')
+    backends_parser.add_argument('--stage', choices=['object', 'face', 'emotion'], default='object')
+    backends_parser.add_argument('--backend', action='append', dest='names',
+                                 help='Backend to include (repeatable; default: all of the stage)')
+    backends_parser.add_argument('--runs', type=int, default=3, help='Runs per image (the median is used)')
+    backends_parser.add_argument('--limit', type=int, default=50, help='Use at most this many images')
+
+    args = parser.parse_args()
+    console = Console()
+
+    if args.mode == 'startup':
+        run_startup(console, args.runs)
+    elif args.mode == 'backends':
+        run_backends(console, args.images, args.stage, args.names, args.runs, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import argparse
+import json
 import logging
 import os
+import sys
 import warnings
 import time
 import statistics
 from pathlib import Path
-from src.pipeline import ImageProcessor
 from src import settings
+from src.memory import format_bytes, parse_bytes
+from src.metadata import MetadataFilter, parse_time_bound
+from src.budget import parse_duration
+from src import resources
+from src import backends
 from rich.console import Console
 from rich.table import Table
 from rich import box
@@ -22,36 +28,514 @@ logging.getLogger('ultralytics').setLevel(logging.ERROR)
 logging.getLogger('mediapipe').setLevel(logging.ERROR)
 warnings.filterwarnings('ignore')
 
+def cpu_list(value):
+    resources.parse_cpu_list(value)
+    return value
+
+
+def add_resource_arguments(parser, workers_help=None):
+    """--threads and --cpu-affinity, plus --workers (and affinity "auto") for commands with worker processes."""
+    parser.add_argument('--threads', type=int,
+                        help='Total CPU threads shared by all libraries and workers (default: all available CPUs)')
+    if workers_help:
+        parser.add_argument('--workers', type=int, help=workers_help)
+        parser.add_argument('--cpu-affinity', metavar='CPUS',
+                            help='Restrict the run to these CPUs (e.g. 0-7), or "auto" to pin each worker process to its own CPUs')
+    else:
+        parser.add_argument('--cpu-affinity', metavar='CPUS', type=cpu_list,
+                            help='Restrict the run to these CPUs (e.g. 0-7)')
+
+
+def add_backend_argument(parser):
+    parser.add_argument('--backend', type=backends.parse_choice, action='append', default=[], metavar='STAGE=NAME',
+                        help='Detector backend for a stage, e.g. object=onnx or emotion=onnx (repeatable; default from settings.backends)')
+
+
+def serve_command(argv):
+    parser = argparse.ArgumentParser(prog='main serve',
+                                     description='Keep the models loaded and score images on request')
+    parser.add_argument('--socket', help='Unix domain socket to listen on (default: a per-user socket in the temp directory)')
+    parser.add_argument('--port', type=int, help='Listen on this localhost TCP port instead of a Unix socket')
+    parser.add_argument('--output', help='Default output directory for jobs that do not name one')
+    parser.add_argument('--desired-emotion', default='happy', help='Default emotion for jobs that do not name one')
+    parser.add_argument('--process-time-debug', action='store_true', help='Collect timing statistics for every job')
+    add_resource_arguments(parser)
+    add_backend_argument(parser)
+    args = parser.parse_args(argv)
+    resources.configure(args.threads, 1, args.cpu_affinity)
+    backends.select(dict(args.backend))
+    
+    from src.server import ScoringServer, SocketInUse, DEFAULT_SOCKET
+    
+    console = Console()
+    server = ScoringServer(args.output, args.desired_emotion, time_debug=args.process_time_debug)
+    try:
+        # Before loading the models, so a second server fails fast
+        server.listen(socket_path=args.socket, port=args.port)
+    except (SocketInUse, OSError) as e:
+        console.print(f"[red]Could not listen: {str(e)}[/red]")
+        return 1
+    with console.status("[cyan]Loading models..."):
+        load_start = time.perf_counter()
+        server.load_models()
+    console.print(f"Models loaded in {time.perf_counter() - load_start:.2f} seconds")
+    
+    address = f"127.0.0.1:{args.port}" if args.port is not None else (args.socket or DEFAULT_SOCKET)
+    console.print(f"[green]Fast Goggles server listening on {address}[/green] (Ctrl+C to stop)")
+    try:
+        server.serve(socket_path=args.socket, port=args.port)
+    except KeyboardInterrupt:
+        console.print("\nServer stopped")
+
+def client_command(argv):
+    parser = argparse.ArgumentParser(prog='main client',
+                                     description='Send a request to a running Fast Goggles server and print the JSON response')
+    parser.add_argument('command', choices=['score', 'rescore', 'status', 'cancel', 'shutdown'])
+    parser.add_argument('path', nargs='?', help='Image file or folder to score')
+    parser.add_argument('--output', help='Output directory for results')
+    parser.add_argument('--desired-emotion', help='Target emotion to score images by')
+    parser.add_argument('--job', type=int, help='Job id for status/cancel')
+    parser.add_argument('--top', type=int, default=20, help='Number of ranked images to return for folders (0 for all)')
+    parser.add_argument('--no-wait', action='store_true', help='Return the job id immediately instead of waiting for the result')
+    parser.add_argument('--priority', action='store_true', help='Score the likely winners of a folder first (see status for the provisional ranking)')
+    parser.add_argument('--socket', help='Unix domain socket of the server')
+    parser.add_argument('--port', type=int, help='Localhost TCP port of the server')
+    args = parser.parse_args(argv)
+    
+    from src.server import send_request
+    
+    request = {'command': args.command}
+    if args.command == 'score':
+        if not args.path:
+            parser.error("score needs an image file or folder")
+        request['path'] = str(Path(args.path).resolve())
+    if args.output:
+        request['output'] = str(Path(args.output).resolve())
+    if args.desired_emotion:
+        request['desired_emotion'] = args.desired_emotion
+    if args.job is not None:
+        request['job_id'] = args.job
+    if args.command in ('score', 'rescore'):
+        request['top'] = args.top
+        request['wait'] = not args.no_wait
+    if args.priority:
+        request['priority'] = True
+    
+    try:
+        response = send_request(request, socket_path=args.socket, port=args.port)
+    except (ConnectionError, FileNotFoundError, OSError) as e:
+        print(json.dumps({'ok': False, 'error': f"Could not reach the server: {e}"}))
+        return 1
+    print(json.dumps(response, indent=2))
+    return 0 if response.get('ok') else 1
+
+def quantize_command(argv):
+    parser = argparse.ArgumentParser(prog='main quantize',
+                                     description='Build int8 ONNX models calibrated on your own images and compare them with the float models')
+    actions = parser.add_subparsers(dest='action', required=True)
+    calibrate_parser = actions.add_parser('calibrate', help='Quantize the ONNX object and/or emotion model')
+    calibrate_parser.add_argument('--images', required=True, help='Folder of representative images from your own shoots')
+    calibrate_parser.add_argument('--stage', choices=['object', 'emotion'], action='append',
+                                  help='Model to quantize (repeatable; default: both)')
+    calibrate_parser.add_argument('--limit', type=int, help=f'Calibration inputs per model (default: {settings.calibration_images})')
+    report_parser = actions.add_parser('report', help='Speed and ranking agreement of the int8 models on a test set')
+    report_parser.add_argument('--images', required=True, help='Folder of test images (not the calibration images)')
+    report_parser.add_argument('--desired-emotion', default='happy', help='Emotion the rankings are scored for')
+    report_parser.add_argument('--top', type=int, default=20, help='Size of the top of the ranking compared')
+    report_parser.add_argument('--limit', type=int, help='Use at most this many images')
+    report_parser.add_argument('--output', help='Also write the report to this JSON file')
+    add_resource_arguments(parser)
+    args = parser.parse_args(argv)
+    resources.configure(args.threads, 1, args.cpu_affinity)
+    
+    from src import quantize
+    
+    console = Console()
+    if args.action == 'calibrate':
+        for stage in args.stage or ['object', 'emotion']:
+            with console.status(f"[cyan]Calibrating the {stage} model..."):
+                quantize.calibrate(stage, args.images, args.limit)
+        console.print("Use them with --backend object=onnx_int8 --backend emotion=onnx_int8")
+        return 0
+    
+    with console.status("[cyan]Scoring the test set with the float and int8 models..."):
+        report = quantize.compare(args.images, args.desired_emotion, args.top, args.limit)
+    table = Table(title=f"Int8 vs Float ({report['images']} images)", box=box.ROUNDED)
+    table.add_column("Metric", style="cyan")
+    table.add_column("Float", justify="right")
+    table.add_column("Int8", justify="right", style="green")
+    for key, label in (('object_ms', 'Object detection (ms)'), ('face_ms', 'Faces + emotion (ms)')):
+        table.add_row(label, f"{report['timing']['float'][key]:.1f}", 
+                      f"{report['timing']['int8'][key]:.1f} ({report['speedup'][key]:.2f}x)")
+    console.print(table)
+    
+    agreement = Table(title="Agreement with the Float Models", box=box.ROUNDED)
+    agreement.add_column("Metric", style="cyan")
+    agreement.add_column("Value", justify="right", style="green")
+    agreement.add_row("Score rank correlation (Spearman)", f"{report['rank_correlation']:.3f}")
+    agreement.add_row(f"Top {report['top']} overlap", f"{report['top_overlap']:.1%}")
+    agreement.add_row("Object detections (F1)", f"{report['object_f1']:.1%}")
+    emotion = report['emotion_agreement']
+    agreement.add_row("Same emotion", f"{emotion:.1%}" if emotion is not None else "no faces")
+    agreement.add_row("Images whose score changed", str(len(report['changed'])))
+    console.print(agreement)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        console.print(f"Report saved to: {args.output}")
+    return 0
+
+def models_command(argv):
+    parser = argparse.ArgumentParser(prog='main models',
+                                     description=f'Manage the local model store ({settings.models_dir}/)')
+    parser.add_argument('action', choices=['list', 'prefetch', 'verify', 'export'],
+                        help='list the model files, download the missing ones, check every file against its checksum, '
+                             'or export the ONNX models of the onnx backends')
+    parser.add_argument('files', nargs='*', help='Only these files (default: all)')
+    parser.add_argument('--force', action='store_true', help='prefetch, export: create the file again even if present')
+    parser.add_argument('--accept', action='store_true',
+                        help='verify: pin the current checksum of changed or unpinned files (e.g. after re-exporting a model)')
+    args = parser.parse_intermixed_args(argv)
+    
+    from src import model_store
+    
+    console = Console()
+    files = args.files or model_store.known_files()
+    failed = False
+    if args.action == 'prefetch':
+        for file_name in files:
+            if file_name not in settings.model_downloads:
+                continue
+            try:
+                with console.status(f"[cyan]Fetching {file_name}..."):
+                    model_store.fetch(file_name, force=args.force)
+                status = model_store.check(file_name, use_cache=False)
+            except Exception as e:
+                status = f"failed: {str(e)}"
+            failed |= status != 'ok'
+            console.print(f"{file_name}: {status}")
+        console.print(f"Models directory: {model_store.models_dir()}")
+        return 1 if failed else 0
+    
+    if args.action == 'export':
+        from src import onnx_backend
+        stages = {file_name: stage for stage, file_name in settings.onnx_models.items()}
+        for file_name in args.files or list(stages):
+            if file_name not in stages:
+                status = f"not an ONNX export (one of {', '.join(stages)})"
+            elif (model_store.models_dir() / file_name).is_file() and not args.force:
+                status = 'present (--force to export again)'
+            else:
+                try:
+                    with console.status(f"[cyan]Exporting {file_name}..."):
+                        onnx_backend.export(stages[file_name])
+                    status = 'exported'
+                except Exception as e:
+                    status = f"failed: {str(e)}"
+            failed |= status.startswith(('not', 'failed'))
+            console.print(f"{file_name}: {status}")
+        return 1 if failed else 0
+    
+    table = Table(title=f"Model Store ({model_store.models_dir()})", box=box.ROUNDED)
+    table.add_column("File", style="cyan")
+    table.add_column("Source")
+    table.add_column("Status")
+    table.add_column("SHA-256")
+    status_style = {'ok': 'green', 'missing': 'yellow', 'unpinned': 'yellow', 'mismatch': 'red', 'accepted': 'green'}
+    for file_name in files:
+        if args.action == 'verify':
+            status = model_store.check(file_name, use_cache=False)
+            if args.accept and status in ('unpinned', 'mismatch'):
+                model_store.pin(file_name)
+                status = 'accepted'
+            failed |= status == 'mismatch'
+        else:
+            status = model_store.check(file_name)
+        source = 'download' if file_name in settings.model_downloads else 'local'
+        checksum = model_store.pinned_checksum(file_name)
+        table.add_row(file_name, source, f"[{status_style[status]}]{status}[/{status_style[status]}]",
+                      checksum[:16] if checksum else '-')
+    console.print(table)
+    return 1 if failed else 0
+
+def find_person_command(argv):
+    parser = argparse.ArgumentParser(prog='main find-person',
+                                     description='Rank the images of a run (analyzed with --embed-faces) by how clearly they show a person')
+    parser.add_argument('--output', required=True, help='Output directory of the run to search')
+    parser.add_argument('--reference', required=True, action='append',
+                        help='Image of the person (repeatable); its largest face is used')
+    parser.add_argument('--desired-emotion', default='happy', help='Emotion the matching images are scored for')
+    parser.add_argument('--top', type=int, default=20, help='Number of images to list')
+    parser.add_argument('--threshold', type=float,
+                        help=f'Minimum face similarity (default: {settings.identity_threshold})')
+    parser.add_argument('--identity-weight', type=float,
+                        help=f'Share of the similarity in the ranking, the rest being the score (default: {settings.identity_weight})')
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument('--exact', dest='approximate', action='store_false', default=None,
+                        help='Compare every face, even in a large archive')
+    search.add_argument('--approximate', dest='approximate', action='store_true',
+                        help=f'Search the clustered index (default from {settings.face_index_ivf_min} faces)')
+    parser.add_argument('--json', help='Also write the ranking to this JSON file')
+    add_resource_arguments(parser)
+    add_backend_argument(parser)
+    args = parser.parse_args(argv)
+    resources.configure(args.threads, 1, args.cpu_affinity)
+    backends.select(dict(args.backend))
+    
+    from src.face_identity import find_person
+    
+    console = Console()
+    with console.status("[cyan]Searching faces..."):
+        matches = find_person(args.output, args.reference, args.desired_emotion, args.top,
+                              args.approximate, args.threshold, args.identity_weight)
+    if not matches:
+        console.print("No image shows a face similar enough to the reference")
+        return 1
+    
+    table = Table(title=f"Images of the Reference Person ({args.desired_emotion})", box=box.ROUNDED)
+    table.add_column("Rank", style="dim")
+    table.add_column("Image")
+    table.add_column("Similarity", justify="right")
+    table.add_column("Score", justify="right")
+    table.add_column("Combined", justify="right", style="green")
+    table.add_column("Emotion")
+    for i, match in enumerate(matches, 1):
+        table.add_row(str(i), match['image_name'], f"{match['similarity']:.3f}", f"{match['score']:.2f}",
+                      f"{match['combined']:.3f}", match['emotion'])
+    console.print(table)
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(matches, f, indent=2)
+        console.print(f"Ranking saved to: {args.json}")
+    return 0
+
+def query_command(argv):
+    parser = argparse.ArgumentParser(prog='main query',
+                                     description='Filter and sort the results of a run, e.g. '
+                                                 '"emotion=happy faces>=3 object=dog score>1.5 order by score limit 50"')
+    parser.add_argument('query', nargs='?',
+                        help='Conditions on emotion, object, faces, score and name, then optional '
+                             '"order by score|faces|name [asc|desc]" and "limit N" (default: ask interactively)')
+    parser.add_argument('--output', required=True, help='Output directory of the run to query')
+    parser.add_argument('--desired-emotion', help='Score the results for this emotion instead of the stored scores')
+    parser.add_argument('--names-only', action='store_true', help='Print only the image names, one per line')
+    parser.add_argument('--json', help='Also write the matching results to this JSON file')
+    args = parser.parse_args(argv)
+    
+    from src.query import QueryError, QueryIndex
+    
+    console = Console()
+    with console.status("[cyan]Indexing results..."):
+        index = QueryIndex.open(args.output, args.desired_emotion)
+    
+    def run(text):
+        try:
+            matches = index.search(text)
+        except QueryError as e:
+            console.print(f"[red]{str(e)}[/red]")
+            return None
+        if args.names_only:
+            for results in matches:
+                print(results['image_name'])
+            return matches
+        table = Table(title=f"{len(matches)} of {len(index)} results", box=box.ROUNDED)
+        table.add_column("Rank", style="dim")
+        table.add_column("Image")
+        table.add_column("Score", justify="right")
+        table.add_column("Faces")
+        table.add_column("Objects")
+        for i, results in enumerate(matches, 1):
+            emotions = [face['emotion'] for face in results['faces']]
+            labels = sorted({obj['label'] for obj in results['objects']})
+            table.add_row(str(i), results['image_name'], f"{results.get('score', 0.0):.2f}",
+                          ", ".join(emotions) if emotions else "No faces", ", ".join(labels))
+        console.print(table)
+        return matches
+    
+    if args.query is not None:
+        matches = run(args.query)
+        if matches is None:
+            return 2
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(matches, f, indent=2)
+            console.print(f"Results saved to: {args.json}")
+        return 0
+    
+    # Interactive culling: the index is built once and every query runs against it
+    console.print(f"{len(index)} results indexed. Enter a query (empty line to quit).")
+    while True:
+        try:
+            text = input('query> ').strip()
+        except EOFError:
+            break
+        if not text:
+            break
+        run(text)
+    return 0
+
+def contact_sheet_command(argv):
+    parser = argparse.ArgumentParser(prog='main contact-sheet',
+                                     description='Pages of thumbnails of the best results of a run, with face and object overlays')
+    parser.add_argument('--output', required=True, help='Output directory of the run')
+    parser.add_argument('--input', required=True, help='Folder with the analyzed images')
+    parser.add_argument('--top', type=int, default=100, help='Number of results on the sheets')
+    parser.add_argument('--query', help='Only results matching this query, in its order (see `main query`)')
+    parser.add_argument('--desired-emotion', help='Rank by this emotion instead of the stored scores')
+    parser.add_argument('--columns', type=int, help=f'Thumbnails per row (default: {settings.contact_sheet_columns})')
+    parser.add_argument('--rows', type=int, help=f'Rows per page (default: {settings.contact_sheet_rows})')
+    parser.add_argument('--tile-size', type=int, help=f'Longest side of a thumbnail (default: {settings.contact_sheet_tile_size})')
+    parser.add_argument('--sheets', help='Folder for the pages (default: <output>/contact_sheets)')
+    parser.add_argument('--no-overlays', dest='overlays', action='store_false', help="Don't draw face and object boxes")
+    add_resource_arguments(parser, 'Thumbnail rendering processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+    resources.configure(args.threads, args.workers or len(resources.available_cpus()), args.cpu_affinity)
+    
+    from src import contact_sheet
+    from src.query import QueryError
+    
+    console = Console()
+    start = time.perf_counter()
+    try:
+        with console.status(f"[cyan]Rendering contact sheets of the top {args.top}..."):
+            pages = contact_sheet.build(args.output, args.input, args.top, args.columns, args.rows, args.tile_size,
+                                        args.query, args.desired_emotion, args.sheets, overlays=args.overlays)
+    except QueryError as e:
+        console.print(f"[red]{str(e)}[/red]")
+        return 2
+    if not pages:
+        console.print("No results to put on a contact sheet")
+        return 1
+    console.print(f"{len(pages)} contact sheet(s) written in {time.perf_counter() - start:.1f}s to: {pages[0].parent}")
+    return 0
+
+# Extra commands, e.g. `python3 -m main serve`; anything else is a normal scoring run
+COMMANDS = {
+    'serve': serve_command,
+    'client': client_command,
+    'quantize': quantize_command,
+    'models': models_command,
+    'find-person': find_person_command,
+    'query': query_command,
+    'contact-sheet': contact_sheet_command,
+}
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+    
     supported_emotions = "angry, disgust, fear, happy, sad, surprise, neutral"
-    supported_formats = ".jpg, .jpeg, .png, .nef, .raw, .arw, .cr2, .cr3, .dng, .orf, .rw2, .pef, .srw"
+    supported_formats = ".jpg, .jpeg, .png, .nef, .raw, .arw, .cr2, .cr3, .dng, .orf, .rw2, .pef, .srw, and video clips (.mp4, .mov, .m4v, .avi, .mkv, .mts, .m2ts, .webm)"
     
     parser = argparse.ArgumentParser(description='Process images for pose, object, and face detection')
-    parser.add_argument('--input', required=True, 
+    parser.add_argument('--input', 
                         help=f'Input directory containing images (supported formats: {supported_formats})')
     parser.add_argument('--output', required=True, 
                         help='Output directory for results')
     parser.add_argument('--desired-emotion', required=True, 
                         help=f'Target emotion to score images by. Supported emotions: {supported_emotions}')
+    parser.add_argument('--video-interval', type=float,
+                        help=f'Seconds between frames sampled from video clips (default: {settings.video_sample_interval})')
+    parser.add_argument('--scene-threshold', type=float,
+                        help=f'Frame difference (0-1) that counts as a scene change in video clips (default: {settings.video_scene_threshold})')
+    parser.add_argument('--temporal-coherence', action='store_true',
+                        help='For bursts and video, reuse the previous frame\'s face and person boxes on near-identical frames')
+    parser.add_argument('--skip-rating', type=int, nargs='+', default=[], metavar='RATING',
+                        help='Skip images with these ratings (EXIF/XMP, e.g. 1 for rejects); unrated images are kept')
+    parser.add_argument('--min-rating', type=int,
+                        help='Skip images rated below this; unrated images are kept')
+    parser.add_argument('--after', type=parse_time_bound,
+                        help='Only process images captured at or after this time ("YYYY-MM-DD HH:MM" or a time of day "HH:MM")')
+    parser.add_argument('--before', type=parse_time_bound,
+                        help='Only process images captured at or before this time ("YYYY-MM-DD HH:MM" or a time of day "HH:MM")')
+    parser.add_argument('--priority', action='store_true',
+                        help='Analyze the images with the best cheap proxy score (faces, sharpness) first and keep a provisional ranking.json up to date; Ctrl+C keeps the best-so-far results')
+    parser.add_argument('--time-budget', type=parse_duration,
+                        help='Finish within this time (e.g. 90s, 10m, 1h30m) by stepping model quality down as needed; combine with --priority so the likely winners come first')
+    parser.add_argument('--max-memory', type=parse_bytes,
+                        help='Memory budget for images decoded ahead (e.g. 4G); large RAW frames wait for budget instead of exhausting RAM')
+    parser.add_argument('--decode-processes', type=int,
+                        help='Decode images in this many separate processes, handing frames over through shared memory (default: --workers minus one; 0 decodes in threads)')
+    parser.add_argument('--distributed', action='store_true',
+                        help='Share the work with other machines running the same command on the same shared --input/--output (see README)')
+    parser.add_argument('--node-id',
+                        help='Name of this machine in distributed mode (default: host name and process id)')
+    parser.add_argument('--isolate', action='store_true',
+                        help='Analyze each file in a worker process that is restarted if the file hangs or crashes it')
+    parser.add_argument('--file-timeout', type=parse_duration,
+                        help='Longest time one file may take with --isolate, e.g. 90s or 5m (implies --isolate)')
+    parser.add_argument('--embed-faces', action='store_true', default=None,
+                        help='Store an identity embedding for every face, so `main find-person` can search the run later')
+    parser.add_argument('--warm-up', action='store_true', default=None,
+                        help='Load the models and run one blank inference before the first image, so it is not a timing outlier')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from the progress journal in --output instead of starting over')
+    parser.add_argument('--rescore', action='store_true',
+                        help='Re-score the results already in --output for --desired-emotion without running detection (no --input needed)')
     parser.add_argument('--process-time-debug', action='store_true',
                         help='Display detailed processing time statistics')
+    add_resource_arguments(parser, 'Worker processes sharing --threads: the analysis worker plus WORKERS-1 decoder processes (default: 1)')
+    add_backend_argument(parser)
+    parser.add_argument('--memory-debug', action='store_true',
+                        help='Record RSS per processing stage and per file, and write memory_report.json to the output directory')
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help='Also diff tracemalloc snapshots around each stage to find the largest allocations (implies --memory-debug, slow)')
+    parser.add_argument('--trace-output', 
+                        help='Write a Chrome trace / Perfetto JSON file of all timing spans (implies --process-time-debug)')
     
     args = parser.parse_args()
+    if not args.input and not args.rescore:
+        parser.error("--input is required unless --rescore is given")
+    if args.trace_output:
+        args.process_time_debug = True
+    
+    decode_processes = args.decode_processes if args.decode_processes is not None else (args.workers or 1) - 1
+    if args.isolate or args.file_timeout or args.distributed:
+        # The isolated worker decodes its own files, and distributed nodes decode in threads
+        decode_processes = 0
+    # Must happen before the detectors (and their thread pools) are imported
+    resources.configure(args.threads, 1 + decode_processes, args.cpu_affinity)
+    
+    # Imported here so that --help and argument errors don't pay for the pipeline import
+    from src.pipeline import ImageProcessor
     
     console = Console()
     
     # Track overall processing time
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     # Initialize the processor
     processor = ImageProcessor(args.input, args.output, args.desired_emotion, 
-                              time_debug=args.process_time_debug)
+                              time_debug=args.process_time_debug,
+                              memory_debug=args.memory_debug,
+                              trace_allocations=args.trace_allocations,
+                              video_interval=args.video_interval,
+                              scene_threshold=args.scene_threshold,
+                              temporal_coherence=args.temporal_coherence,
+                              metadata_filter=MetadataFilter(args.skip_rating, args.min_rating, args.after, args.before),
+                              priority=args.priority,
+                              resume=args.resume,
+                              isolate=args.isolate,
+                              file_timeout=args.file_timeout,
+                              detector_backends=dict(args.backend),
+                              warm_up=args.warm_up,
+                              embed_faces=args.embed_faces,
+                              time_budget=args.time_budget,
+                              max_memory=args.max_memory,
+                              decode_processes=decode_processes)
     
-    # Process the directory and get the results
-    results = processor.process_directory()
+    # Process the directory (or re-score a previous run) and get the results
+    if args.rescore:
+        results = processor.rescore_directory()
+    elif args.distributed:
+        results = processor.process_distributed(args.node_id)
+    else:
+        results = processor.process_directory()
     
     # Calculate total processing time
-    total_time = time.time() - start_time
+    total_time = time.perf_counter() - start_time
     
     # Display results table
     table = Table(show_header=True, header_style="bold magenta")
@@ -62,6 +546,7 @@ def main():
     table.add_column("Face Quality")
     table.add_column("Relevant Objects")
     
+    scoring = processor.scoring_engine()
     for i, result in enumerate(results[:20], 1):
         face_info = []
         face_quality_info = []
@@ -96,7 +581,7 @@ def main():
         
         object_info = [
             obj['label'] for obj in result['objects'] 
-            if any(obj['label'].lower() == bias['name'].lower() for bias in settings.image_raw_bias_settings)
+            if scoring.has_bias(obj['label'])
         ]
         
         table.add_row(
@@ -111,6 +596,23 @@ def main():
     console.print(table)
     console.print(f"\nResults saved to: {args.output}")
     
+    failed = [result['image_name'] for result in results if result.get('error')]
+    if failed:
+        console.print(f"[red]{len(failed)} file(s) could not be analyzed:[/red] {', '.join(failed)}")
+    
+    # Show how the time budget was spent across quality tiers
+    if processor.budget is not None:
+        report = processor.budget.report()
+        budget_table = Table(title="Time Budget", show_header=True, header_style="bold cyan")
+        budget_table.add_column("Quality Tier")
+        budget_table.add_column("Images")
+        budget_table.add_column("Seconds / Image")
+        for name, count in report['tiers'].items():
+            per_image = report['seconds_per_image'].get(name)
+            budget_table.add_row(name, str(count), f"{per_image:.3f}" if per_image is not None else "-")
+        console.print(budget_table)
+        console.print(f"Used {report['elapsed_seconds']:.1f}s of a {report['budget_seconds']:.0f}s budget")
+    
     # Display timing information if requested
     if args.process_time_debug and hasattr(processor, 'timing_stats'):
         stats = processor.timing_stats
@@ -136,6 +638,42 @@ def main():
             timing_table.add_row("Fastest file", f"{min_time_file[0]} ({min_time_file[1]:.2f} seconds)")
             timing_table.add_row("Slowest file", f"{max_time_file[0]} ({max_time_file[1]:.2f} seconds)")
             
+            # Add peak memory per stage if memory accounting is enabled
+            memory_stats = processor.memory_stats
+            if memory_stats:
+                timing_table.add_section()
+                timing_table.add_row("Peak RSS (whole run)", format_bytes(memory_stats['peak_rss']))
+                for stage_name, stage_stats in memory_stats['stages'].items():
+                    timing_table.add_row(
+                        f"Peak RSS during {stage_name}",
+                        f"{format_bytes(stage_stats['peak_rss'])} (+{format_bytes(stage_stats['max_growth'])})"
+                    )
+            
+            # Add the effective thread settings of every library that was loaded
+            resource_report = resources.report()
+            if resource_report:
+                timing_table.add_section()
+                timing_table.add_row(
+                    "Thread budget",
+                    f"{resource_report['threads']} threads, {resource_report['workers']} worker(s), "
+                    f"{resource_report['threads_per_worker']} per worker"
+                )
+                timing_table.add_row("CPU affinity", f"{resource_report['affinity'] or 'none'} ({resource_report['effective_affinity']})")
+                for library, threads in resource_report['libraries'].items():
+                    timing_table.add_row(f"{library} threads", str(threads))
+            
+            # Add the admission waits caused by the memory budget
+            budget_stats = stats.get('memory_budget')
+            if budget_stats:
+                timing_table.add_section()
+                timing_table.add_row("Memory budget", format_bytes(budget_stats['limit']))
+                timing_table.add_row("Peak reserved", format_bytes(budget_stats['peak_reserved']))
+                timing_table.add_row("Decodes postponed by budget", str(budget_stats['deferred']))
+                timing_table.add_row(
+                    "Waits for memory",
+                    f"{budget_stats['waits']} ({budget_stats['wait_seconds']:.2f} seconds, max {budget_stats['max_wait_seconds']:.2f})"
+                )
+            
             # Add component timing if available
             if stats['component_times']:
                 timing_table.add_section()
@@ -167,6 +705,73 @@ def main():
                 
                 console.print("\n")
                 console.print(file_table)
+            
+            # Print per-span statistics, children indented below their parent span
+            if stats.get('spans'):
+                span_table = Table(title="Timing Spans", box=box.ROUNDED)
+                span_table.add_column("Span", style="cyan")
+                span_table.add_column("Count", justify="right")
+                span_table.add_column("Mean (s)", justify="right", style="green")
+                span_table.add_column("p50 (s)", justify="right", style="green")
+                span_table.add_column("p95 (s)", justify="right", style="yellow")
+                span_table.add_column("Max (s)", justify="right", style="red")
+                span_table.add_column("Total (s)", justify="right")
+                
+                for span_path, span_stats in stats['spans'].items():
+                    depth = span_path.count('/')
+                    span_table.add_row(
+                        "  " * depth + span_path.rsplit('/', 1)[-1],
+                        str(span_stats['count']),
+                        f"{span_stats['mean']:.3f}",
+                        f"{span_stats['p50']:.3f}",
+                        f"{span_stats['p95']:.3f}",
+                        f"{span_stats['max']:.3f}",
+                        f"{span_stats['total']:.2f}"
+                    )
+                
+                console.print("\n")
+                console.print(span_table)
+    
+    # Display memory information if requested
+    memory_stats = processor.memory_stats
+    if memory_stats:
+        memory_table = Table(title="Memory Usage", box=box.ROUNDED)
+        memory_table.add_column("Stage", style="cyan")
+        memory_table.add_column("Runs", justify="right")
+        memory_table.add_column("Peak RSS", justify="right", style="red")
+        memory_table.add_column("Max growth", justify="right", style="yellow")
+        memory_table.add_column("Net growth", justify="right", style="green")
+        
+        for stage_name, stage_stats in memory_stats['stages'].items():
+            memory_table.add_row(
+                stage_name,
+                str(stage_stats['count']),
+                format_bytes(stage_stats['peak_rss']),
+                format_bytes(stage_stats['max_growth']),
+                format_bytes(stage_stats['total_growth'])
+            )
+        
+        console.print("\n")
+        console.print(memory_table)
+        console.print(f"Peak RSS: {format_bytes(memory_stats['peak_rss'])} "
+                      f"(start: {format_bytes(memory_stats['start_rss'])})")
+        
+        if memory_stats['largest_allocations']:
+            allocation_table = Table(title="Largest Allocations", box=box.ROUNDED)
+            allocation_table.add_column("Size", justify="right", style="red")
+            allocation_table.add_column("Stage", style="cyan")
+            allocation_table.add_column("Location")
+            for allocation in memory_stats['largest_allocations']:
+                allocation_table.add_row(format_bytes(allocation['size']), allocation['stage'], allocation['location'])
+            console.print(allocation_table)
+        
+        report_path = Path(args.output) / 'memory_report.json'
+        if report_path.exists():
+            console.print(f"Memory report saved to: {report_path}")
+    
+    if args.trace_output:
+        processor.export_trace(args.trace_output)
+        console.print(f"\nTrace written to: {args.trace_output} (open in chrome://tracing or ui.perfetto.dev)")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
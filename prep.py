@@ -1,29 +1,15 @@
-# This is really only used if you do the identity stuff
-# but we ain't gonna do that because im tired
+# Downloads the res10 SSD face detector used by the opencv_dnn face backend
+# (settings.backends['face'] = 'opencv_dnn' or --backend face=opencv_dnn).
+# `python3 -m main models prefetch` fetches these and every other model.
 
-import os
-import urllib.request
+from src import settings
+from src import model_store
 
 def doprep():
-    models_folder = "models/"
-    embeddings_model = "res10_300x300_ssd_iter_140000.caffemodel"
-    deploy_prototxt = "deploy.prototxt"
-
-    embeddings_url = "https://github.com/gopinath-balu/computer_vision/raw/refs/heads/master/CAFFE_DNN/res10_300x300_ssd_iter_140000.caffemodel"
-    deploy_url = "https://github.com/BVLC/caffe/raw/refs/heads/master/models/bvlc_reference_caffenet/deploy.prototxt"
-
-    os.makedirs(models_folder, exist_ok=True)
-
-    if os.path.isfile(models_folder + embeddings_model):
-        print("Found face embeddings model... Proceeding.")
-    else:
-        print("You don't have the face embeddings model, so it will be downloaded for you...")
-        urllib.request.urlretrieve(embeddings_url, models_folder + embeddings_model)
-        print("Download complete.")
-
-    if not os.path.isfile(models_folder + deploy_prototxt):
-        print("You don't have the deploy prototxt, so it will be downloaded for you...")
-        urllib.request.urlretrieve(deploy_url, models_folder + deploy_prototxt)
-        print("Download complete.")
-    else:
-        print("Found deploy prototxt... Proceeding.")
+    for file_name in settings.face_dnn_files.values():
+        if (model_store.models_dir() / file_name).is_file():
+            print(f"Found {file_name}... Proceeding.")
+        else:
+            print(f"You don't have {file_name}, so it will be downloaded for you...")
+            model_store.fetch(file_name)
+            print("Download complete.")
@@ -0,0 +1,103 @@
+"""
+Memory-budgeted admission control for decoding.
+
+Before a frame is decoded, its peak memory is estimated from the header
+dimensions (see src.metadata) and reserved in a MemoryBudget. A frame is only
+decoded once its reservation fits, so decoding ahead slows down rather than
+running the machine out of memory. The reservation is held until the frame
+has been analyzed.
+"""
+import threading
+import time
+
+from . import settings
+from .image_loader import is_raw
+from .timing import span
+
+
+def estimate_frame_bytes(path, image_metadata=None):
+    """
+    Estimate the peak memory needed to decode and analyze an image file.
+
+    Args:
+        path: Image path
+        image_metadata (dict): Result of metadata.read_metadata(), read if not given
+
+    Returns:
+        int: Estimated bytes
+    """
+    if image_metadata is None:
+        from .metadata import read_metadata
+        image_metadata = read_metadata(path)
+    width, height = image_metadata.get('width'), image_metadata.get('height')
+    pixels = width * height if width and height else settings.default_frame_pixels
+    per_pixel = settings.raw_decode_bytes_per_pixel if is_raw(path) else settings.image_decode_bytes_per_pixel
+    return int(pixels * per_pixel)
+
+
+class MemoryBudget:
+    """
+    Counting semaphore over bytes.
+
+    A reservation larger than the whole budget is clamped to it, so an
+    oversized frame is still admitted, but only while nothing else is.
+
+    Args:
+        limit (int): Budget in bytes
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+        self.stats = {
+            'admitted': 0,
+            'deferred': 0,        # admissions postponed because the budget was full
+            'waits': 0,           # blocking waits for memory
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+            'peak_reserved': 0,
+        }
+
+    def _clamp(self, nbytes):
+        return max(0, min(int(nbytes), self.limit))
+
+    def _admit(self, nbytes):
+        self.in_use += nbytes
+        self.stats['admitted'] += 1
+        self.stats['peak_reserved'] = max(self.stats['peak_reserved'], self.in_use)
+
+    def try_acquire(self, nbytes):
+        """Reserve `nbytes` if they fit right now; returns the reserved amount, or None."""
+        nbytes = self._clamp(nbytes)
+        with self._condition:
+            if self.in_use + nbytes > self.limit:
+                self.stats['deferred'] += 1
+                return None
+            self._admit(nbytes)
+            return nbytes
+
+    def acquire(self, nbytes):
+        """Reserve `nbytes`, waiting until they fit; returns the reserved amount."""
+        nbytes = self._clamp(nbytes)
+        with self._condition:
+            if self.in_use + nbytes > self.limit:
+                started = time.perf_counter()
+                with span('memory_wait'):
+                    while self.in_use + nbytes > self.limit:
+                        self._condition.wait()
+                waited = time.perf_counter() - started
+                self.stats['waits'] += 1
+                self.stats['wait_seconds'] += waited
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+            self._admit(nbytes)
+            return nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._condition.notify_all()
+
+    def report(self):
+        with self._condition:
+            return {'limit': self.limit, 'in_use': self.in_use, **self.stats}
@@ -0,0 +1,51 @@
+"""
+Measures of how closely two sets of results agree, used to compare detector
+backends and the int8 models with the float ones.
+"""
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def match_f1(reference, candidate, min_iou=0.5):
+    """F1 score of (label, box) detections against a reference, matching greedily by IoU."""
+    if not reference and not candidate:
+        return 1.0
+    unmatched = list(reference)
+    matches = 0
+    for label, box in candidate:
+        best = max(unmatched, key=lambda ref: box_iou(ref[1], box) if ref[0] == label else -1, default=None)
+        if best is not None and best[0] == label and box_iou(best[1], box) >= min_iou:
+            unmatched.remove(best)
+            matches += 1
+    return 2 * matches / (len(reference) + len(candidate))
+
+
+def rank_correlation(reference_scores, candidate_scores):
+    """Spearman rank correlation of two score lists for the same images (ties get average ranks)."""
+    import pandas as pd
+    if len(reference_scores) < 2:
+        return 1.0
+    reference = pd.Series(reference_scores).rank()
+    candidate = pd.Series(candidate_scores).rank()
+    if reference.nunique() == 1 or candidate.nunique() == 1:
+        return 1.0 if reference.equals(candidate) else 0.0
+    return float(reference.corr(candidate))
+
+
+def top_overlap(reference_scores, candidate_scores, top):
+    """Fraction of the reference's top-N images that are also in the candidate's top N."""
+    top = min(top, len(reference_scores))
+    if not top:
+        return 1.0
+    def best(scores):
+        return set(sorted(range(len(scores)), key=lambda i: -scores[i])[:top])
+    return len(best(reference_scores) & best(candidate_scores)) / top
@@ -0,0 +1,78 @@
+"""
+In-process Python API for scoring images that are already in memory.
+
+Usage:
+    from src.api import analyze
+
+    for result in analyze(frames, desired_emotion='happy'):
+        print(result['image_name'], result['score'])
+
+`frames` can be any iterable (including a lazy generator) of NumPy arrays
+(BGR, as returned by OpenCV), encoded image bytes, file paths, or
+(name, frame) tuples to control the name stored in each result.
+"""
+from pathlib import Path
+
+from . import timing
+from .image_loader import load_image, prefetch
+
+
+def _frame_name(frame, index):
+    if isinstance(frame, (str, Path)):
+        return Path(frame).name
+    return f"frame_{index:06d}"
+
+
+def _named_frames(frames):
+    for index, frame in enumerate(frames):
+        if isinstance(frame, tuple) and len(frame) == 2:
+            yield frame
+        else:
+            yield _frame_name(frame, index), frame
+
+
+def _load_named_frame(named_frame):
+    return load_image(named_frame[1])
+
+
+def analyze(frames, desired_emotion=None, lookahead=4, output_dir=None, processor=None):
+    """
+    Detect (and optionally score) every frame, yielding results lazily in input order.
+
+    Args:
+        frames: Iterable of NumPy arrays, bytes, paths or (name, frame) tuples
+        desired_emotion (str): If given, every result also gets a 'score'
+        lookahead (int): How many frames are pulled from `frames` and decoded
+            ahead of the one being analyzed
+        output_dir (str): If given, each result is also written as
+            <name>_results.json; otherwise nothing touches the disk
+        processor (ImageProcessor): Reuse an existing processor (and its timing settings)
+
+    Yields:
+        dict: Results with 'image_name', 'poses', 'objects' and 'faces' (plus
+              'score' and 'score_components' when scoring). Frames that fail to
+              decode yield a result with an 'error' message instead.
+    """
+    if processor is None:
+        from .pipeline import ImageProcessor
+        processor = ImageProcessor(None, output_dir, desired_emotion)
+
+    for (name, _), image, error in prefetch(_named_frames(frames), lookahead=lookahead, load=_load_named_frame):
+        if error is not None:
+            results = processor._empty_results(name)
+            results['error'] = str(error)
+            yield results
+            continue
+
+        with timing.span('process_image', file=name):
+            results = processor.analyze_image(image, name)
+        if desired_emotion is not None:
+            results['score'] = processor.score_image(results)
+        if output_dir is not None:
+            processor.save_results(results, output_dir)
+        yield results
+
+
+def analyze_image(frame, desired_emotion=None, processor=None):
+    """Analyze a single frame; see analyze()."""
+    return next(analyze([frame], desired_emotion=desired_emotion, lookahead=1, processor=processor))
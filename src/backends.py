@@ -0,0 +1,100 @@
+"""
+Detector backends, selectable per stage.
+
+Every stage of the pipeline goes through a backend object, chosen in
+settings.backends (or with --backend STAGE=NAME):
+
+    object   detect(image) -> [{'label', 'confidence', 'box'}]
+    face     locate(image) -> [(xmin, ymin, width, height)] relative to the image
+             (optionally locate_batch(images) for several images in one pass, and
+             locate_with_keypoints(image) -> [(box, [(x, y)] * 4)] with the relative
+             positions of the right eye, left eye, nose tip and mouth center)
+    emotion  classify(face_img) -> emotion name
+    pose     detect(image, model_complexity, region_sweep) -> [pandas.DataFrame]
+    identity embed(face_imgs) -> normalized (faces, dimensions) array
+
+A backend also has load(), which loads its model once. Backends are
+registered by import path, so choosing the ONNX Runtime backends doesn't
+import PyTorch (ultralytics) or TensorFlow (DeepFace) at all.
+"""
+import importlib
+
+from . import settings
+
+BACKENDS = {
+    'object': {
+        'ultralytics': '.predict_object:UltralyticsObjectDetector',
+        'onnx': '.onnx_backend:OnnxObjectDetector',
+        'onnx_int8': '.onnx_backend:OnnxInt8ObjectDetector',
+    },
+    'pose': {
+        'mediapipe': '.predict_pose:MediaPipePoseDetector',
+    },
+    'face': {
+        'mediapipe': '.predict_face:MediaPipeFaceDetector',
+        'opencv_dnn': '.face_dnn:OpenCvDnnFaceDetector',
+    },
+    'emotion': {
+        'deepface': '.predict_face:DeepFaceEmotionClassifier',
+        'onnx': '.onnx_backend:OnnxEmotionClassifier',
+        'onnx_int8': '.onnx_backend:OnnxInt8EmotionClassifier',
+    },
+    'identity': {
+        'sface': '.face_identity:SFaceEmbedder',
+    },
+}
+
+_instances = {}
+
+
+def selected(stage):
+    """Name of the backend configured for `stage`."""
+    return settings.backends[stage]
+
+
+def select(choices):
+    """
+    Choose backends for this process.
+
+    Args:
+        choices (dict): Stage -> backend name, e.g. {'object': 'onnx'}
+    """
+    for stage, name in choices.items():
+        if stage not in BACKENDS:
+            raise ValueError(f"Unknown stage {stage!r}; choose from {', '.join(BACKENDS)}")
+        if name not in BACKENDS[stage]:
+            raise ValueError(f"Unknown {stage} backend {name!r}; choose from {', '.join(BACKENDS[stage])}")
+        settings.backends[stage] = name
+
+
+def parse_choice(value):
+    """Parse a --backend argument such as 'object=onnx' into (stage, name)."""
+    stage, sep, name = str(value).partition('=')
+    if not sep:
+        raise ValueError(f"Expected STAGE=NAME, e.g. object=onnx, not {value!r}")
+    stage, name = stage.strip(), name.strip()
+    if stage not in BACKENDS or name not in BACKENDS[stage]:
+        choices = '; '.join(f"{s}: {', '.join(names)}" for s, names in BACKENDS.items())
+        raise ValueError(f"Unknown backend {value!r} ({choices})")
+    return stage, name
+
+
+def get(stage, name=None):
+    """
+    The loaded backend for `stage` (the configured one unless `name` is given).
+    Instances are created once per process and reused.
+    """
+    name = name or selected(stage)
+    key = (stage, name)
+    if key not in _instances:
+        module_name, class_name = BACKENDS[stage][name].split(':')
+        module = importlib.import_module(module_name, __package__)
+        backend = getattr(module, class_name)()
+        backend.load()
+        _instances[key] = backend
+    return _instances[key]
+
+
+def load(stage, name=None):
+    """Load a stage's model now rather than on first use."""
+    return get(stage, name)
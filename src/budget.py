@@ -0,0 +1,104 @@
+"""
+Time-budget mode: pick the best quality tier that still finishes on time.
+
+The controller measures the time per image at each quality tier as the run
+goes (an exponential moving average) and, after every image, compares the
+expected time per image with the time left per remaining image. It steps
+down to a faster tier when the run falls behind and back up when it is well
+ahead. Tiers are defined in settings.quality_tiers.
+"""
+import re
+import time
+
+from . import settings
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)\s*([hms]?)')
+UNIT_SECONDS = {'h': 3600, 'm': 60, 's': 1, '': 1}
+
+
+def parse_duration(value):
+    """Parse '90', '45s', '10m', '1.5h' or '1h30m' into seconds."""
+    text = str(value).strip().lower()
+    parts = DURATION_PART.findall(text)
+    if not text or not parts or DURATION_PART.sub('', text).strip():
+        raise ValueError(f"Unrecognised duration {value!r}; use e.g. 90s, 10m or 1h30m")
+    seconds = sum(float(amount) * UNIT_SECONDS[unit] for amount, unit in parts)
+    if seconds <= 0:
+        raise ValueError("Duration must be positive")
+    return seconds
+
+
+class BudgetController:
+    """
+    Chooses the quality tier for each image so that a batch finishes within a deadline.
+
+    Args:
+        budget_seconds (float): Total time available, counted from construction
+        tiers (list): Quality tier dicts, best first (default: settings.quality_tiers)
+        smoothing (float): Weight of the newest measurement in the moving average
+    """
+
+    def __init__(self, budget_seconds, tiers=None, smoothing=0.3):
+        self.budget = budget_seconds
+        self.tiers = tiers or settings.quality_tiers
+        self.smoothing = smoothing
+        self.started = time.monotonic()
+        self.deadline = self.started + budget_seconds
+        self.remaining = 0
+        self.tier = 0
+        self.per_image = {}                      # tier index -> seconds per image (EWMA)
+        self.counts = [0] * len(self.tiers)
+
+    def plan(self, total):
+        """Set the number of images still to process."""
+        self.remaining = total
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def current(self):
+        """Quality tier dict to use for the next image."""
+        return self.tiers[self.tier]
+
+    def estimate(self, index):
+        """Expected seconds per image at tier `index`, or None before any measurement."""
+        if index in self.per_image:
+            return self.per_image[index]
+        if not self.per_image:
+            return None
+        # Scale the closest measured tier by the configured relative costs
+        measured = min(self.per_image, key=lambda i: abs(i - index))
+        return self.per_image[measured] * self.tiers[index]['cost'] / self.tiers[measured]['cost']
+
+    def record(self, seconds):
+        """Record the time one image took at the current tier and choose the next tier."""
+        previous = self.per_image.get(self.tier)
+        self.per_image[self.tier] = seconds if previous is None else \
+            self.smoothing * seconds + (1 - self.smoothing) * previous
+        self.counts[self.tier] += 1
+        self.remaining = max(0, self.remaining - 1)
+        self._adjust()
+
+    def _adjust(self):
+        if not self.remaining:
+            return
+        time_left = (self.deadline - time.monotonic()) * settings.budget_safety_margin
+        allowed = time_left / self.remaining
+        for index in range(len(self.tiers)):
+            expected = self.estimate(index)
+            # Moving up to a better tier needs some slack, so the tier doesn't flip back and forth
+            if index < self.tier:
+                expected = expected * 1.25 if expected is not None else None
+            if expected is not None and expected <= allowed:
+                self.tier = index
+                return
+        self.tier = len(self.tiers) - 1
+
+    def report(self):
+        """Summary of the run: time used and how many images were analyzed at each tier."""
+        return {
+            'budget_seconds': self.budget,
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'tiers': {tier['name']: count for tier, count in zip(self.tiers, self.counts)},
+            'seconds_per_image': {self.tiers[i]['name']: round(seconds, 4) for i, seconds in sorted(self.per_image.items())},
+        }
@@ -0,0 +1,196 @@
+"""
+Contact sheets: the top-ranked results of a run as pages of thumbnails.
+
+Each thumbnail is decoded at reduced size (libjpeg's reduced-resolution
+decode, or a RAW file's embedded preview), gets the face and object overlays
+of src.overlays and a caption with its rank, name and score. Tiles are
+rendered in a process pool. Pages are composed in NumPy and written by a
+thread pool, so one page is encoded while the next is assembled. Only the top
+N results and the tiles of the pages in flight are held in memory.
+"""
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from . import resources
+from . import settings
+from .overlays import iter_results
+from .timing import span
+
+SHEETS_DIR = 'contact_sheets'
+CAPTION_HEIGHT = 22
+BACKGROUND = (32, 32, 32)
+
+
+def top_results(output_dir, top, query=None, desired_emotion=None):
+    """
+    The `top` best results of a run, best first.
+
+    Without a query, summary.json is streamed and only the best `top` are
+    kept. A query (see src.query) filters and orders them instead.
+    """
+    if query or desired_emotion:
+        from .query import QueryIndex, parse
+        parsed = parse(query or '')
+        if parsed['limit'] is None or parsed['limit'] > top:
+            parsed['limit'] = top
+        return QueryIndex.open(output_dir, desired_emotion).search(parsed)
+    best = []
+    for position, results in enumerate(iter_results(Path(output_dir) / 'summary.json')):
+        entry = (results.get('score', 0.0), -position, results)
+        if len(best) < top:
+            heapq.heappush(best, entry)
+        else:
+            heapq.heappushpop(best, entry)
+    return [results for _, _, results in sorted(best, key=lambda entry: entry[:2], reverse=True)]
+
+
+def _video_frame(video_path, frame_index, tile_size):
+    import cv2
+    from .image_loader import load_preview
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        ok, frame = capture.read()
+    finally:
+        capture.release()
+    if not ok:
+        raise ValueError(f"Could not read frame {frame_index} of {video_path}")
+    preview = load_preview(frame, tile_size)
+    return preview, preview.shape[1] / frame.shape[1]
+
+
+def render_tile(results, rank, image_dir, tile_size, overlays=True):
+    """
+    One thumbnail, letterboxed into a tile_size square with a caption strip
+    below (runs in a worker process).
+
+    Returns:
+        numpy.ndarray: (tile_size + CAPTION_HEIGHT, tile_size, 3) tile
+    """
+    import cv2
+    import numpy as np
+    from .overlays import draw_faces, draw_objects, load_working_image
+
+    tile = np.full((tile_size + CAPTION_HEIGHT, tile_size, 3), BACKGROUND, dtype=np.uint8)
+    try:
+        source = results.get('source')
+        if source and 'video' in source:
+            image, scale = _video_frame(Path(image_dir) / source['video'], source['frame_index'], tile_size)
+        else:
+            image, scale = load_working_image(Path(image_dir) / results['image_name'], results, tile_size)
+        if overlays:
+            image = np.ascontiguousarray(image)
+            draw_objects(image, results['objects'], scale=scale)
+            draw_faces(image, results.get('faces', []), scale=scale)
+        height, width = image.shape[:2]
+        if max(height, width) > tile_size:
+            factor = tile_size / max(height, width)
+            image = cv2.resize(image, (max(1, int(width * factor)), max(1, int(height * factor))),
+                               interpolation=cv2.INTER_AREA)
+            height, width = image.shape[:2]
+        top, left = (tile_size - height) // 2, (tile_size - width) // 2
+        tile[top:top + height, left:left + width] = image
+    except Exception as e:
+        cv2.putText(tile, "unreadable", (8, tile_size // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        print(f"Could not render {results['image_name']}: {str(e)}")
+
+    caption = f"#{rank} {results['image_name']}"
+    score = f"{results.get('score', 0.0):.2f}"
+    score_width = cv2.getTextSize(score, cv2.FONT_HERSHEY_SIMPLEX, 0.45, 1)[0][0]
+    # Long names are cut so that the score always fits
+    while len(caption) > 4 and cv2.getTextSize(caption, cv2.FONT_HERSHEY_SIMPLEX, 0.45, 1)[0][0] > tile_size - score_width - 16:
+        caption = caption[:-4] + '...'
+    baseline = tile_size + CAPTION_HEIGHT - 7
+    cv2.putText(tile, caption, (4, baseline), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (230, 230, 230), 1, cv2.LINE_AA)
+    cv2.putText(tile, score, (tile_size - score_width - 4, baseline), cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                (120, 220, 120), 1, cv2.LINE_AA)
+    return tile
+
+
+def compose_page(tiles, columns, gap=None):
+    """Lay tiles out in a grid of `columns`, `gap` pixels apart."""
+    import numpy as np
+    gap = settings.contact_sheet_gap if gap is None else gap
+    tile_height, tile_width = tiles[0].shape[:2]
+    rows = -(-len(tiles) // columns)
+    page = np.full((rows * (tile_height + gap) + gap, columns * (tile_width + gap) + gap, 3), BACKGROUND,
+                   dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        y, x = gap + row * (tile_height + gap), gap + column * (tile_width + gap)
+        page[y:y + tile_height, x:x + tile_width] = tile
+    return page
+
+
+def _write_page(page, path, quality):
+    import cv2
+    # cv2.imwrite releases the GIL, so pages are encoded in parallel threads
+    if not cv2.imwrite(str(path), page, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise ValueError(f"Could not write {path}")
+    return path
+
+
+def _init_worker():
+    import cv2
+    # One thread per process, unless the run's budget (src.resources) gives it a share
+    cv2.setNumThreads(1)
+
+
+def build(output_dir, image_dir, top=100, columns=None, rows=None, tile_size=None, query=None,
+          desired_emotion=None, sheets_dir=None, workers=None, overlays=True):
+    """
+    Write contact sheets of the best results of a run.
+
+    Args:
+        output_dir: Output directory of the run (with summary.json)
+        image_dir: Folder with the analyzed images
+        top (int): Number of results on the sheets
+        columns, rows, tile_size (int): Page layout (default: settings.contact_sheet_*)
+        query (str): Only results matching this query (see src.query), in its order
+        desired_emotion (str): Rank by this emotion instead of the stored scores
+        sheets_dir: Where the pages go (default: <output>/contact_sheets)
+        workers (int): Tile rendering processes (default: the configured workers, see
+                       src.resources, or one per CPU)
+        overlays (bool): Draw face and object boxes
+
+    Returns:
+        list: Paths of the written pages
+    """
+    columns = columns or settings.contact_sheet_columns
+    rows = rows or settings.contact_sheet_rows
+    tile_size = tile_size or settings.contact_sheet_tile_size
+    workers = workers or resources.pool_size() or os.cpu_count() or 1
+    sheets_dir = Path(sheets_dir) if sheets_dir else Path(output_dir) / SHEETS_DIR
+    sheets_dir.mkdir(parents=True, exist_ok=True)
+
+    with span('select_results'):
+        selected = top_results(output_dir, top, query, desired_emotion)
+    per_page = columns * rows
+    pages = [selected[start:start + per_page] for start in range(0, len(selected), per_page)]
+
+    written = []
+    initializer, initargs = resources.pool_initializer(_init_worker)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as tile_pool, \
+            ThreadPoolExecutor(max_workers=settings.contact_sheet_encoders) as encoder:
+        def submit(page_number):
+            first_rank = page_number * per_page + 1
+            return [tile_pool.submit(render_tile, results, first_rank + i, image_dir, tile_size, overlays)
+                    for i, results in enumerate(pages[page_number])]
+
+        # The next page's tiles render while this one is composed and encoded
+        in_flight = submit(0) if pages else []
+        encoding = []
+        for page_number in range(len(pages)):
+            tiles = [future.result() for future in in_flight]
+            in_flight = submit(page_number + 1) if page_number + 1 < len(pages) else []
+            with span('compose_page'):
+                page = compose_page(tiles, columns)
+            path = sheets_dir / f"sheet_{page_number + 1:03d}.jpg"
+            encoding.append(encoder.submit(_write_page, page, path, settings.contact_sheet_quality))
+            # Bound the composed pages waiting for the encoder
+            while len([f for f in encoding if not f.done()]) > settings.contact_sheet_encoders:
+                next(f for f in encoding if not f.done()).result()
+        written = [future.result() for future in encoding]
+    return written
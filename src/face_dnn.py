@@ -0,0 +1,54 @@
+"""
+Face detection with OpenCV's DNN module and the res10 300x300 SSD (Caffe) model.
+
+A lighter alternative to MediaPipe's full-range detector: it needs only
+OpenCV, runs several images through the network in one blob, and is loaded
+from the local models directory (fetched by prep.py), so it works offline.
+"""
+from . import settings
+from . import model_store
+from .timing import span
+
+INPUT_SIZE = (300, 300)
+# Per-channel means the model was trained with (BGR)
+MEAN = (104.0, 177.0, 123.0)
+
+
+class OpenCvDnnFaceDetector:
+    """Face backend (see src.backends); boxes match MediaPipe's relative (xmin, ymin, width, height)."""
+
+    def load(self):
+        import cv2
+        config = model_store.resolve(settings.face_dnn_files['config'])
+        weights = model_store.resolve(settings.face_dnn_files['weights'])
+        with span('model_load'):
+            self.net = cv2.dnn.readNetFromCaffe(str(config), str(weights))
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def locate(self, image):
+        return self.locate_batch([image])[0]
+
+    def locate_batch(self, images):
+        """
+        Detect faces in several images with one forward pass.
+
+        Returns:
+            list: For each image, a list of (xmin, ymin, width, height) boxes relative to that image
+        """
+        import cv2
+        if not images:
+            return []
+        blob = cv2.dnn.blobFromImages(images, 1.0, INPUT_SIZE, MEAN, swapRB=False, crop=False)
+        self.net.setInput(blob)
+        with span('inference'):
+            # (1, 1, detections, 7): image index, class, confidence, x1, y1, x2, y2 (relative)
+            detections = self.net.forward()[0, 0]
+
+        boxes = [[] for _ in images]
+        for image_index, _, confidence, x1, y1, x2, y2 in detections:
+            # Unused rows are padded with image index -1
+            if image_index < 0 or confidence < settings.face_dnn_confidence:
+                continue
+            boxes[int(image_index)].append((float(x1), float(y1), float(x2 - x1), float(y2 - y1)))
+        return boxes
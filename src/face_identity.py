@@ -0,0 +1,384 @@
+"""
+Face identity: embeddings and a persistent vector index for "find this person".
+
+With --embed-faces (settings.face_embeddings) the face stage adds an
+'embedding' to every face: OpenCV's SFace model, run on all faces of an image
+in one batch and stored in the results as base64 float16, so resumed,
+distributed and rescored runs never compute it again. Faces are aligned on
+their eye, nose and mouth keypoints like SFace's training data, which
+settings.identity_threshold assumes; a face backend without keypoints gets
+plain box crops.
+
+FaceIndex collects the embeddings of a finished run (summary.json) into
+<output>/face_index/ and is rebuilt only when summary.json changes. Searches
+are exact (NumPy dot products over all faces) or, from
+settings.face_index_ivf_min faces on, approximate: an inverted file of
+spherical k-means clusters, of which only the settings.face_index_probe
+clusters closest to each reference face are compared.
+"""
+import base64
+import json
+import os
+from pathlib import Path
+
+from . import settings
+from . import model_store
+from .timing import span
+
+INPUT_SIZE = (112, 112)
+INDEX_DIR = 'face_index'
+# Where SFace expects the right eye, left eye, nose tip and mouth center in its
+# 112x112 input (the ArcFace template, with the mouth corners averaged)
+ALIGNMENT_TEMPLATE = [(38.2946, 51.6963), (73.5318, 51.5014), (56.0252, 71.7366), (56.1396, 92.2848)]
+
+
+def encode_embedding(vector):
+    """Compact JSON form of an embedding (base64 of float16)."""
+    import numpy as np
+    return base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode('ascii')
+
+
+def decode_embedding(text):
+    import numpy as np
+    return np.frombuffer(base64.b64decode(text), dtype=np.float16).astype(np.float32)
+
+
+def face_crop(image, box):
+    """Square crop around a face box (x1, y1, x2, y2), with settings.identity_margin on every side."""
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = box
+    side = max(x2 - x1, y2 - y1) * (1 + 2 * settings.identity_margin)
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    left, top = int(max(0, center_x - side / 2)), int(max(0, center_y - side / 2))
+    right, bottom = int(min(width, center_x + side / 2)), int(min(height, center_y + side / 2))
+    return image[top:bottom, left:right]
+
+
+def aligned_face(image, keypoints):
+    """
+    The face warped onto SFace's 112x112 input by the similarity transform that
+    best maps its keypoints (pixel (x, y) of right eye, left eye, nose tip and
+    mouth center) onto ALIGNMENT_TEMPLATE; None if they are degenerate.
+    """
+    import cv2
+    import numpy as np
+    matrix, _ = cv2.estimateAffinePartial2D(np.float32(keypoints), np.float32(ALIGNMENT_TEMPLATE), method=cv2.LMEDS)
+    if matrix is None:
+        return None
+    return cv2.warpAffine(image, matrix, INPUT_SIZE, flags=cv2.INTER_LINEAR)
+
+
+def face_input(image, box, keypoints=None):
+    """The identity model's input for a face: aligned when its keypoints are known, else a box crop."""
+    if keypoints is not None:
+        aligned = aligned_face(image, keypoints)
+        if aligned is not None:
+            return aligned
+    return face_crop(image, box)
+
+
+class SFaceEmbedder:
+    """
+    Identity backend (see src.backends) running OpenCV's SFace recognition model.
+
+    Expects aligned faces (see face_input()); other crops are resized to the
+    model's input as they are.
+    """
+
+    def load(self):
+        import cv2
+        path = model_store.resolve(settings.identity_model)
+        with span('model_load'):
+            self.net = cv2.dnn.readNetFromONNX(str(path))
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # Exports with a fixed batch size of 1 fall back to one face per pass
+        self.batched = True
+
+    def _forward(self, face_imgs):
+        import cv2
+        blob = cv2.dnn.blobFromImages(face_imgs, 1.0, INPUT_SIZE, (0, 0, 0), swapRB=True, crop=False)
+        self.net.setInput(blob)
+        return self.net.forward().reshape(len(face_imgs), -1)
+
+    def embed(self, face_imgs):
+        """
+        Embed several face crops, settings.identity_batch_size per forward pass.
+
+        Returns:
+            numpy.ndarray: (faces, dimensions) float32, L2-normalized
+        """
+        import cv2
+        import numpy as np
+        outputs = []
+        batch_size = settings.identity_batch_size
+        for start in range(0, len(face_imgs), batch_size):
+            chunk = face_imgs[start:start + batch_size]
+            with span('inference'):
+                if self.batched:
+                    try:
+                        outputs.append(self._forward(chunk))
+                        continue
+                    except cv2.error:
+                        self.batched = False
+                outputs.extend(self._forward([face_img]) for face_img in chunk)
+        if not outputs:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.concatenate(outputs).astype(np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _kmeans(vectors, clusters, iterations=10, seed=0):
+    """Spherical k-means on normalized vectors; returns (centroids, assignment)."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    assignment = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(iterations):
+        for start in range(0, len(vectors), 65536):
+            assignment[start:start + 65536] = (vectors[start:start + 65536] @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # An empty cluster keeps its previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids, assignment
+
+
+class FaceIndex:
+    """
+    Face embeddings of one output directory with their image and face.
+
+    Args:
+        embeddings (numpy.ndarray): (faces, dimensions) normalized vectors
+        faces (list): Per row: {'image_name', 'face', 'box', 'emotion', 'face_quality'}
+    """
+
+    def __init__(self, embeddings, faces):
+        self.embeddings = embeddings
+        self.faces = faces
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.faces)
+
+    @classmethod
+    def from_results(cls, all_results):
+        import numpy as np
+        vectors, faces = [], []
+        for results in all_results:
+            for number, face in enumerate(results['faces']):
+                if face.get('embedding'):
+                    vectors.append(decode_embedding(face['embedding']))
+                    faces.append({'image_name': results['image_name'], 'face': number, 'box': face['box'],
+                                  'emotion': face['emotion'], 'face_quality': face.get('face_quality', 1.0)})
+        embeddings = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        index = cls(embeddings, faces)
+        if len(index) >= settings.face_index_ivf_min:
+            index.build_ivf()
+        return index
+
+    @classmethod
+    def open(cls, output_dir):
+        """
+        The index of an output directory, loaded from <output>/face_index/ or
+        built from summary.json (and saved) if that changed since.
+        """
+        output_dir = Path(output_dir)
+        summary_path = output_dir / 'summary.json'
+        if not summary_path.exists():
+            raise FileNotFoundError(f"No summary.json found in {output_dir}; run a full analysis first")
+        stat = summary_path.stat()
+        source = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        index_dir = output_dir / INDEX_DIR
+        try:
+            with open(index_dir / 'faces.json') as f:
+                manifest = json.load(f)
+            if manifest['source'] == source:
+                return cls.load(index_dir, manifest)
+        except (OSError, ValueError, KeyError):
+            pass
+        with open(summary_path) as f:
+            all_results = json.load(f)
+        with span('build_face_index'):
+            index = cls.from_results(all_results)
+        if not len(index):
+            raise ValueError(f"No face embeddings in {summary_path}; analyze the images with --embed-faces")
+        index.save(index_dir, source)
+        return index
+
+    @classmethod
+    def load(cls, index_dir, manifest):
+        import numpy as np
+        index = cls(np.load(index_dir / 'embeddings.npy').astype(np.float32), manifest['faces'])
+        if (index_dir / 'ivf.npz').exists():
+            ivf = np.load(index_dir / 'ivf.npz')
+            index.centroids, index.order, index.offsets = ivf['centroids'], ivf['order'], ivf['offsets']
+        return index
+
+    def save(self, index_dir, source):
+        import numpy as np
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / 'embeddings.npy', self.embeddings.astype(np.float16))
+        if self.centroids is not None:
+            np.savez(index_dir / 'ivf.npz', centroids=self.centroids, order=self.order, offsets=self.offsets)
+        elif (index_dir / 'ivf.npz').exists():
+            (index_dir / 'ivf.npz').unlink()
+        # Written last: a complete faces.json marks a complete index
+        tmp_path = index_dir / f"faces.json.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': source, 'faces': self.faces}, f)
+        os.replace(tmp_path, index_dir / 'faces.json')
+
+    def build_ivf(self, clusters=None):
+        """Cluster the embeddings for approximate search (about 4 * sqrt(faces) clusters by default)."""
+        import numpy as np
+        clusters = min(len(self), clusters or max(1, int(4 * np.sqrt(len(self)))))
+        with span('build_ivf'):
+            self.centroids, assignment = _kmeans(self.embeddings, clusters)
+        # Faces grouped by cluster: order[offsets[c]:offsets[c + 1]] are the rows of cluster c
+        self.order = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=clusters))]).astype(np.int64)
+
+    def search(self, queries, approximate=None):
+        """
+        Similarity of every indexed face to the closest of the query faces.
+
+        Args:
+            queries (numpy.ndarray): (references, dimensions) normalized vectors
+            approximate (bool): Search only the closest clusters; None uses the
+                                IVF index when there is one
+
+        Returns:
+            tuple: (rows, similarities) of the faces that were compared
+        """
+        import numpy as np
+        if approximate is None:
+            approximate = self.centroids is not None
+        if approximate and self.centroids is None:
+            self.build_ivf()
+        if approximate:
+            probe = min(settings.face_index_probe, len(self.centroids))
+            nearest = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :probe]
+            clusters = np.unique(nearest)
+            rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+        else:
+            rows = np.arange(len(self))
+        similarities = np.full(len(rows), -1.0, dtype=np.float32)
+        for start in range(0, len(rows), 65536):
+            block = self.embeddings[rows[start:start + 65536]] @ queries.T
+            similarities[start:start + 65536] = block.max(axis=1)
+        return rows, similarities
+
+
+def embed_faces(image, faces, keypoints=None):
+    """
+    Add an 'embedding' to every face of an image, in one batch.
+
+    Args:
+        image (numpy.ndarray): BGR image the face boxes refer to
+        faces (list): Face results with 'box'; changed in place
+        keypoints (list): Per face, pixel keypoints to align it on (see
+                          aligned_face()) or None for a box crop
+    """
+    from . import backends
+    if not faces:
+        return
+    keypoints = keypoints or [None] * len(faces)
+    crops = [face_input(image, face['box'], points) for face, points in zip(faces, keypoints)]
+    with span('face_identity'):
+        vectors = backends.get('identity').embed(crops)
+    for face, vector in zip(faces, vectors):
+        face['embedding'] = encode_embedding(vector)
+
+
+def reference_embeddings(paths):
+    """
+    Embeddings of the largest face in each reference image. An image without
+    a detectable face is taken to be a face crop itself.
+
+    Returns:
+        numpy.ndarray: (references, dimensions)
+    """
+    import numpy as np
+    from . import backends
+    from .image_loader import load_image
+    from .predict_face import locate_with_keypoints
+    crops = []
+    for path in paths:
+        image = load_image(path)
+        height, width = image.shape[:2]
+        faces = [((int(x * width), int(y * height), int((x + w) * width), int((y + h) * height)),
+                  [(px * width, py * height) for px, py in keypoints] if keypoints else None)
+                 for (x, y, w, h), keypoints in locate_with_keypoints(image)]
+        if faces:
+            box, keypoints = max(faces, key=lambda f: (f[0][2] - f[0][0]) * (f[0][3] - f[0][1]))
+            crops.append(face_input(image, box, keypoints))
+        else:
+            print(f"No face found in {Path(path).name}; using the whole image as the face")
+            crops.append(image)
+    return backends.get('identity').embed(crops) if crops else np.zeros((0, 0), dtype=np.float32)
+
+
+def find_person(output_dir, reference_paths, desired_emotion, top=None, approximate=None,
+                threshold=None, identity_weight=None):
+    """
+    Rank the images of a finished run by how clearly they show a person.
+
+    The best similarity of any face in an image to any reference face must
+    reach `threshold`; matching images are then ranked by
+    identity_weight * similarity + (1 - identity_weight) * score, with the
+    score for `desired_emotion` normalized to the best matching image.
+
+    Args:
+        output_dir: Output directory of a run with --embed-faces
+        reference_paths (list): Images of the person (one face each)
+        desired_emotion (str): Emotion the images are scored for
+        top (int): Return only the best N
+        approximate (bool): Force (True) or avoid (False) the IVF index
+        threshold (float): Minimum similarity (default: settings.identity_threshold)
+        identity_weight (float): Default: settings.identity_weight
+
+    Returns:
+        list: Dicts with 'image_name', 'similarity', 'score', 'combined',
+              'face' (index in the results), 'box' and 'emotion', best first
+    """
+    from .scoring import ScoringEngine
+    threshold = settings.identity_threshold if threshold is None else threshold
+    identity_weight = settings.identity_weight if identity_weight is None else identity_weight
+
+    index = FaceIndex.open(output_dir)
+    queries = reference_embeddings(reference_paths)
+    with span('face_search'):
+        rows, similarities = index.search(queries, approximate)
+
+    best = {}
+    for row, similarity in zip(rows.tolist(), similarities.tolist()):
+        if similarity < threshold:
+            continue
+        face = index.faces[row]
+        if face['image_name'] not in best or similarity > best[face['image_name']]['similarity']:
+            best[face['image_name']] = {'image_name': face['image_name'], 'similarity': similarity,
+                                        'face': face['face'], 'box': face['box'], 'emotion': face['emotion']}
+    if not best:
+        return []
+
+    with open(Path(output_dir) / 'summary.json') as f:
+        all_results = [results for results in json.load(f) if results['image_name'] in best]
+    scores = ScoringEngine(desired_emotion).score_batch(all_results)
+    max_score = max(float(scores.max()), 0.0)
+    for results, score in zip(all_results, scores.tolist()):
+        match = best[results['image_name']]
+        match['score'] = score
+        match['combined'] = (identity_weight * match['similarity']
+                             + (1 - identity_weight) * (max(score, 0.0) / max_score if max_score > 0 else 0.0))
+    ranked = sorted((match for match in best.values() if 'combined' in match),
+                    key=lambda m: m['combined'], reverse=True)
+    return ranked[:top] if top else ranked
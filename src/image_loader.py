@@ -0,0 +1,216 @@
+"""
+Decoding of every supported input into an OpenCV (BGR, uint8) image held in memory.
+
+Sources can be file paths (JPEG/PNG and the supported RAW formats), encoded
+bytes, or NumPy arrays that are already decoded. RAW files are developed in
+memory, so no temporary files are written.
+"""
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import settings
+from .timing import span
+
+RAW_FORMATS = ['.nef', '.raw', '.arw', '.cr2', '.cr3', '.dng', '.orf', '.rw2', '.pef', '.srw']
+IMAGE_FORMATS = ['.jpg', '.jpeg', '.png']
+SUPPORTED_FORMATS = IMAGE_FORMATS + RAW_FORMATS
+
+
+def is_raw(path):
+    return Path(path).suffix.lower() in RAW_FORMATS
+
+
+def decode_raw(source):
+    """
+    Develop a RAW file (path or file-like object) into a BGR image.
+    Falls back to dcraw when rawpy is missing or can't read the file.
+    """
+    import cv2
+    try:
+        import rawpy
+        with rawpy.imread(source) as raw:
+            rgb = raw.postprocess(use_camera_wb=True, half_size=False, no_auto_bright=False)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    except Exception as e:
+        if not isinstance(source, (str, os.PathLike)):
+            raise ValueError(f"Failed to decode RAW data: {str(e)}")
+        # dcraw writes a PPM to stdout, which OpenCV can decode straight from memory
+        try:
+            output = subprocess.run(['dcraw', '-c', '-w', str(source)], capture_output=True, check=True,
+                                    timeout=settings.dcraw_timeout).stdout
+            image = decode_bytes(output)
+        except Exception as dcraw_error:
+            raise ValueError(f"Failed to process RAW image {source}: {str(e)}, dcraw error: {str(dcraw_error)}")
+        return image
+
+
+def decode_bytes(data):
+    """Decode an encoded image (JPEG, PNG, PPM, ...) held in memory."""
+    import cv2
+    import numpy as np
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image data")
+    return image
+
+
+def load_image(source):
+    """
+    Return `source` as a BGR uint8 image.
+
+    Args:
+        source: A path (str or Path), encoded image bytes, or a NumPy array.
+            Arrays are expected in OpenCV's BGR order; grayscale and BGRA
+            arrays are converted.
+
+    Returns:
+        numpy.ndarray: Image of shape (height, width, 3)
+    """
+    import cv2
+    import numpy as np
+    if isinstance(source, np.ndarray):
+        if source.ndim == 2:
+            return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+        if source.ndim == 3 and source.shape[2] == 4:
+            return cv2.cvtColor(source, cv2.COLOR_BGRA2BGR)
+        if source.ndim != 3 or source.shape[2] != 3:
+            raise ValueError(f"Unsupported image array shape {source.shape}")
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        with span('decode'):
+            return decode_bytes(source)
+
+    path = str(source)
+    if is_raw(path):
+        with span('raw_conversion'):
+            return decode_raw(path)
+    with span('decode'):
+        image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Could not read image at {path}")
+    return image
+
+
+def _raw_thumbnail(path):
+    """Decode the preview JPEG embedded in a RAW file, or None if there is none."""
+    import cv2
+    try:
+        import rawpy
+        with rawpy.imread(path) as raw:
+            thumb = raw.extract_thumb()
+        if thumb.format == rawpy.ThumbFormat.JPEG:
+            return decode_bytes(thumb.data)
+        return cv2.cvtColor(thumb.data, cv2.COLOR_RGB2BGR)
+    except Exception:
+        pass
+    # dcraw -e writes the embedded thumbnail to stdout
+    try:
+        output = subprocess.run(['dcraw', '-e', '-c', path], capture_output=True, check=True,
+                                timeout=settings.dcraw_timeout).stdout
+        return decode_bytes(output)
+    except Exception:
+        return None
+
+
+def load_preview(source, max_side=1024):
+    """
+    Cheap reduced-resolution decode for proxies and thumbnails.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by libjpeg itself, RAW files
+    use their embedded preview, and the result is shrunk so that its longest
+    side is at most `max_side`. Arrays and bytes go through load_image().
+    """
+    import cv2
+    if isinstance(source, (str, os.PathLike)):
+        path = str(source)
+        with span('preview_decode'):
+            image = None
+            if is_raw(path):
+                image = _raw_thumbnail(path)
+            elif Path(path).suffix.lower() in ('.jpg', '.jpeg'):
+                from .metadata import read_metadata
+                info = read_metadata(path)
+                longest = max(info['width'] or 0, info['height'] or 0)
+                flag = cv2.IMREAD_COLOR
+                for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                        (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                    if longest and longest / factor >= max_side:
+                        flag = reduced
+                        break
+                image = cv2.imread(path, flag)
+        if image is None:
+            image = load_image(path)
+    else:
+        image = load_image(source)
+
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return image
+
+
+def prefetch(sources, lookahead=4, load=load_image, workers=2, budget=None, estimate=None):
+    """
+    Decode sources in background threads while the caller works on earlier ones.
+
+    At most `lookahead` sources are pulled from the (possibly lazy) iterable ahead
+    of the one being consumed, so memory stays bounded for endless streams.
+
+    With a `budget` (admission.MemoryBudget), each source reserves
+    `estimate(source)` bytes before it is decoded and keeps them until the
+    caller asks for the next item. Decoding ahead is postponed while the
+    budget is full; only when nothing is held does admission block.
+
+    Yields:
+        tuple: (source, image, error) in input order; `image` is None when
+               decoding failed and `error` holds the exception.
+    """
+    lookahead = max(1, lookahead)
+    iterator = iter(sources)
+    pending = []
+    deferred = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, lookahead))) as executor:
+        def fill(may_block=True):
+            while len(pending) < lookahead:
+                if deferred:
+                    source = deferred.pop()
+                else:
+                    try:
+                        source = next(iterator)
+                    except StopIteration:
+                        return
+                reserved = 0
+                if budget is not None:
+                    nbytes = estimate(source) if estimate is not None else 0
+                    if pending or not may_block:
+                        # Blocking here could wait on frames only the caller can release
+                        reserved = budget.try_acquire(nbytes)
+                        if reserved is None:
+                            deferred.append(source)
+                            return
+                    else:
+                        reserved = budget.acquire(nbytes)
+                pending.append((source, reserved, executor.submit(load, source)))
+
+        fill()
+        while pending:
+            source, reserved, future = pending.pop(0)
+            # The popped frame stays reserved until the caller is done with it
+            fill(may_block=budget is None)
+            try:
+                try:
+                    with span('prefetch_wait'):
+                        image = future.result()
+                except Exception as e:
+                    yield source, None, e
+                else:
+                    yield source, image, None
+            finally:
+                if budget is not None:
+                    budget.release(reserved)
+            if budget is not None:
+                fill()
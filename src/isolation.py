@@ -0,0 +1,179 @@
+"""
+Per-file isolation: analyze each file in a worker process under a wall-clock timeout.
+
+A malformed RAW can make LibRaw hang or crash, which in-process would stall
+or kill the whole run. The IsolatedWorker keeps a process with the models
+loaded and hands it one file at a time. If the file takes longer than the
+timeout, the worker is killed; if the worker dies, the crash is reported.
+Either way a fresh worker is started for the next file, and the caller gets
+a FileFailure that says why.
+
+With timing or memory accounting on, the worker records its spans and
+stages itself and sends them back with every file, so the parent's reports
+cover the work done in the worker.
+"""
+import multiprocessing
+import signal
+import time
+
+from . import memory
+from . import resources
+from . import settings
+from . import timing
+
+
+class FileFailure(Exception):
+    """A file could not be analyzed in the worker (timeout, crash or error)."""
+
+
+def _describe_exit(exitcode):
+    if exitcode is not None and exitcode < 0:
+        try:
+            return f"worker crashed ({signal.Signals(-exitcode).name})"
+        except ValueError:
+            pass
+    return f"worker crashed (exit code {exitcode})"
+
+
+def _drain_telemetry():
+    """The worker's spans and memory records since the last file, for the parent."""
+    timer, tracker = timing.get_active_timer(), memory.get_active_tracker()
+    return {'spans': timer.drain() if timer is not None else None,
+            'memory': tracker.drain() if tracker is not None else None}
+
+
+def _merge_telemetry(telemetry):
+    timer, tracker = timing.get_active_timer(), memory.get_active_tracker()
+    if telemetry['spans'] and timer is not None:
+        timer.add_events(telemetry['spans'])
+    if telemetry['memory'] and tracker is not None:
+        tracker.merge(telemetry['memory'])
+
+
+def _worker_main(conn, processor_kwargs, resource_config):
+    # The analysis worker of the run: its share of the thread budget, pinned as worker 0
+    resources.init_worker(resource_config, 0)
+    from .image_loader import load_preview
+    from .pipeline import ImageProcessor
+    processor = ImageProcessor(**processor_kwargs)
+    # A file that can't be decoded or analyzed is reported as an error, so the
+    # parent records why and retries it on the preview
+    processor.raise_errors = True
+    try:
+        processor.load_models()
+    except Exception as e:
+        # Reported again by each file that needs the missing model
+        print(f"Error loading models in worker: {str(e)}")
+    conn.send(('ready', None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        image_path, image_metadata, proxy, quality_tier, degraded = request
+        processor.quality_tier = quality_tier
+        try:
+            # The degraded retry only decodes the embedded/reduced preview
+            image = load_preview(image_path, settings.degraded_preview_size) if degraded else None
+            results = processor.process_file(image_path, image_metadata, proxy, image)
+            conn.send(('ok', results, _drain_telemetry()))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {str(e)}", _drain_telemetry()))
+    conn.close()
+
+
+class IsolatedWorker:
+    """
+    A restartable worker process that runs ImageProcessor.process_file().
+
+    Args:
+        processor_kwargs (dict): Arguments for the worker's ImageProcessor
+        timeout (float): Seconds one file may take before the worker is killed
+        start_timeout (float): Seconds a new worker may take to load its models
+    """
+
+    def __init__(self, processor_kwargs, timeout, start_timeout=None):
+        self.processor_kwargs = processor_kwargs
+        self.timeout = timeout
+        self.start_timeout = start_timeout or settings.worker_start_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._conn = None
+        self.restarts = 0
+
+    def _start(self):
+        self._conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(target=_worker_main,
+                                              args=(child_conn, self.processor_kwargs, resources.get_config()),
+                                              name='isolated-worker', daemon=True)
+        self._process.start()
+        child_conn.close()
+        if not self._conn.poll(self.start_timeout):
+            self._kill()
+            raise FileFailure(f"worker did not start within {self.start_timeout:.0f}s")
+        try:
+            self._conn.recv()
+        except EOFError:
+            exitcode = self._reap()
+            raise FileFailure(_describe_exit(exitcode))
+
+    def _reap(self):
+        """Collect a dead worker; returns its exit code."""
+        self._process.join(5)
+        exitcode = self._process.exitcode
+        self._conn.close()
+        self._process = self._conn = None
+        self.restarts += 1
+        return exitcode
+
+    def _kill(self):
+        self._process.kill()
+        self._reap()
+
+    def run(self, image_path, image_metadata=None, proxy=None, quality_tier=None, degraded=False):
+        """
+        Analyze one file in the worker.
+
+        Args:
+            degraded (bool): Analyze the reduced-resolution preview instead of the full decode
+
+        Returns:
+            dict: The results from ImageProcessor.process_file()
+
+        Raises:
+            FileFailure: On timeout, crash or an error in the worker
+        """
+        if self._process is None:
+            self._start()
+        quality_tier = quality_tier or settings.quality_tiers[0]
+        self._conn.send((str(image_path), image_metadata, proxy, quality_tier, degraded))
+        started = time.monotonic()
+        if not self._conn.poll(self.timeout):
+            self._kill()
+            raise FileFailure(f"timed out after {time.monotonic() - started:.0f}s")
+        try:
+            status, payload, telemetry = self._conn.recv()
+        except EOFError:
+            raise FileFailure(_describe_exit(self._reap()))
+        _merge_telemetry(telemetry)
+        if status != 'ok':
+            raise FileFailure(payload)
+        return payload
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._process = self._conn = None
+
@@ -0,0 +1,72 @@
+"""
+Append-only progress journal that lets an interrupted run resume.
+
+process_directory() appends one JSON line per finished file to
+<output>/progress.jsonl and fsyncs it before moving on, so a crash (a RAW
+decoder taking the process down, a laptop going to sleep) costs at most the
+file that was being analyzed. A line is either complete or, if the crash hit
+in the middle of the write, a truncated last line that is ignored on load.
+"""
+import json
+import os
+from pathlib import Path
+
+JOURNAL_NAME = 'progress.jsonl'
+
+
+class Journal:
+    """
+    Args:
+        path: Journal file, usually <output>/progress.jsonl
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+
+    def load(self):
+        """
+        Read the files completed by previous runs.
+
+        Returns:
+            dict: File name -> list of results (several for a video clip)
+        """
+        completed = {}
+        if not self.path.exists():
+            return completed
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write at the moment of the crash; that file is simply redone
+                    continue
+                completed[entry['file']] = entry['results']
+        return completed
+
+    def open(self, resume=False):
+        """Start appending; without `resume` the journal of a previous run is discarded."""
+        self._file = open(self.path, 'ab' if resume else 'wb')
+        if resume:
+            self._terminate_torn_line()
+
+    def _terminate_torn_line(self):
+        # A partial last line must not swallow the first entry appended after it
+        if self._file.tell() == 0:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                self._file.write(b'\n')
+
+    def record(self, file_name, results):
+        """Durably record that `file_name` is done, with its results."""
+        line = json.dumps({'file': file_name, 'results': results}) + '\n'
+        self._file.write(line.encode('utf-8'))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
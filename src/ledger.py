@@ -0,0 +1,322 @@
+"""
+Shared job ledger for splitting one shoot across several machines.
+
+The ledger is a directory on the shared filesystem (NAS) built only from
+operations that are atomic on local disks, NFS and SMB alike: exclusive file
+creation (O_CREAT | O_EXCL), rename and replace. SQLite's locking is not
+reliable on network filesystems, so it isn't used.
+
+    ledger/items.json           work items (file names), written once by the first node
+    ledger/items.lock           taken by the node that writes items.json
+    ledger/nodes/<node>.alive   heartbeat of each node: {"node", "expires"}
+    ledger/leases/<key>.lease   claimed items: {"node", "item", "id", "expires"}
+    ledger/done/<key>.done      finished items
+    ledger/summary.<node>.jsonl results of each node, one line per image, merged into summary.json
+
+A lease file is written once and never rewritten by its owner. The owner
+keeps its leases alive by renewing its heartbeat file from a background
+thread. A lease whose node stopped renewing (it crashed or lost the NAS) is
+expired. To reclaim it, a node must create the exclusive token
+<key>.lease.<lease id>.reclaim, which only one node can do per lease, and only
+that node replaces the lease. The item is then processed again.
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from . import settings
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _create_exclusive(path, data):
+    """Create `path` with JSON content; returns False if it already exists."""
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    return True
+
+
+def _append_jsonl(path, entries):
+    with open(path, 'a') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_jsonl(path):
+    entries = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Missing, or caught mid-write by another node
+        return None
+
+
+class Ledger:
+    """
+    Lease-based work queue in a shared directory.
+
+    Args:
+        directory (str): Ledger directory, visible to every node
+        node_id (str): Unique name of this node (default: host name and PID)
+        lease_seconds (float): How long a claim stays valid without renewal
+    """
+
+    def __init__(self, directory, node_id=None, lease_seconds=None):
+        self.directory = Path(directory)
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds or settings.ledger_lease_seconds
+        self.leases_dir = self.directory / 'leases'
+        self.done_dir = self.directory / 'done'
+        self.nodes_dir = self.directory / 'nodes'
+        self.leases_dir.mkdir(parents=True, exist_ok=True)
+        self.done_dir.mkdir(parents=True, exist_ok=True)
+        self.nodes_dir.mkdir(parents=True, exist_ok=True)
+        self.items = []
+        # item -> id of the lease this node holds on it
+        self._held = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _key(item):
+        return hashlib.sha1(item.encode('utf-8')).hexdigest()[:20]
+
+    def _lease_path(self, item):
+        return self.leases_dir / f"{self._key(item)}.lease"
+
+    def _done_path(self, item):
+        return self.done_dir / f"{self._key(item)}.done"
+
+    def initialize(self, items, timeout=None):
+        """
+        Publish the work items, or adopt the list another node already published.
+
+        A node that took items.lock but died before writing items.json leaves
+        a stale lock; after settings.ledger_lock_seconds (plus the clock skew)
+        one of the waiting nodes publishes its own list instead.
+
+        Returns:
+            list: The ledger's items (the first node's list wins)
+        """
+        items_path = self.directory / 'items.json'
+        lock_path = self.directory / 'items.lock'
+        stale_after = settings.ledger_lock_seconds + settings.ledger_clock_skew
+        deadline = time.monotonic() + (timeout if timeout is not None else 2 * stale_after + 30)
+        while True:
+            published = _read_json(items_path)
+            if published is not None:
+                self.items = published
+                return self.items
+            try:
+                lock = os.stat(lock_path)
+            except FileNotFoundError:
+                lock = None
+            if lock is None:
+                # Nobody is publishing yet: the node that takes the lock writes the list
+                if _create_exclusive(lock_path, {'node': self.node_id, 'created': time.time()}):
+                    _write_json_atomic(items_path, list(items))
+                    continue
+            elif time.time() > lock.st_mtime + stale_after:
+                # Only one node may take over this particular stale lock
+                token = lock_path.with_name(f"items.lock.{lock.st_mtime_ns}.stale")
+                if _create_exclusive(token, {'node': self.node_id, 'created': time.time()}):
+                    print(f"Publishing the item list in place of a node that died ({lock_path} is stale)")
+                    _write_json_atomic(items_path, list(items))
+                    continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No item list appeared in {self.directory}")
+            time.sleep(0.2)
+
+    def _heartbeat_path(self, node_id):
+        return self.nodes_dir / f"{node_id}.alive"
+
+    def _beat(self):
+        _write_json_atomic(self._heartbeat_path(self.node_id),
+                           {'node': self.node_id, 'expires': time.time() + self.lease_seconds})
+
+    def _lease(self, item):
+        return {'node': self.node_id, 'item': item, 'id': uuid.uuid4().hex,
+                'expires': time.time() + self.lease_seconds}
+
+    def _expired(self, lease):
+        """Whether nobody keeps `lease` alive any more: neither the lease itself nor its node's heartbeat."""
+        heartbeat = _read_json(self._heartbeat_path(lease['node'])) or {}
+        expires = max(lease.get('expires', 0), heartbeat.get('expires', 0))
+        return time.time() > expires + settings.ledger_clock_skew
+
+    def _acquire(self, item):
+        """Returns the id of the new lease on `item`, or None if someone else holds it."""
+        lease_path = self._lease_path(item)
+        lease = self._lease(item)
+        if _create_exclusive(lease_path, lease):
+            return lease['id']
+        current = _read_json(lease_path)
+        if current is None or 'id' not in current:
+            return None
+        # A lease in our name that we don't hold was left by an earlier run with the same --node-id
+        leftover = current['node'] == self.node_id and current['id'] not in self._held.values()
+        if not leftover and not self._expired(current):
+            return None
+        # Expired: the one node that creates the token for this very lease replaces it.
+        # Owners never rewrite their lease, so nothing else can change it meanwhile.
+        token = lease_path.with_name(f"{lease_path.name}.{current['id']}.reclaim")
+        if not _create_exclusive(token, {'node': self.node_id, 'reclaimed': time.time()}):
+            return None
+        _write_json_atomic(lease_path, lease)
+        print(f"Reclaiming {item} from {current['node']} (lease expired)")
+        return lease['id']
+
+    def claim(self):
+        """
+        Claim the next unfinished item that nobody holds.
+
+        Returns:
+            str: The item, or None if every remaining item is leased or done
+        """
+        # Leases are only valid while the heartbeat is fresh
+        self._beat()
+        for item in self.items:
+            if self._done_path(item).exists() or item in self._held:
+                continue
+            lease_id = self._acquire(item)
+            if lease_id is None:
+                continue
+            with self._lock:
+                self._held[item] = lease_id
+            # It may have been finished between the check above and the claim
+            if self._done_path(item).exists():
+                self.release(item)
+                continue
+            return item
+        return None
+
+    def _owns(self, item, lease_id):
+        lease = _read_json(self._lease_path(item))
+        return lease is not None and lease.get('id') == lease_id
+
+    def complete(self, item):
+        """Mark `item` finished and drop its lease."""
+        _create_exclusive(self._done_path(item), {'node': self.node_id, 'finished': time.time()})
+        self.release(item)
+
+    def release(self, item):
+        """Give up a claim without finishing it, so another node can take it."""
+        with self._lock:
+            lease_id = self._held.pop(item, None)
+        if lease_id is not None and self._owns(item, lease_id):
+            try:
+                os.unlink(self._lease_path(item))
+            except FileNotFoundError:
+                pass
+
+    def release_all(self):
+        """Release every claim this node still holds (on shutdown)."""
+        with self._lock:
+            held = list(self._held)
+        for item in held:
+            self.release(item)
+
+    def renew(self):
+        """Extend every lease this node holds by renewing its heartbeat."""
+        self._beat()
+        with self._lock:
+            held = list(self._held.items())
+        for item, lease_id in held:
+            if not self._owns(item, lease_id):
+                # Someone reclaimed it: we were too slow, the result may be computed twice
+                print(f"Lost the lease on {item}")
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except OSError as e:
+                print(f"Could not renew leases: {str(e)}")
+
+    def start_heartbeat(self):
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._renew_loop, name='ledger-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        # Leases still held then expire on their own
+        try:
+            os.unlink(self._heartbeat_path(self.node_id))
+        except FileNotFoundError:
+            pass
+
+    def done_count(self):
+        return sum(1 for item in self.items if self._done_path(item).exists())
+
+    def all_done(self):
+        return self.done_count() == len(self.items)
+
+    def status(self):
+        leases = [_read_json(path) for path in self.leases_dir.glob('*.lease')]
+        leases = [lease for lease in leases if lease is not None]
+        return {
+            'items': len(self.items),
+            'done': self.done_count(),
+            'leased': len(leases),
+            'nodes': sorted({lease['node'] for lease in leases}),
+        }
+
+    def summary_path(self, node_id=None):
+        return self.directory / f"summary.{node_id or self.node_id}.jsonl"
+
+    def add_results(self, results):
+        """Append the results of one item to this node's summary (one line per image)."""
+        if results:
+            _append_jsonl(self.summary_path(), results)
+
+    def merged_results(self):
+        """
+        All nodes' results, one per image (an item processed twice after a
+        lost lease keeps the later result).
+        """
+        merged = {}
+        for path in sorted(self.directory.glob('summary.*.jsonl'), key=lambda p: p.stat().st_mtime):
+            for results in _read_jsonl(path):
+                source = results.get('source') or {}
+                merged[(results['image_name'], source.get('timestamp'))] = results
+        return list(merged.values())
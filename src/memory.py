@@ -0,0 +1,277 @@
+"""
+Per-stage memory accounting for the processing pipeline.
+
+Works like src.timing: stages are opened with ``stage(name)`` and are free
+while no MemoryTracker is active. An active tracker records RSS before and
+after every stage, samples the peak RSS while the stage runs, and (optionally)
+diffs tracemalloc snapshots to find the largest allocations of each stage.
+"""
+import json
+import os
+import sys
+import threading
+import tracemalloc
+
+_active_tracker = None
+
+
+def current_rss():
+    """Return the resident set size of this process in bytes (0 if it cannot be determined)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the lifetime peak (KB on Linux, bytes on macOS), the best we can do here
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+def format_bytes(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024 or unit == 'GB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{value} B"
+        value /= 1024
+
+
+def parse_bytes(value):
+    """Parse a size such as '8G', '512MB' or '1.5g' (binary units) into bytes."""
+    text = str(value).strip().upper().rstrip('B').rstrip('I')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    multiplier = 1
+    if text and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError:
+        raise ValueError(f"Unrecognised size {value!r}; use e.g. 512M or 8G")
+    if size <= 0:
+        raise ValueError("Size must be positive")
+    return size
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, tracker, name, file):
+        self.tracker = tracker
+        self.name = name
+        self.file = file
+        self.rss_before = 0
+        self.peak_rss = 0
+        self.snapshot = None
+
+    def __enter__(self):
+        self.tracker._enter(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracker._exit(self)
+        return False
+
+
+def _new_stage_stats():
+    return {
+        'count': 0,
+        'peak_rss': 0,
+        'max_growth': 0,
+        'total_growth': 0,
+    }
+
+
+class MemoryTracker:
+    """
+    Records RSS and (optionally) tracemalloc statistics per stage and per file.
+
+    Args:
+        trace_allocations (bool): Start tracemalloc and diff snapshots around every
+            stage to find the largest allocations. Slows processing noticeably.
+        sample_interval (float): Seconds between RSS samples while a stage is open.
+        top_allocations (int): How many of the largest allocation sites to keep.
+    """
+
+    def __init__(self, trace_allocations=False, sample_interval=0.005, top_allocations=10):
+        self.trace_allocations = trace_allocations
+        self.sample_interval = sample_interval
+        self.top_allocations = top_allocations
+        self.stages = {}        # stage name -> aggregated statistics
+        self.files = {}         # file name -> per-file record
+        self.allocations = []   # largest allocation sites seen in any stage
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='memory-sampler', daemon=True)
+        self._sampler.start()
+        self._started_tracemalloc = False
+        self._traced = None     # final tracemalloc (current, peak), kept by close()
+        self.closed = False
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            self._started_tracemalloc = True
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                for open_stage in self._open:
+                    open_stage.peak_rss = max(open_stage.peak_rss, rss)
+
+    def _enter(self, stage):
+        rss = current_rss()
+        stage.rss_before = rss
+        stage.peak_rss = rss
+        if self.trace_allocations:
+            stage.snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self._open.append(stage)
+
+    def _exit(self, stage):
+        rss_after = current_rss()
+        with self._lock:
+            self._open.remove(stage)
+            stage.peak_rss = max(stage.peak_rss, rss_after)
+            self.peak_rss = max(self.peak_rss, stage.peak_rss)
+
+            stats = self.stages.setdefault(stage.name, _new_stage_stats())
+            growth = rss_after - stage.rss_before
+            stats['count'] += 1
+            stats['peak_rss'] = max(stats['peak_rss'], stage.peak_rss)
+            stats['max_growth'] = max(stats['max_growth'], stage.peak_rss - stage.rss_before)
+            stats['total_growth'] += growth
+
+            if stage.file is not None:
+                self.files[stage.file] = {
+                    'rss_before': stage.rss_before,
+                    'rss_after': rss_after,
+                    'peak_rss': stage.peak_rss,
+                }
+
+        if stage.snapshot is not None:
+            self._record_allocations(stage)
+
+    def _record_allocations(self, stage):
+        after = tracemalloc.take_snapshot()
+        differences = after.compare_to(stage.snapshot, 'lineno')
+        stage.snapshot = None
+        with self._lock:
+            for diff in differences[:self.top_allocations]:
+                if diff.size_diff <= 0:
+                    continue
+                frame = diff.traceback[0]
+                self.allocations.append({
+                    'stage': stage.name,
+                    'file': stage.file,
+                    'location': f"{frame.filename}:{frame.lineno}",
+                    'size': diff.size_diff,
+                    'count': diff.count_diff,
+                })
+            self.allocations.sort(key=lambda a: a['size'], reverse=True)
+            del self.allocations[self.top_allocations:]
+
+    def stage(self, name, file=None):
+        return _Stage(self, name, file)
+
+    def drain(self):
+        """Remove and return the stage, file and allocation records collected so far (see merge())."""
+        with self._lock:
+            part = {'peak_rss': self.peak_rss, 'stages': self.stages, 'files': self.files,
+                    'allocations': self.allocations}
+            self.stages, self.files, self.allocations = {}, {}, []
+        return part
+
+    def merge(self, part):
+        """Add records drained from the tracker of another process, e.g. the isolated worker."""
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, part['peak_rss'])
+            for name, other in part['stages'].items():
+                stats = self.stages.setdefault(name, _new_stage_stats())
+                stats['count'] += other['count']
+                stats['peak_rss'] = max(stats['peak_rss'], other['peak_rss'])
+                stats['max_growth'] = max(stats['max_growth'], other['max_growth'])
+                stats['total_growth'] += other['total_growth']
+            self.files.update(part['files'])
+            self.allocations = sorted(self.allocations + part['allocations'], key=lambda a: a['size'],
+                                      reverse=True)[:self.top_allocations]
+
+    def report(self):
+        """Return the collected statistics as a JSON-serialisable dictionary."""
+        with self._lock:
+            report = {
+                'start_rss': self.start_rss,
+                'current_rss': current_rss(),
+                'peak_rss': self.peak_rss,
+                'stages': {name: dict(stats) for name, stats in self.stages.items()},
+                'files': dict(self.files),
+                'largest_allocations': list(self.allocations),
+            }
+        if self.trace_allocations and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report['tracemalloc'] = {'current': current, 'peak': peak}
+        elif self._traced:
+            report['tracemalloc'] = {'current': self._traced[0], 'peak': self._traced[1]}
+        return report
+
+    def write_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+    def close(self):
+        """Stop the sampler thread and the tracemalloc this tracker started; report() keeps working."""
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        self._sampler.join(timeout=1)
+        if self.trace_allocations and tracemalloc.is_tracing():
+            self._traced = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        if get_active_tracker() is self:
+            set_active_tracker(None)
+
+
+def set_active_tracker(tracker):
+    """Make `tracker` receive all stages opened via stage(); pass None to disable tracking."""
+    global _active_tracker
+    _active_tracker = tracker
+
+
+def get_active_tracker():
+    return _active_tracker
+
+
+def stage(name, file=None):
+    """
+    Open a memory accounting stage on the active tracker.
+
+    Usage:
+        with stage('face_detection'):
+            ...
+    """
+    tracker = _active_tracker
+    if tracker is None:
+        return NULL_STAGE
+    return tracker.stage(name, file)
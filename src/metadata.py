@@ -0,0 +1,439 @@
+"""
+Fast metadata pre-pass that reads only file headers, never pixel data.
+
+Supports the EXIF block of JPEG and PNG files, the TIFF structure used by
+most RAW formats (NEF, ARW, CR2, DNG, ORF, RW2, PEF, SRW), the CMT boxes of
+Canon CR3 files, and XMP ratings (embedded in JPEGs or in a .xmp sidecar
+next to the file). Only the IFD entries that are needed are read, so even
+large RAW files cost a few small reads.
+
+The metadata is used to order work by capture time, filter images cheaply
+(rating, time window) and group burst sequences.
+"""
+import os
+import re
+import struct
+from datetime import datetime, time as day_time
+from pathlib import Path
+
+from . import settings
+
+# Tags read from IFD0 (and the further IFDs of RAW files)
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_SUB_IFDS = 0x014A
+TAG_RATING = 0x4746
+TAG_EXIF_IFD = 0x8769
+
+# Tags read from the Exif IFD
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_FOCAL_LENGTH = 0x920A
+TAG_IMAGE_NUMBER = 0x9211
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_EXIF_IMAGE_WIDTH = 0xA002
+TAG_EXIF_IMAGE_HEIGHT = 0xA003
+
+IFD0_TAGS = {TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH, TAG_MAKE, TAG_MODEL, TAG_ORIENTATION,
+             TAG_DATETIME, TAG_SUB_IFDS, TAG_RATING, TAG_EXIF_IFD}
+EXIF_TAGS = {TAG_EXPOSURE_TIME, TAG_F_NUMBER, TAG_ISO, TAG_DATETIME_ORIGINAL, TAG_FOCAL_LENGTH,
+             TAG_IMAGE_NUMBER, TAG_SUBSEC_ORIGINAL, TAG_EXIF_IMAGE_WIDTH, TAG_EXIF_IMAGE_HEIGHT}
+
+# Bytes per value for each TIFF field type
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TYPE_FORMATS = {3: 'H', 4: 'I', 8: 'h', 9: 'i', 11: 'f', 12: 'd', 13: 'I'}
+
+CR3_UUID = bytes.fromhex('85c0b687820f11e08111f4ce462b6a48')
+XMP_RATING = re.compile(rb'xmp:Rating(?:="|>)\s*(-?\d+)')
+
+MAX_IFD_ENTRIES = 1000
+MAX_RAW_IFDS = 8
+
+
+class _TiffReader:
+    """Reads selected IFD entries of a TIFF structure starting at `base` in an open file."""
+
+    def __init__(self, f, base=0):
+        self.f = f
+        self.base = base
+        f.seek(base)
+        header = f.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            raise ValueError("Not a TIFF structure")
+        self.endian = '<' if header[:2] == b'II' else '>'
+        # The magic number is 42 for TIFF, but ORF ('RO'/'RS') and RW2 (0x55) use their own
+        self.first_ifd = struct.unpack(self.endian + 'I', header[4:8])[0]
+
+    def _unpack(self, fmt, data):
+        return struct.unpack(self.endian + fmt, data)
+
+    def read_ifd(self, offset, wanted):
+        """
+        Return ({tag: value}, next IFD offset) for the tags in `wanted`.
+        Offsets are relative to the TIFF header, as stored in the file.
+        """
+        f = self.f
+        f.seek(self.base + offset)
+        count_data = f.read(2)
+        if len(count_data) < 2:
+            return {}, 0
+        count = self._unpack('H', count_data)[0]
+        if count > MAX_IFD_ENTRIES:
+            return {}, 0
+        entries = f.read(count * 12)
+        next_data = f.read(4)
+        next_ifd = self._unpack('I', next_data)[0] if len(next_data) == 4 else 0
+
+        values = {}
+        for i in range(len(entries) // 12):
+            tag, field_type, value_count = self._unpack('HHI', entries[i * 12:i * 12 + 8])
+            if tag not in wanted or field_type not in TYPE_SIZES:
+                continue
+            size = TYPE_SIZES[field_type] * value_count
+            raw = entries[i * 12 + 8:i * 12 + 12]
+            if size > 4:
+                f.seek(self.base + self._unpack('I', raw)[0])
+                raw = f.read(min(size, 4096))
+            values[tag] = self._decode(field_type, value_count, raw)
+        return values, next_ifd
+
+    def _decode(self, field_type, count, raw):
+        if field_type == 2:
+            return raw[:count].split(b'\0', 1)[0].decode('ascii', 'replace').strip()
+        if field_type in (5, 10):
+            fmt = 'I' if field_type == 5 else 'i'
+            pairs = [self._unpack(fmt * 2, raw[i:i + 8]) for i in range(0, min(len(raw), count * 8), 8)]
+            numbers = [num / den if den else 0.0 for num, den in pairs]
+        elif field_type in TYPE_FORMATS:
+            fmt = TYPE_FORMATS[field_type]
+            size = TYPE_SIZES[field_type]
+            usable = min(count, len(raw) // size)
+            numbers = list(self._unpack(fmt * usable, raw[:usable * size]))
+        else:
+            numbers = list(raw[:count])
+        return numbers[0] if len(numbers) == 1 else numbers
+
+
+def _parse_datetime(value, subsec=None):
+    try:
+        captured = datetime.strptime(value.strip(), '%Y:%m:%d %H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+    if subsec:
+        digits = ''.join(c for c in str(subsec) if c.isdigit())[:6]
+        if digits:
+            captured = captured.replace(microsecond=int(digits.ljust(6, '0')))
+    return captured
+
+
+def _read_tiff(f, base, info, exif_only=False):
+    """Read IFD0 (plus the Exif IFD and the further RAW IFDs) of a TIFF structure into `info`."""
+    reader = _TiffReader(f, base)
+    if exif_only:
+        # CR3 CMT2 boxes hold the Exif IFD directly
+        exif, _ = reader.read_ifd(reader.first_ifd, EXIF_TAGS)
+        info['_exif'].update(exif)
+        return
+
+    ifd0, next_ifd = reader.read_ifd(reader.first_ifd, IFD0_TAGS)
+    info['_ifd0'].update(ifd0)
+    if TAG_EXIF_IFD in ifd0:
+        exif, _ = reader.read_ifd(ifd0[TAG_EXIF_IFD], EXIF_TAGS)
+        info['_exif'].update(exif)
+
+    # RAW files keep the full resolution image in a later IFD or a SubIFD
+    sizes = [(ifd0.get(TAG_IMAGE_WIDTH), ifd0.get(TAG_IMAGE_LENGTH))]
+    pending = [next_ifd]
+    sub_ifds = ifd0.get(TAG_SUB_IFDS)
+    if sub_ifds:
+        pending.extend(sub_ifds if isinstance(sub_ifds, list) else [sub_ifds])
+    for offset in pending[:MAX_RAW_IFDS]:
+        if not offset:
+            continue
+        ifd, _ = reader.read_ifd(offset, {TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH})
+        sizes.append((ifd.get(TAG_IMAGE_WIDTH), ifd.get(TAG_IMAGE_LENGTH)))
+    info['_sizes'].extend(sizes)
+
+
+def _read_jpeg(f, info):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return
+        if byte != b'\xff':
+            continue
+        marker = f.read(1)
+        while marker == b'\xff':
+            marker = f.read(1)
+        if not marker:
+            return
+        code = marker[0]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA):
+            # End of image / start of scan: no more headers
+            return
+        length_data = f.read(2)
+        if len(length_data) < 2:
+            return
+        length = struct.unpack('>H', length_data)[0]
+        if length < 2:
+            # The length counts its own two bytes; anything less is a corrupt header
+            return
+        segment_start = f.tell()
+        if code == 0xE1:
+            head = f.read(min(length - 2, 64))
+            if head.startswith(b'Exif\0\0'):
+                _read_tiff(f, segment_start + 6, info)
+            elif head.startswith(b'http://ns.adobe.com/xap/1.0/'):
+                f.seek(segment_start)
+                _read_xmp_rating(f.read(length - 2), info)
+        elif 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC) and length >= 7:
+            height, width = struct.unpack('>xHH', f.read(5))
+            info['_sizes'].append((width, height))
+        f.seek(segment_start + length - 2)
+
+
+def _read_png(f, info):
+    f.seek(8)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        data_start = f.tell()
+        if chunk_type == b'IHDR':
+            width, height = struct.unpack('>II', f.read(8))
+            info['_sizes'].append((width, height))
+        elif chunk_type == b'eXIf':
+            _read_tiff(f, data_start, info)
+        elif chunk_type == b'IDAT':
+            return
+        f.seek(data_start + length + 4)
+
+
+def _iter_boxes(f, start, end):
+    """Yield (type, data start, box end) for the ISO BMFF boxes between start and end."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header:
+            return
+        yield box_type, position + header, position + size
+        position += size
+
+
+def _read_cr3(f, info):
+    end = f.seek(0, os.SEEK_END)
+    for box_type, data_start, box_end in _iter_boxes(f, 0, end):
+        if box_type != b'moov':
+            continue
+        for child_type, child_start, child_end in _iter_boxes(f, data_start, box_end):
+            if child_type != b'uuid':
+                continue
+            f.seek(child_start)
+            if f.read(16) != CR3_UUID:
+                continue
+            for cmt_type, cmt_start, _ in _iter_boxes(f, child_start + 16, child_end):
+                if cmt_type == b'CMT1':
+                    _read_tiff(f, cmt_start, info)
+                elif cmt_type == b'CMT2':
+                    _read_tiff(f, cmt_start, info, exif_only=True)
+        return
+
+
+def _read_xmp_rating(data, info):
+    match = XMP_RATING.search(data)
+    if match:
+        info['_xmp_rating'] = int(match.group(1))
+
+
+def read_metadata(path):
+    """
+    Read capture metadata from the headers of an image file.
+
+    Args:
+        path (str): Path to a JPEG, PNG or RAW file
+
+    Returns:
+        dict: 'capture_time' (ISO string), 'timestamp' (seconds, used for
+              sorting), 'time_source' ('exif' or 'mtime'), 'rating', 'make',
+              'model', 'focal_length', 'exposure_time', 'f_number', 'iso',
+              'orientation', 'image_number', 'width' and 'height' (None when unknown)
+    """
+    path = Path(path)
+    info = {'_ifd0': {}, '_exif': {}, '_sizes': []}
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            if head.startswith(b'\xff\xd8'):
+                _read_jpeg(f, info)
+            elif head.startswith(b'\x89PNG'):
+                _read_png(f, info)
+            elif head[4:8] == b'ftyp':
+                _read_cr3(f, info)
+            elif head[:2] in (b'II', b'MM'):
+                _read_tiff(f, 0, info)
+    except (OSError, ValueError, struct.error):
+        # Unreadable or unusual headers just mean less metadata
+        pass
+
+    # Sidecars written by Lightroom / Bridge / Capture One take precedence for ratings
+    sidecar = path.with_suffix('.xmp')
+    if sidecar.exists():
+        try:
+            _read_xmp_rating(sidecar.read_bytes(), info)
+        except OSError:
+            pass
+
+    ifd0, exif = info['_ifd0'], info['_exif']
+    captured = _parse_datetime(exif.get(TAG_DATETIME_ORIGINAL), exif.get(TAG_SUBSEC_ORIGINAL)) \
+        or _parse_datetime(ifd0.get(TAG_DATETIME))
+    if captured is not None:
+        timestamp = captured.timestamp()
+        time_source = 'exif'
+    else:
+        try:
+            timestamp = path.stat().st_mtime
+        except OSError:
+            timestamp = 0.0
+        captured = datetime.fromtimestamp(timestamp)
+        time_source = 'mtime'
+
+    sizes = [(w, h) for w, h in info['_sizes'] + [(exif.get(TAG_EXIF_IMAGE_WIDTH), exif.get(TAG_EXIF_IMAGE_HEIGHT))]
+             if isinstance(w, int) and isinstance(h, int) and w > 0 and h > 0]
+    width, height = max(sizes, key=lambda size: size[0] * size[1]) if sizes else (None, None)
+
+    rating = info.get('_xmp_rating', ifd0.get(TAG_RATING))
+    return {
+        'capture_time': captured.isoformat(),
+        'timestamp': timestamp,
+        'time_source': time_source,
+        'rating': rating if isinstance(rating, int) else None,
+        'make': ifd0.get(TAG_MAKE) or None,
+        'model': ifd0.get(TAG_MODEL) or None,
+        'focal_length': exif.get(TAG_FOCAL_LENGTH) if isinstance(exif.get(TAG_FOCAL_LENGTH), float) else None,
+        'exposure_time': exif.get(TAG_EXPOSURE_TIME) if isinstance(exif.get(TAG_EXPOSURE_TIME), float) else None,
+        'f_number': exif.get(TAG_F_NUMBER) if isinstance(exif.get(TAG_F_NUMBER), float) else None,
+        'iso': exif.get(TAG_ISO) if isinstance(exif.get(TAG_ISO), int) else None,
+        'orientation': ifd0.get(TAG_ORIENTATION) if isinstance(ifd0.get(TAG_ORIENTATION), int) else None,
+        'image_number': exif.get(TAG_IMAGE_NUMBER) if isinstance(exif.get(TAG_IMAGE_NUMBER), int) else None,
+        'width': width,
+        'height': height,
+    }
+
+
+def parse_time_bound(value):
+    """
+    Parse a --after/--before value: 'YYYY-MM-DD HH:MM[:SS]' is an absolute
+    moment, 'HH:MM[:SS]' a time of day on any date.
+    """
+    value = value.strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised time {value!r}; use 'YYYY-MM-DD HH:MM' or 'HH:MM'")
+
+
+class MetadataFilter:
+    """
+    Cheap filters evaluated on header metadata before any image is decoded.
+
+    Args:
+        skip_ratings (iterable): Ratings to skip (e.g. {1} for rejects rated one star)
+        min_rating (int): Skip images rated below this; unrated images are kept
+        after (datetime or time): Skip images captured before this moment / time of day
+        before (datetime or time): Skip images captured after this moment / time of day
+    """
+
+    def __init__(self, skip_ratings=(), min_rating=None, after=None, before=None):
+        self.skip_ratings = set(skip_ratings or ())
+        self.min_rating = min_rating
+        self.after = after
+        self.before = before
+
+    def accepts(self, metadata):
+        rating = metadata.get('rating')
+        if rating is not None:
+            if rating in self.skip_ratings:
+                return False
+            if self.min_rating is not None and rating < self.min_rating:
+                return False
+        if self.after is not None or self.before is not None:
+            captured = datetime.fromisoformat(metadata['capture_time'])
+            if not self._within(captured):
+                return False
+        return True
+
+    def _within(self, captured):
+        for bound, is_after in ((self.after, True), (self.before, False)):
+            if bound is None:
+                continue
+            value = captured.time() if isinstance(bound, day_time) else captured
+            if (value < bound) if is_after else (value > bound):
+                return False
+        return True
+
+
+def assign_bursts(entries, max_gap=None):
+    """
+    Group time-ordered (path, metadata) entries into bursts: consecutive frames
+    from the same camera less than `max_gap` seconds apart. Adds 'burst_id' and
+    'burst_index' to each metadata dict.
+    """
+    max_gap = settings.burst_max_gap if max_gap is None else max_gap
+    burst_id = -1
+    previous = None
+    index = 0
+    for _, metadata in entries:
+        same_burst = (
+            previous is not None
+            and metadata['time_source'] == 'exif' and previous['time_source'] == 'exif'
+            and metadata.get('model') == previous.get('model')
+            and 0 <= metadata['timestamp'] - previous['timestamp'] <= max_gap
+        )
+        if same_burst:
+            index += 1
+        else:
+            burst_id += 1
+            index = 0
+        metadata['burst_id'] = burst_id
+        metadata['burst_index'] = index
+        previous = metadata
+    return entries
+
+
+def prepare_files(paths, metadata_filter=None):
+    """
+    Metadata pre-pass for a batch of files: read headers, drop filtered files,
+    sort by capture time (then name) and assign bursts.
+
+    Returns:
+        tuple: (list of (path, metadata) in processing order, number of files filtered out)
+    """
+    entries = [(Path(path), read_metadata(path)) for path in paths]
+    kept = [entry for entry in entries if metadata_filter is None or metadata_filter.accepts(entry[1])]
+    kept.sort(key=lambda entry: (entry[1]['timestamp'], entry[0].name))
+    assign_bursts(kept)
+    return kept, len(entries) - len(kept)
@@ -0,0 +1,184 @@
+"""
+Local model store: every model file is loaded from settings.models_dir.
+
+Files with a download URL (settings.model_downloads) are fetched by
+`main models prefetch` rather than lazily by ultralytics or DeepFace, so an
+air-gapped machine can be prepared by copying the models directory.
+models/manifest.json pins the SHA-256 of every file, either from
+settings.model_checksums or from its first download or use. A file is hashed
+the first time it is loaded. After that, only its size and modification time
+are compared with the cache in models/.verified.json, so startup stays fast.
+"""
+import hashlib
+import json
+import os
+import urllib.request
+from pathlib import Path
+
+from . import settings
+
+MANIFEST_NAME = 'manifest.json'
+VERIFIED_NAME = '.verified.json'
+REPO_ROOT = Path(__file__).resolve().parent.parent
+# DeepFace looks for its weights in $DEEPFACE_HOME/.deepface/weights
+DEEPFACE_EMOTION_WEIGHTS = 'deepface/.deepface/weights/facial_expression_model_weights.h5'
+
+
+class ChecksumMismatch(ValueError):
+    """A model file differs from the checksum pinned in the manifest."""
+
+
+def models_dir():
+    # Relative to the repository, so every entry point finds the same store whatever the working directory
+    return (REPO_ROOT / settings.models_dir).resolve()
+
+
+def known_files():
+    """Every model file the backends may load, relative to the models directory."""
+    files = list(settings.model_downloads)
+    files += list(settings.onnx_models.values()) + list(settings.onnx_quantized_models.values())
+    files += list(settings.face_dnn_files.values())
+    return list(dict.fromkeys(files))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read(name):
+    try:
+        with open(models_dir() / name) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(name, data):
+    path = models_dir() / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def pinned_checksum(file_name):
+    """The expected SHA-256 of a file: from settings, else from the manifest, else None."""
+    return settings.model_checksums.get(file_name) or _read(MANIFEST_NAME).get(file_name, {}).get('sha256')
+
+
+def pin(file_name, sha256=None):
+    """Record the checksum of a file in the manifest (e.g. after re-exporting a model)."""
+    path = models_dir() / file_name
+    sha256 = sha256 or file_sha256(path)
+    manifest = _read(MANIFEST_NAME)
+    manifest[file_name] = {'sha256': sha256, 'size': path.stat().st_size}
+    _write(MANIFEST_NAME, manifest)
+    _remember_verified(file_name, path, sha256)
+    return sha256
+
+
+def _remember_verified(file_name, path, sha256):
+    stat = path.stat()
+    verified = _read(VERIFIED_NAME)
+    verified[file_name] = {'sha256': sha256, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    _write(VERIFIED_NAME, verified)
+
+
+def fetch(file_name, force=False):
+    """
+    Download a file listed in settings.model_downloads into the models directory.
+
+    The download is hashed while it streams and only moved into place if it
+    matches the pinned checksum (or pinned now, when there is none yet).
+
+    Returns:
+        Path: Local path of the file
+    """
+    url = settings.model_downloads.get(file_name)
+    if not url:
+        raise FileNotFoundError(f"{file_name} has no download URL; create it locally in {models_dir()}")
+    path = models_dir() / file_name
+    if path.is_file() and not force:
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.part")
+    digest = hashlib.sha256()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as response, open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: response.read(1 << 20), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        expected = pinned_checksum(file_name)
+        if expected and digest.hexdigest() != expected:
+            raise ChecksumMismatch(f"Download of {file_name} has SHA-256 {digest.hexdigest()}, expected {expected}")
+        if not expected:
+            print(f"Warning: {file_name} has no checksum in settings.model_checksums; pinning the downloaded "
+                  f"SHA-256 {digest.hexdigest()} (compare it with the one published upstream)")
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    pin(file_name, digest.hexdigest())
+    return path
+
+
+def check(file_name, use_cache=True):
+    """
+    Compare a local file with its pinned checksum.
+
+    Returns:
+        str: 'ok', 'missing', 'unpinned' (present but no checksum yet) or 'mismatch'
+    """
+    path = models_dir() / file_name
+    if not path.is_file():
+        return 'missing'
+    expected = pinned_checksum(file_name)
+    if use_cache and expected:
+        stat = path.stat()
+        cached = _read(VERIFIED_NAME).get(file_name)
+        if cached and cached == {'sha256': expected, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}:
+            return 'ok'
+    if not expected:
+        return 'unpinned'
+    sha256 = file_sha256(path)
+    if sha256 != expected:
+        return 'mismatch'
+    _remember_verified(file_name, path, sha256)
+    return 'ok'
+
+
+def resolve(file_name):
+    """
+    Local, verified path of a model file; used by every backend to load its model.
+
+    A missing file is downloaded when settings.model_auto_fetch allows it. A
+    file without a pinned checksum is pinned on first use.
+
+    Raises:
+        FileNotFoundError: If the file is missing and can't be fetched
+        ChecksumMismatch: If the file doesn't match its pinned checksum
+    """
+    path = models_dir() / file_name
+    if not path.is_file():
+        if not (settings.model_auto_fetch and file_name in settings.model_downloads):
+            raise FileNotFoundError(f"Model file {path} not found; run `python3 -m main models prefetch` "
+                                    f"(or copy the models directory from a prepared machine)")
+        print(f"Downloading {file_name} into {models_dir()}")
+        return fetch(file_name)
+    status = check(file_name)
+    if status == 'unpinned':
+        pin(file_name)
+    elif status == 'mismatch':
+        raise ChecksumMismatch(f"{path} doesn't match the checksum in {MANIFEST_NAME}; "
+                               f"re-fetch it, or accept it with `python3 -m main models verify --accept`")
+    return path
+
+
+def deepface_home():
+    """DEEPFACE_HOME under which the emotion weights are stored in the models directory."""
+    return models_dir() / 'deepface'
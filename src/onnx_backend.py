@@ -0,0 +1,221 @@
+"""
+ONNX Runtime (CPU) backends for object detection and emotion classification.
+
+They need only onnxruntime, OpenCV and NumPy, so a run that selects them
+never imports PyTorch or TensorFlow. The models are exported once with
+`main models export` (see export()):
+
+    yolov8n.pt through ultralytics' exporter          -> models/yolov8n.onnx
+    DeepFace's emotion CNN with its .h5 weights, tf2onnx -> models/emotion.onnx
+
+File names and session options are in settings (onnx_models,
+onnx_graph_optimization, onnx_threads). The '_int8' variants load the
+statically quantized models built by src.quantize.
+"""
+import ast
+import os
+
+from . import settings
+from . import resources
+from . import model_store
+from .timing import span
+
+# Output order of DeepFace's emotion model (FER-2013 classes)
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+
+
+def model_path(stage, quantized=False, must_exist=True):
+    """Local path of the (float or int8) ONNX model for `stage`."""
+    names = settings.onnx_quantized_models if quantized else settings.onnx_models
+    path = model_store.models_dir() / names[stage]
+    if must_exist and not path.is_file():
+        if quantized:
+            raise FileNotFoundError(f"Quantized {stage} model not found at {path}; build it with `main quantize calibrate`")
+        raise FileNotFoundError(f"ONNX model for {stage} not found at {path}; create it with `main models export`")
+    return model_store.resolve(names[stage]) if must_exist else path
+
+
+def _deepface_emotion_model():
+    """DeepFace's emotion CNN (Keras) with the verified weights from the models directory."""
+    os.environ['DEEPFACE_HOME'] = str(model_store.deepface_home())
+    weights = model_store.resolve(model_store.DEEPFACE_EMOTION_WEIGHTS)
+    # DeepFace ships only the weights; its loader builds the architecture they belong to
+    try:
+        from deepface.models.demography.Emotion import load_model
+    except ImportError:
+        try:
+            from deepface.extendedmodels.Emotion import load_model
+        except ImportError:
+            from deepface.extendedmodels.Emotion import loadModel as load_model
+    model = load_model()
+    model.load_weights(str(weights))
+    return model
+
+
+def export(stage):
+    """
+    Export the float ONNX model of a stage into the models directory and pin
+    its checksum (needs ultralytics for 'object', DeepFace and tf2onnx for
+    'emotion').
+
+    Returns:
+        Path: The exported model
+    """
+    path = model_path(stage, must_exist=False)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if stage == 'object':
+        from ultralytics import YOLO
+        exported = YOLO(str(model_store.resolve('yolov8n.pt'))).export(format='onnx')
+        os.replace(exported, path)
+    elif stage == 'emotion':
+        import tensorflow as tf
+        import tf2onnx
+        model = _deepface_emotion_model()
+        # NHWC like Keras, with a free batch dimension for the quantization calibration
+        signature = (tf.TensorSpec((None, 48, 48, 1), tf.float32, name='input'),)
+        tf2onnx.convert.from_keras(model, input_signature=signature, output_path=str(path))
+    else:
+        raise ValueError(f"No ONNX model for the {stage} stage")
+    model_store.pin(settings.onnx_models[stage])
+    return path
+
+
+def create_session(path):
+    """An ONNX Runtime CPU session with the configured graph optimization and thread budget."""
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = {
+        'disabled': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[settings.onnx_graph_optimization]
+    threads = settings.onnx_threads
+    if threads is None and resources.get_config() is not None:
+        threads = resources.get_config()['threads_per_worker']
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    with span('model_load'):
+        return ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+
+def letterbox(image, size):
+    """Resize keeping the aspect ratio and pad to size x size; returns (image, scale, (pad_x, pad_y))."""
+    import cv2
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    resized_width, resized_height = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(image, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - resized_width) // 2, (size - resized_height) // 2
+    padded = cv2.copyMakeBorder(resized, pad_y, size - resized_height - pad_y, pad_x, size - resized_width - pad_x,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, scale, (pad_x, pad_y)
+
+
+def decode_yolo(output, scale, pad, image_shape, names, confidence=None, iou=None):
+    """
+    Turn the raw YOLOv8 output (1, 4 + classes, anchors) into detections,
+    with per-class non-maximum suppression like ultralytics.
+    """
+    import cv2
+    import numpy as np
+    confidence = settings.object_confidence if confidence is None else confidence
+    iou = settings.object_iou if iou is None else iou
+    predictions = output[0].T
+    class_scores = predictions[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_ids)), class_ids]
+    keep = scores >= confidence
+    boxes, scores, class_ids = predictions[keep, :4], scores[keep], class_ids[keep]
+    if not len(scores):
+        return []
+
+    # Center/size on the letterboxed input -> corners on the original image
+    height, width = image_shape[:2]
+    x1 = np.clip((boxes[:, 0] - boxes[:, 2] / 2 - pad[0]) / scale, 0, width)
+    y1 = np.clip((boxes[:, 1] - boxes[:, 3] / 2 - pad[1]) / scale, 0, height)
+    x2 = np.clip((boxes[:, 0] + boxes[:, 2] / 2 - pad[0]) / scale, 0, width)
+    y2 = np.clip((boxes[:, 1] + boxes[:, 3] / 2 - pad[1]) / scale, 0, height)
+    rects = np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
+    indices = cv2.dnn.NMSBoxesBatched(rects.tolist(), scores.tolist(), class_ids.tolist(), confidence, iou)
+
+    detections = []
+    for i in sorted(np.array(indices).flatten(), key=lambda i: -scores[i]):
+        detections.append({
+            'label': names[int(class_ids[i])],
+            'confidence': float(scores[i]),
+            'box': (int(x1[i]), int(y1[i]), int(x2[i]), int(y2[i]))
+        })
+    return detections
+
+
+class OnnxObjectDetector:
+    """Object backend (see src.backends) running an exported YOLOv8 model in ONNX Runtime."""
+    quantized = False
+
+    def load(self):
+        self.session = create_session(model_path('object', self.quantized))
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 640
+        # ultralytics stores the class names in the model metadata
+        names = self.session.get_modelmeta().custom_metadata_map.get('names')
+        if names:
+            names = ast.literal_eval(names)
+            self.names = [names[i] for i in sorted(names)]
+        else:
+            # COCO order, as listed in the object biases
+            self.names = [bias['name'] for bias in sorted(settings.image_raw_bias_settings, key=lambda b: b['id'])]
+
+    def preprocess(self, image):
+        """Letterboxed, normalized NCHW RGB blob; returns (blob, scale, pad)."""
+        import cv2
+        import numpy as np
+        padded, scale, pad = letterbox(image, self.size)
+        blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True).astype(np.float32)
+        return blob, scale, pad
+
+    def detect(self, image):
+        blob, scale, pad = self.preprocess(image)
+        with span('inference'):
+            output = self.session.run(None, {self.input_name: blob})[0]
+        return decode_yolo(output, scale, pad, image.shape, self.names)
+
+
+class OnnxEmotionClassifier:
+    """Emotion backend (see src.backends) running DeepFace's emotion CNN converted to ONNX."""
+    quantized = False
+
+    def load(self):
+        self.session = create_session(model_path('emotion', self.quantized))
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # tf2onnx keeps Keras' NHWC layout; accept NCHW exports too
+        self.channels_first = model_input.shape[1] == 1
+
+    def preprocess(self, face_img):
+        """48x48 grayscale batch of one face in the model's layout."""
+        import cv2
+        import numpy as np
+        gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.resize(gray, (48, 48), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+        return gray[np.newaxis, np.newaxis] if self.channels_first else gray[np.newaxis, :, :, np.newaxis]
+
+    def classify(self, face_img):
+        import numpy as np
+        batch = self.preprocess(face_img)
+        with span('inference'):
+            probabilities = self.session.run(None, {self.input_name: batch})[0][0]
+        return EMOTION_LABELS[int(np.argmax(probabilities))]
+
+
+class OnnxInt8ObjectDetector(OnnxObjectDetector):
+    """OnnxObjectDetector on the int8 model built by src.quantize."""
+    quantized = True
+
+
+class OnnxInt8EmotionClassifier(OnnxEmotionClassifier):
+    """OnnxEmotionClassifier on the int8 model built by src.quantize."""
+    quantized = True
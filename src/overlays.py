@@ -0,0 +1,181 @@
+"""
+Drawing of detection results onto images, shared by debug_data.py and the
+contact sheets.
+
+Results are streamed with iter_results() and drawn onto reduced-resolution
+decodes (load_working_image()); every draw_* function takes the `scale` that
+maps result coordinates onto the working image.
+"""
+import json
+import re
+from pathlib import Path
+
+from .image_loader import load_image, load_preview
+from .metadata import read_metadata
+
+POSE_CONNECTIONS = [
+    (0, 1), (1, 2), (2, 3), (3, 7), (0, 4), (4, 5), (5, 6), (6, 8),
+    (9, 10), (11, 12), (11, 13), (13, 15), (12, 14), (14, 16),
+    (11, 23), (12, 24), (23, 24), (23, 25), (24, 26), (25, 27), (26, 28), (27, 29), (28, 30), (29, 31), (30, 32)
+]
+
+
+def _scaled(point, scale):
+    return tuple(int(v * scale) for v in point)
+
+
+def draw_pose(image, pose_data, color=(0, 255, 0), scale=1.0):
+    import cv2
+    # Landmark id -> position, so each connection is two dict lookups
+    points = {landmark['landmark_id']: (int(landmark['x'] * scale), int(landmark['y'] * scale))
+              for landmark in pose_data}
+
+    for point in points.values():
+        cv2.circle(image, point, 5, color, -1)
+
+    for start_idx, end_idx in POSE_CONNECTIONS:
+        start, end = points.get(start_idx), points.get(end_idx)
+        if start and end:
+            cv2.line(image, start, end, color, 2)
+
+
+def draw_objects(image, objects, color=(255, 0, 0), scale=1.0):
+    import cv2
+    for obj in objects:
+        x1, y1, x2, y2 = _scaled(obj['box'], scale)
+        label = obj['label']
+        conf = obj['confidence']
+
+        cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+        text = f"{label} {conf:.2f}"
+        text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+        cv2.rectangle(image, (x1, y1 - text_size[1] - 10), (x1 + text_size[0], y1), color, -1)
+        cv2.putText(image, text, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+
+
+def draw_faces(image, faces, color=(0, 0, 255), scale=1.0):
+    import cv2
+    for face in faces:
+        x1, y1, x2, y2 = _scaled(face['box'], scale)
+        emotion = face['emotion']
+
+        # Determine the color based on quality
+        is_partial = face.get('is_partial', False)
+        face_quality = face.get('face_quality', 1.0)
+        face_completeness = face.get('face_completeness', 1.0)
+
+        if is_partial and face_completeness < 0.7:
+            # Red for badly partial faces
+            box_color = (0, 0, 255)  # Red
+        elif is_partial or face_quality < 0.7:
+            # Yellow for partial but mostly visible faces or low quality
+            box_color = (0, 255, 255)  # Yellow
+        else:
+            # Green for good quality faces
+            box_color = (0, 255, 0)  # Green
+
+        cv2.rectangle(image, (x1, y1), (x2, y2), box_color, 2)
+
+        # Draw face quality info
+        quality_text = f"{emotion}"
+        if is_partial:
+            quality_text += f" Q:{face_quality:.2f} P:{face_completeness:.2f}"
+        else:
+            quality_text += f" Q:{face_quality:.2f}"
+
+        text_size = cv2.getTextSize(quality_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+        cv2.rectangle(image, (x1, y2), (x1 + text_size[0], y2 + text_size[1] + 10), box_color, -1)
+        cv2.putText(image, quality_text, (x1, y2 + text_size[1] + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+
+
+def iter_results(path):
+    """
+    Yield results one at a time without loading them all.
+
+    Args:
+        path: summary.json (a JSON array, decoded object by object), a
+            progress.jsonl journal, or an output directory of *_results.json files
+    """
+    path = Path(path)
+    if path.is_dir():
+        for results_path in sorted(path.glob('*_results.json')):
+            with open(results_path) as f:
+                yield json.load(f)
+        return
+    if path.suffix == '.jsonl':
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                yield from entry.get('results', [entry])
+        return
+
+    decoder = json.JSONDecoder()
+    separators = re.compile(r'[\s,]*')
+    with open(path) as f:
+        buffer = f.read(1 << 16).lstrip()
+        if buffer.startswith('{'):
+            # A single result rather than a list
+            yield json.loads(buffer + f.read())
+            return
+        if not buffer.startswith('['):
+            raise ValueError(f"{path} is not a JSON list of results")
+        position = 1
+        while True:
+            position = separators.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                result, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The next result continues in the next chunk
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield result
+
+
+def full_size(image_path, results):
+    """
+    Width and height of the image the detections were made on.
+
+    Decoders apply the EXIF orientation, so for orientations 5-8 (rotated by
+    90 degrees) the header's width and height are swapped.
+
+    Returns:
+        tuple: (width, height), (None, None) when the headers don't tell
+    """
+    info = results.get('metadata') or {}
+    if not info.get('width') or 'orientation' not in info:
+        info = read_metadata(image_path)
+    width, height = info.get('width'), info.get('height')
+    if info.get('orientation') in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height
+
+
+def load_working_image(image_path, results, max_side):
+    """
+    Decode an image at reduced resolution for drawing.
+
+    JPEGs are decoded at reduced scale and RAW files use their embedded
+    preview, so nothing is developed at full resolution.
+
+    Returns:
+        tuple: (image, scale) where scale maps result coordinates onto the image
+    """
+    if not max_side:
+        return load_image(image_path), 1.0
+    width, _ = full_size(image_path, results)
+    image = load_preview(image_path, max_side)
+    if not width:
+        # Unknown original size: decode it fully once to get it
+        full = load_image(image_path)
+        width = full.shape[1]
+        image = load_preview(full, max_side)
+    return image, image.shape[1] / width
@@ -1,18 +1,30 @@
 import os
 import json
+import time
 from pathlib import Path
-import pandas as pd
 import warnings
-from .predict_pose import detect_multiple_poses
-from .predict_object import detect_objects
-from .predict_face import detect_faces
 from . import settings
+from . import timing
+from . import memory
+from . import metadata
+from . import scheduling
+from . import resources
+from . import backends
+from .budget import BudgetController
+from .image_loader import SUPPORTED_FORMATS, decode_raw, is_raw, load_image, prefetch
+from .admission import MemoryBudget, estimate_frame_bytes
+from .ledger import Ledger
+from .journal import JOURNAL_NAME, Journal
+from .scoring import ScoringEngine
+from .isolation import FileFailure, IsolatedWorker
+from .video import VIDEO_FORMATS, is_video
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, TimeRemainingColumn
 import logging
-import cv2
-import numpy as np
 import tempfile
-import time
+
+# The detectors pull in OpenCV, MediaPipe, ultralytics (torch) and DeepFace (TensorFlow).
+# They are imported by the stage that needs them so that importing this module,
+# `--help` and rescoring existing results stay fast.
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
@@ -29,229 +41,613 @@ def convert_raw_to_rgb(raw_path):
     """
     Convert RAW image formats (NEF, CR2, ARW, etc.) to a format readable by OpenCV.
     Returns the path to a temporary jpg file.
+    
+    The pipeline itself develops RAW files in memory with image_loader.decode_raw;
+    this is kept for tools that need a file on disk.
     """
-    try:
-        # Try using RawPy for RAW conversion
-        import rawpy
-        with rawpy.imread(raw_path) as raw:
-            rgb = raw.postprocess(use_camera_wb=True, half_size=False, no_auto_bright=False)
-            
-            # Create a temporary file to save the converted image
-            temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            temp_path = temp_file.name
-            temp_file.close()
-            
-            # Save the image
-            cv2.imwrite(temp_path, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
-            return temp_path
-    except (ImportError, Exception) as e:
-        # If RawPy fails or isn't installed, try LibRaw via dcraw
-        try:
-            import subprocess
-            temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
-            temp_path = temp_file.name
-            temp_file.close()
-            
-            # Use dcraw to convert the RAW file
-            subprocess.run(['dcraw', '-c', '-w', raw_path], stdout=open(temp_path, 'wb'))
-            
-            # Check if the file was created and has content
-            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-                return temp_path
-            else:
-                raise Exception("Failed to convert RAW image with dcraw")
-        except Exception as dcraw_error:
-            raise ValueError(f"Failed to process RAW image {raw_path}: {str(e)}, dcraw error: {str(dcraw_error)}")
+    import cv2
+    image = decode_raw(raw_path)
+    
+    # Create a temporary file to save the converted image
+    temp_file = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+    temp_path = temp_file.name
+    temp_file.close()
+    
+    # Save the image
+    cv2.imwrite(temp_path, image)
+    return temp_path
+
+def write_json_atomic(path, data):
+    """Write JSON next to `path` and rename it into place, so readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
 
 class ImageProcessor:
-    def __init__(self, input_dir, output_dir, desired_emotion, time_debug=False):
-        self.input_dir = Path(input_dir)
-        self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+    # Spans whose totals are reported as the classic per-component times
+    COMPONENT_SPANS = {
+        'raw_conversion': ('process_image/raw_conversion', 'prefetch/raw_conversion'),
+        'pose_detection': 'process_image/pose_detection',
+        'object_detection': 'process_image/object_detection',
+        'face_detection': 'process_image/face_detection',
+        'scoring': ('score_image', 'score_batch'),
+    }
+
+    def __init__(self, input_dir, output_dir, desired_emotion, time_debug=False,
+                 memory_debug=False, trace_allocations=False, video_interval=None, scene_threshold=None,
+                 temporal_coherence=False, metadata_filter=None, priority=False, time_budget=None,
+                 max_memory=None, decode_processes=0, resume=False,
+                 isolate=False, file_timeout=None, detector_backends=None, warm_up=None, embed_faces=None):
+        self.input_dir = Path(input_dir) if input_dir is not None else None
+        # Without an output directory nothing is written to disk (see src.api)
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
         self.desired_emotion = desired_emotion
-        self.temp_files = []  # Track temporary files for cleanup
+        self._scoring = None
+        # Stage -> backend name overriding settings.backends (see src.backends)
+        self.detector_backends = dict(detector_backends or {})
+        backends.select(self.detector_backends)
+        # Run one inference on a blank frame when loading, so the first image isn't a timing outlier
+        self.warm_up = settings.model_warmup if warm_up is None else warm_up
+        # Add identity embeddings to the faces for `main find-person` (see src.face_identity)
+        self.embed_faces = settings.face_embeddings if embed_faces is None else embed_faces
+        self.video_interval = video_interval
+        self.scene_threshold = scene_threshold
+        # Optional metadata.MetadataFilter applied to headers before anything is decoded
+        self.metadata_filter = metadata_filter
+        # Analyze the images with the best proxy score first (see src.scheduling)
+        self.priority = priority
+        self.provisional_results = []
+        self.progress = {'processed': 0, 'total': 0, 'complete': False}
+        # With a time budget (seconds) the quality tier is chosen per image (see src.budget)
+        self.time_budget = time_budget
+        self.budget = None
+        self.quality_tier = settings.quality_tiers[0]
+        # Memory budget in bytes for images decoded ahead (see src.admission)
+        self.max_memory = max_memory
+        self.memory_budget = None
+        # Decoder processes sharing frames through shared memory (0 decodes in threads)
+        self.decode_processes = decode_processes
+        self._decoder = None
+        # Continue an interrupted run from its progress journal (see src.journal)
+        self.resume = resume
+        # Analyze each still in a worker process with a timeout (see src.isolation)
+        self.isolate = isolate or bool(file_timeout)
+        self.file_timeout = file_timeout or settings.file_timeout
+        self._worker = None
+        # Set in the isolated worker: decode and detector errors are raised (and
+        # reported as a FileFailure) instead of giving the file empty results
+        self.raise_errors = False
+        self.tracker = None
+        if temporal_coherence:
+            from .tracking import FrameTracker
+            self.tracker = FrameTracker()
         self.time_debug = time_debug
+        self.timer = None
+        self._stop_requested = False
         
         # Initialize timing statistics if enabled
         if self.time_debug:
+            self.timer = timing.SpanTimer()
+            timing.set_active_timer(self.timer)
             self.timing_stats = {
                 'file_times': {},      # Individual file processing times
-                'component_times': {   # Time spent in each component of processing
-                    'raw_conversion': 0,
-                    'pose_detection': 0,
-                    'object_detection': 0,
-                    'face_detection': 0,
-                    'scoring': 0
-                }
+                'component_times': {component: 0 for component in self.COMPONENT_SPANS},
+                'spans': {}            # Per-span statistics (count, mean, p50, p95, ...)
             }
         
-    def __del__(self):
-        # Clean up any temporary files
-        for temp_file in self.temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.unlink(temp_file)
-            except:
-                pass
+        # Initialize memory accounting if enabled
+        self.memory_debug = memory_debug or trace_allocations
+        self.trace_allocations = trace_allocations
+        self.memory_tracker = None
+        self._open_memory_tracker()
+    
+    def _open_memory_tracker(self):
+        # A run closes its tracker when it ends, so a later run (e.g. in `main serve`) starts a new one
+        if self.memory_debug and (self.memory_tracker is None or self.memory_tracker.closed):
+            self.memory_tracker = memory.MemoryTracker(trace_allocations=self.trace_allocations)
+            memory.set_active_tracker(self.memory_tracker)
+    
+    def _close_memory_tracker(self):
+        # Every run leaves its memory_report.json, then the RSS sampler thread and
+        # tracemalloc stop; memory_stats stays readable
+        if self.memory_tracker is None or self.memory_tracker.closed:
+            return
+        if self.output_dir is not None:
+            self.memory_tracker.write_report(self.output_dir / "memory_report.json")
+        self.memory_tracker.close()
         
-    def process_image(self, image_path):
-        # Start timing if debug enabled
-        if self.time_debug:
-            start_time = time.time()
-            component_start_time = start_time
+    def _update_component_times(self):
+        # Running totals only; cheap enough to refresh after every image
+        for component, span_paths in self.COMPONENT_SPANS.items():
+            if isinstance(span_paths, str):
+                span_paths = (span_paths,)
+            self.timing_stats['component_times'][component] = sum(self.timer.total(path) for path in span_paths)
+
+    def _update_timing_stats(self):
+        """Fill in all timing statistics; the percentiles sort every sample, so only once per run."""
+        self._update_component_times()
+        self.timing_stats['spans'] = self.timer.summary()
+        if self.memory_budget is not None:
+            self.timing_stats['memory_budget'] = self.memory_budget.report()
+
+    @property
+    def memory_stats(self):
+        """Memory report (RSS per stage and file, largest allocations), or None when disabled."""
+        if self.memory_tracker is None:
+            return None
+        return self.memory_tracker.report()
+
+    def export_trace(self, path):
+        """Write the recorded spans as a Chrome trace / Perfetto JSON file."""
+        if self.timer is None:
+            raise RuntimeError("Timing is disabled; create the processor with time_debug=True")
+        return self.timer.export_chrome_trace(path)
+        
+    def load_models(self):
+        """Load every detection model now rather than when the first image needs it."""
+        with timing.span('load_models'):
+            # A time budget may step down to the lighter pose models, so those are loaded too
+            tiers = settings.quality_tiers if self.time_budget else settings.quality_tiers[:1]
+            complexities = {tier['pose_complexity'] for tier in tiers}
+            # The region sweep and tracked frames use separate models; built here, not inside the first timed file
+            region_complexities = {tier['pose_complexity'] for tier in tiers if tier['region_sweep']}
+            if self.tracker is not None:
+                region_complexities |= complexities
+            backends.get('pose').load(sorted(complexities, reverse=True), sorted(region_complexities, reverse=True))
+            for stage in ('object', 'face', 'emotion'):
+                backends.load(stage)
+            if self.embed_faces:
+                backends.load('identity')
+            resources.apply_library_limits()
+            if self.warm_up:
+                self._warm_up()
+    
+    def _warm_up(self):
+        import numpy as np
+        blank = np.zeros((640, 640, 3), dtype=np.uint8)
+        with timing.span('warm_up'):
+            self._detect(blank, 'warm_up')
+            # A blank frame has no faces, so the emotion model is run on its own
+            backends.get('emotion').classify(blank[:96, :96])
+
+    def request_stop(self):
+        """Ask a running process_directory() to stop after the current image."""
+        self._stop_requested = True
         
+    def process_image(self, image_path, image=None):
         image_path = Path(image_path)
-        results = {
-            'image_name': image_path.name,
+        with timing.span('process_image', file=image_path.name) as file_span, \
+                memory.stage('process_image', file=str(image_path)):
+            results = self._process_image(image_path, image)
+        
+        # Record total time for this image
+        if self.time_debug:
+            self.timing_stats['file_times'][str(image_path)] = file_span.elapsed
+            self._update_component_times()
+        
+        return results
+
+    def _process_image(self, image_path, image=None):
+        if image is not None:
+            return self.analyze_image(image, image_path.name)
+        
+        # Decode once and share the image between all detectors; RAW files are developed in memory
+        stage = 'raw_conversion' if is_raw(image_path) else 'decode'
+        try:
+            with memory.stage(stage):
+                image = load_image(image_path)
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            if stage == 'raw_conversion':
+                print(f"Error converting RAW file {image_path}: {str(e)}")
+            else:
+                print(f"Error reading image {image_path}: {str(e)}")
+            return self._empty_results(image_path.name)
+        
+        return self.analyze_image(image, image_path.name)
+
+    @staticmethod
+    def _empty_results(image_name):
+        return {
+            'image_name': image_name,
             'poses': [],
             'objects': [],
             'faces': []
         }
+
+    def analyze_image(self, image, image_name):
+        """
+        Run pose, object and face detection on a decoded image.
         
-        # Handle RAW formats
-        process_path = str(image_path)
-        raw_formats = ['.nef', '.raw', '.arw', '.cr2', '.cr3', '.dng', '.orf', '.rw2', '.pef', '.srw']
-        if image_path.suffix.lower() in raw_formats:
-            try:
-                # Time RAW conversion if debug enabled
-                if self.time_debug:
-                    raw_start_time = time.time()
-                
-                process_path = convert_raw_to_rgb(str(image_path))
-                self.temp_files.append(process_path)
-                
-                # Record RAW conversion time
-                if self.time_debug:
-                    self.timing_stats['component_times']['raw_conversion'] += time.time() - raw_start_time
-            except Exception as e:
-                print(f"Error converting RAW file {image_path}: {str(e)}")
-                
-                # Record total time for failed RAW conversion
-                if self.time_debug:
-                    self.timing_stats['file_times'][str(image_path)] = time.time() - start_time
-                
-                return results
+        With temporal coherence enabled, frames that are nearly identical to the
+        previous one only re-run the per-region stages (see src.tracking).
         
-        # Process the image with the regular pipeline
-        try:
-            # Time pose detection
-            if self.time_debug:
-                component_start_time = time.time()
+        Args:
+            image (numpy.ndarray): BGR image
+            image_name (str): Name stored in the results
             
-            poses = detect_multiple_poses(process_path)
-            for pose in poses:
-                results['poses'].append(pose.to_dict('records'))
+        Returns:
+            dict: Results with 'image_name', 'poses', 'objects' and 'faces'
+        """
+        if self.tracker is None:
+            results = self._detect(image, image_name)
+        else:
+            full = self.tracker.needs_full_detection(image)
+            if full:
+                results = self._detect(image, image_name)
+            else:
+                results = self._detect_tracked(image, image_name, self.tracker.previous)
+            results['detection'] = 'full' if full else 'tracked'
+            self.tracker.update(results, full)
+        results['quality_tier'] = self.quality_tier['name']
+        return results
+
+    def _detect_tracked(self, image, image_name, previous):
+        from .tracking import person_boxes
+        results = self._empty_results(image_name)
+        # The quality tier applies here too, so reused frames also get cheaper when a time budget falls behind
+        tier = self.quality_tier
+        image, scale = self._working_image(image, tier['max_side'])
+        
+        try:
+            with timing.span('pose_detection'), memory.stage('pose_detection'):
+                from .predict_pose import detect_poses_in_regions
+                boxes = [tuple(v * scale for v in box) for box in person_boxes(previous)]
+                poses = detect_poses_in_regions(image, boxes, model_complexity=tier['pose_complexity'])
+                for pose in poses:
+                    results['poses'].append(pose.to_dict('records'))
             
-            # Record pose detection time
-            if self.time_debug:
-                self.timing_stats['component_times']['pose_detection'] += time.time() - component_start_time
-                component_start_time = time.time()
+            with timing.span('face_detection'), memory.stage('face_detection'):
+                from .predict_face import analyze_faces_in_regions
+                previous_faces = previous['faces']
+                if scale != 1.0:
+                    previous_faces = [dict(face, box=tuple(int(round(v * scale)) for v in face['box']))
+                                      for face in previous_faces]
+                results['faces'] = analyze_faces_in_regions(image, previous_faces, self.embed_faces,
+                                                            tier['emotion_faces'])
+        except Exception as e:
+            if self.raise_errors:
+                raise
+            print(f"Error processing image {image_name}: {str(e)}")
+        
+        if scale != 1.0:
+            self._rescale_results(results, 1.0 / scale)
+        # Objects barely move between near-identical frames, keep the previous ones (already full size)
+        results['objects'] = [dict(obj) for obj in previous['objects']]
+        return results
+
+    @staticmethod
+    def _working_image(image, max_side):
+        """Downscale `image` to the tier's working resolution; returns (image, scale)."""
+        height, width = image.shape[:2]
+        if not max_side or max(height, width) <= max_side:
+            return image, 1.0
+        import cv2
+        scale = max_side / max(height, width)
+        with timing.span('resize'):
+            resized = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return resized, scale
+    
+    @staticmethod
+    def _rescale_results(results, factor):
+        """Map coordinates found on a downscaled working image back to the original image."""
+        for pose in results['poses']:
+            for landmark in pose:
+                landmark['x'] *= factor
+                landmark['y'] *= factor
+        for obj in results['objects']:
+            obj['box'] = tuple(int(round(v * factor)) for v in obj['box'])
+        for face in results['faces']:
+            face['box'] = tuple(int(round(v * factor)) for v in face['box'])
+    
+    def _detect(self, image, image_name):
+        results = self._empty_results(image_name)
+        tier = self.quality_tier
+        image, scale = self._working_image(image, tier['max_side'])
+        
+        try:
+            with timing.span('pose_detection'), memory.stage('pose_detection'):
+                with timing.span('import'):
+                    pose_detector = backends.get('pose')
+                    resources.apply_library_limits()
+                poses = pose_detector.detect(image, tier['pose_complexity'], tier['region_sweep'])
+                for pose in poses:
+                    results['poses'].append(pose.to_dict('records'))
             
-            # Time object detection
-            objects = detect_objects(process_path)
+            with timing.span('object_detection'), memory.stage('object_detection'):
+                with timing.span('import'):
+                    from .predict_object import detect_objects
+                    resources.apply_library_limits()
+                objects = detect_objects(image)
             results['objects'] = objects
             
-            # Record object detection time
-            if self.time_debug:
-                self.timing_stats['component_times']['object_detection'] += time.time() - component_start_time
-                component_start_time = time.time()
-            
-            # Time face detection
-            faces = detect_faces(process_path)
+            with timing.span('face_detection'), memory.stage('face_detection'):
+                with timing.span('import'):
+                    from .predict_face import detect_faces
+                    resources.apply_library_limits()
+                faces = detect_faces(image, tier['emotion_faces'], self.embed_faces)
             results['faces'] = faces
-            
-            # Record face detection time
-            if self.time_debug:
-                self.timing_stats['component_times']['face_detection'] += time.time() - component_start_time
         except Exception as e:
-            print(f"Error processing image {image_path}: {str(e)}")
-        
-        # Record total time for this image
-        if self.time_debug:
-            self.timing_stats['file_times'][str(image_path)] = time.time() - start_time
+            if self.raise_errors:
+                raise
+            print(f"Error processing image {image_name}: {str(e)}")
         
+        if scale != 1.0:
+            self._rescale_results(results, 1.0 / scale)
         return results
     
     def score_image(self, results):
-        # Start timing for scoring if debug enabled
+        with timing.span('score_image', file=results['image_name']), memory.stage('scoring'):
+            score = self._score_image(results)
+        
+        # Record scoring time
         if self.time_debug:
-            component_start_time = time.time()
+            self._update_component_times()
         
-        emotion_score = 0
-        object_score = 0
-        face_quality_score = 0
+        return score
+
+    def _score_image(self, results):
+        return self.scoring_engine().score(results)
+    
+    def scoring_engine(self):
+        """The scoring.ScoringEngine for the current desired emotion, compiled on first use."""
+        if self._scoring is None or self._scoring.desired_emotion != self.desired_emotion.lower():
+            self._scoring = ScoringEngine(self.desired_emotion)
+        return self._scoring
+    
+    def process_file(self, image_path, image_metadata=None, proxy=None, image=None):
+        """Detect, score and save the results of a single image (decoded here unless `image` is given)."""
+        image_path = Path(image_path)
+        if image_metadata is None:
+            image_metadata = metadata.read_metadata(image_path)
+        results = self.process_image(image_path, image)
+        results['metadata'] = image_metadata
+        if proxy is not None:
+            results['proxy'] = proxy
+        results['score'] = self.score_image(results)
+        self.save_results(results)
+        return results
+
+    def process_video(self, video_path):
+        """
+        Detect, score and save the frames sampled from a video clip.
         
-        # Process face scores
-        if results['faces']:
-            for face in results['faces']:
-                # Apply face quality to scoring
-                face_quality = face.get('face_quality', 1.0)
-                
-                # Penalize partial faces
-                if face.get('is_partial', False):
-                    completeness = face.get('face_completeness', 0.5)
-                    # Only count partial faces that are mostly visible
-                    if completeness >= 0.7:
-                        # Reduce score based on how much is cut off
-                        quality_factor = completeness
-                    else:
-                        # Heavily penalize very partial faces
-                        quality_factor = 0.3
-                else:
-                    quality_factor = 1.0
-                
-                # Calculate emotion match score with quality adjustments
-                if face['emotion'].lower() == self.desired_emotion.lower():
-                    # Base emotion score weighted by face quality
-                    emotion_score += 1 * face_quality * quality_factor
-                
-                # Add to overall face quality score
-                face_quality_score += face_quality * quality_factor
-        else:
-            # Penalize images with no faces at all
-            face_quality_score = -1
+        Returns:
+            list: One result per analyzed frame; 'source' holds the video name,
+                  timestamp and frame index so frames rank next to the stills
+        """
+        from .video import sample_frames
+        video_path = Path(video_path)
+        all_results = []
+        if self.tracker is not None:
+            self.tracker.reset()
         
-        # Calculate average face quality if there are faces
-        if results['faces']:
-            avg_face_quality = face_quality_score / len(results['faces'])
-            # Apply a mild bonus for images with multiple good quality faces
-            if len(results['faces']) > 1 and avg_face_quality > 0.8:
-                face_quality_score *= 1.2
+        frames = sample_frames(video_path, interval=self.video_interval, scene_threshold=self.scene_threshold)
+        for timestamp, frame_index, frame in frames:
+            if self._stop_requested:
+                break
+            
+            name = f"{video_path.name}@{timestamp:.3f}s"
+            with timing.span('process_image', file=name) as frame_span, \
+                    memory.stage('process_image', file=name):
+                results = self.analyze_image(frame, name)
+            results['source'] = {
+                'video': video_path.name,
+                'timestamp': round(timestamp, 3),
+                'frame_index': frame_index
+            }
+            if self.time_debug:
+                self.timing_stats['file_times'][name] = frame_span.elapsed
+            
+            results['score'] = self.score_image(results)
+            self.save_results(results)
+            all_results.append(results)
         
-        # Process object scores
-        for obj in results['objects']:
-            for bias in settings.image_raw_bias_settings:
-                if obj['label'].lower() == bias['name'].lower():
-                    object_score += emotion_score * bias['biasamount']
-                    break
-        
-        # Combine scores - include face quality in the final score
-        final_score = emotion_score + object_score
-        
-        # If we have faces, adjust final score by face quality
-        if results['faces'] and face_quality_score > 0:
-            # Apply face quality multiplier (neutral at 1.0, can go higher for good faces)
-            final_score *= (0.5 + 0.5 * min(face_quality_score, 2.0))
-        
-        # Store component scores for debugging/analysis
-        results['score_components'] = {
-            'emotion_score': emotion_score,
-            'object_score': object_score,
-            'face_quality_score': face_quality_score,
-            'final_score': final_score
-        }
+        if self.tracker is not None:
+            self.tracker.reset()
+        return all_results
+
+    @staticmethod
+    def results_filename(results):
+        """Name of the per-image JSON file for a result."""
+        source = results.get('source')
+        if source and 'video' in source:
+            return f"{Path(source['video']).stem}_{int(source['timestamp'] * 1000):09d}ms_results.json"
+        return f"{Path(results['image_name']).stem}_results.json"
+
+    def save_results(self, results, output_dir=None):
+        """Write one image's results to <output>/<image stem>_results.json."""
+        output_dir = Path(output_dir) if output_dir is not None else self.output_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = output_dir / self.results_filename(results)
+        with timing.span('write_results', file=results['image_name']), memory.stage('write_results'):
+            with open(output_path, 'w') as f:
+                json.dump(results, f, indent=2)
+        return output_path
+    
+    def provisional_ranking(self, top=None):
+        """Best-so-far ranking of the run in progress (or the last finished run)."""
+        ranking = sorted(({'image_name': r['image_name'], 'score': r['score']} for r in self.provisional_results),
+                         key=lambda x: x['score'], reverse=True)
+        return {**self.progress, 'ranking': ranking[:top] if top else ranking}
+
+    def _publish(self, all_results):
+        """Write the summary and the ranking so far; each file is replaced atomically."""
+        with timing.span('write_summary'):
+            write_json_atomic(self.output_dir / "summary.json", all_results)
+            write_json_atomic(self.output_dir / "ranking.json", self.provisional_ranking())
+
+    def _load_entry(self, entry):
+        """Decode a (path, metadata) entry ahead of time; videos are decoded by process_video."""
+        image_path, _ = entry
+        if is_video(image_path):
+            return None
+        if self._decoder is not None:
+            with timing.span('prefetch', file=image_path.name):
+                return self._decoder.load(image_path)
+        stage = 'raw_conversion' if is_raw(image_path) else 'decode'
+        with timing.span('prefetch', file=image_path.name), memory.stage(stage):
+            return load_image(image_path)
+    
+    def _start_decoder(self, entries):
+        """Start the decoder processes and their shared-memory frame pool (see src.shm_pool)."""
+        from .shm_pool import ProcessDecoder
+        frame_sizes = [
+            (image_metadata['width'] or 0) * (image_metadata['height'] or 0) * 3
+            for image_path, image_metadata in entries if not is_video(image_path)
+        ]
+        slot_bytes = max(frame_sizes + [0]) or settings.default_frame_pixels * 3
+        try:
+            # One slot per frame decoded ahead, plus the one being analyzed
+            return ProcessDecoder(self.decode_processes, settings.decode_lookahead + 2, slot_bytes)
+        except (MemoryError, OSError) as e:
+            print(f"Shared-memory decoding unavailable ({str(e)}); decoding in threads instead")
+            return None
+    
+    def _stop_decoder(self, finished):
+        if self._decoder is None:
+            return
+        if not finished:
+            # Frames decoded ahead of an early stop are dropped, not leaked
+            self._decoder.release_all()
+        leaks = self._decoder.close()
+        self._decoder = None
+        if leaks:
+            print(f"Warning: {len(leaks)} shared frame slot(s) were never released: "
+                  + ", ".join(label or f"slot {slot}" for slot, label in leaks))
+    
+    def _start_worker(self):
+        if not self.isolate:
+            # This process is the analysis worker (index 0; decoder processes come after it)
+            resources.pin_worker(0)
+            return None
+        processor_kwargs = {'input_dir': None, 'output_dir': str(self.output_dir),
+                            'desired_emotion': self.desired_emotion, 'detector_backends': self.detector_backends,
+                            'warm_up': self.warm_up, 'embed_faces': self.embed_faces,
+                            # The worker measures itself and sends its spans and memory records back
+                            'time_debug': self.time_debug, 'memory_debug': self.memory_debug,
+                            'trace_allocations': self.trace_allocations}
+        return IsolatedWorker(processor_kwargs, self.file_timeout)
+    
+    def _stop_worker(self):
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
+    
+    def _analyze_file(self, image_path, image_metadata, proxy=None, image=None):
+        """process_file(), in the isolated worker when --isolate is on."""
+        if self._worker is None:
+            return self.process_file(image_path, image_metadata, proxy, image)
         
-        # Record scoring time
-        if self.time_debug:
-            self.timing_stats['component_times']['scoring'] += time.time() - component_start_time
+        failures = []
+        elapsed = 0.0
+        for attempt in range(settings.isolation_retries + 1):
+            degraded = attempt > 0
+            try:
+                with timing.span('isolated', file=image_path.name) as file_span:
+                    results = self._worker.run(image_path, image_metadata, proxy, self.quality_tier, degraded)
+            except FileFailure as e:
+                failures.append(f"preview: {str(e)}" if degraded else str(e))
+                print(f"Failed to analyze {image_path.name}: {str(e)}")
+                continue
+            finally:
+                elapsed += file_span.elapsed
+                if self.time_debug:
+                    # The worker's spans have been merged into this process's timer
+                    self.timing_stats['file_times'][str(image_path)] = elapsed
+                    self._update_component_times()
+            if failures:
+                # Keep the record of what went wrong before the degraded retry succeeded
+                results['degraded'] = 'preview'
+                results['failures'] = failures
+                self.save_results(results)
+            return results
         
-        return final_score
+        results = self._empty_results(image_path.name)
+        results['metadata'] = image_metadata
+        results['error'] = failures[-1]
+        results['failures'] = failures
+        results['score'] = self.score_image(results)
+        self.save_results(results)
+        return results
+    
+    @staticmethod
+    def _estimate_entry(entry):
+        image_path, image_metadata = entry
+        if is_video(image_path):
+            return 0
+        return estimate_frame_bytes(image_path, image_metadata)
     
     def process_directory(self):
-        all_results = []
-        # Include RAW formats in the supported file types
-        supported_formats = ['.jpg', '.jpeg', '.png', '.nef', '.raw', '.arw', '.cr2', '.cr3', '.dng', '.orf', '.rw2', '.pef', '.srw']
-        image_files = [f for f in self.input_dir.glob('*') if f.suffix.lower() in supported_formats]
+        self._open_memory_tracker()
+        try:
+            return self._process_directory()
+        finally:
+            self._close_memory_tracker()
+    
+    def _process_directory(self):
+        self._stop_requested = False
+        all_results = self.provisional_results = []
+        self.budget = None
+        self.quality_tier = settings.quality_tiers[0]
+        if self.time_budget:
+            # The clock starts now: the pre-passes and model loading count against the budget
+            self.budget = BudgetController(self.time_budget)
+        # Include RAW formats and video clips in the supported file types
+        image_files = [f for f in self.input_dir.glob('*') if f.suffix.lower() in SUPPORTED_FORMATS + VIDEO_FORMATS]
+        
+        # Header-only pre-pass: filter, order by capture time and group bursts without decoding
+        with timing.span('metadata'):
+            entries, skipped = metadata.prepare_files(image_files, self.metadata_filter)
+        if skipped:
+            print(f"Skipped {skipped} file(s) by metadata filter")
+        journal = Journal(self.output_dir / JOURNAL_NAME)
+        resumed = 0
+        if self.resume:
+            # Files finished before the interruption are only re-scored, for the current emotion
+            completed = journal.load()
+            remaining = []
+            for entry in entries:
+                if entry[0].name not in completed:
+                    remaining.append(entry)
+                    continue
+                for results in completed[entry[0].name]:
+                    results['score'] = self.score_image(results)
+                    all_results.append(results)
+                resumed += 1
+            entries = remaining
+            print(f"Resuming: {resumed} file(s) already done, {len(entries)} to go")
+        proxies = {}
+        if self.priority:
+            with timing.span('prioritize'):
+                entries, proxies = scheduling.prioritize(entries)
+        if self.tracker is not None:
+            self.tracker.reset()
+        current_burst = None
+        self.progress = {'processed': resumed, 'total': resumed + len(entries), 'complete': False}
+        if self.budget is not None:
+            self.budget.plan(len(entries))
+        if self.budget is not None or (self.warm_up and not self.isolate):
+            # Load the models up front so the first image's time is a real throughput measurement
+            self.load_models()
+        last_publish = time.monotonic()
+        
+        # Stills are decoded ahead in background threads; with --max-memory only as far as the budget allows
+        self.memory_budget = MemoryBudget(self.max_memory) if self.max_memory else None
+        # Optionally in separate processes that hand frames over through shared memory
+        self._decoder = self._start_decoder(entries) if self.decode_processes and not self.isolate else None
+        # Isolated files are decoded by the worker, so that a crashing decoder only takes the worker down
+        self._worker = self._start_worker()
+        load = self._load_entry if self._worker is None else (lambda entry: None)
+        frames = prefetch(entries, lookahead=settings.decode_lookahead, load=load,
+                          workers=settings.decode_workers, budget=self.memory_budget,
+                          estimate=self._estimate_entry)
         
         with Progress(
             SpinnerColumn(),
@@ -260,25 +656,171 @@ class ImageProcessor:
             TaskProgressColumn(),
             TimeRemainingColumn(),
         ) as progress:
-            task = progress.add_task("[cyan]Processing images...", total=len(image_files))
+            task = progress.add_task("[cyan]Processing images...", total=self.progress['total'],
+                                     completed=resumed)
             
-            for image_path in image_files:
-                try:
-                    results = self.process_image(image_path)
-                    results['score'] = self.score_image(results)
-                    all_results.append(results)
+            journal.open(resume=self.resume)
+            try:
+                for (image_path, image_metadata), image, _ in frames:
+                    if self._stop_requested:
+                        break
+                    if self.budget is not None:
+                        if self.budget.expired():
+                            print(f"Time budget reached after {self.progress['processed']} of {self.progress['total']} files")
+                            break
+                        self.quality_tier = self.budget.current()
+                    
+                    # Only frames of the same burst are similar enough to track between
+                    if self.tracker is not None and image_metadata['burst_id'] != current_burst:
+                        self.tracker.reset()
+                    current_burst = image_metadata['burst_id']
+                    
+                    file_start = time.perf_counter()
+                    try:
+                        if is_video(image_path):
+                            file_results = self.process_video(image_path)
+                        else:
+                            file_results = [self._analyze_file(image_path, image_metadata, proxies.get(image_path), image)]
+                        all_results.extend(file_results)
+                        # A clip cut short by a stop request is redone on resume
+                        if not (self._stop_requested and is_video(image_path)):
+                            journal.record(image_path.name, file_results)
+                    except Exception as e:
+                        print(f"Error processing {image_path}: {str(e)}")
+                    if self._decoder is not None:
+                        self._decoder.release(image_path)
+                    if self.budget is not None:
+                        self.budget.record(time.perf_counter() - file_start)
+                    
+                    self.progress['processed'] += 1
+                    progress.update(task, advance=1)
                     
-                    output_path = self.output_dir / f"{image_path.stem}_results.json"
-                    with open(output_path, 'w') as f:
-                        json.dump(results, f, indent=2)
-                        
+                    # In priority mode the best-so-far ranking is kept on disk as the run goes
+                    if self.priority and time.monotonic() - last_publish >= settings.provisional_publish_interval:
+                        self._publish(all_results)
+                        last_publish = time.monotonic()
+            except KeyboardInterrupt:
+                # Stopping early still leaves a valid summary of everything analyzed so far
+                print(f"Interrupted; keeping the {len(all_results)} results analyzed so far")
+            finally:
+                frames.close()
+                journal.close()
+                self._stop_worker()
+                self._stop_decoder(finished=self.progress['processed'] == self.progress['total'])
+        
+        self.progress['complete'] = self.progress['processed'] == self.progress['total']
+        self._publish(all_results)
+        
+        if self.time_debug:
+            self._update_timing_stats()
+        
+        return sorted(all_results, key=lambda x: x['score'], reverse=True)
+
+    def process_distributed(self, node_id=None):
+        """
+        Share the input directory with other nodes through a job ledger in the
+        output directory (see src.ledger). Every node runs this with the same
+        --input and --output on the shared filesystem; each claims files until
+        none are left, and the nodes' results are merged into summary.json.
+        
+        Returns:
+            list: Merged results of all nodes sorted by score (highest first);
+                  only this node's results if others are still working
+        """
+        self._open_memory_tracker()
+        try:
+            return self._process_distributed(node_id)
+        finally:
+            self._close_memory_tracker()
+    
+    def _process_distributed(self, node_id):
+        self._stop_requested = False
+        ledger = Ledger(self.output_dir / "ledger", node_id)
+        all_results = self.provisional_results = []
+        
+        image_files = [f for f in self.input_dir.glob('*') if f.suffix.lower() in SUPPORTED_FORMATS + VIDEO_FORMATS]
+        with timing.span('metadata'):
+            entries, skipped = metadata.prepare_files(image_files, self.metadata_filter)
+        # Items are file names, so nodes may mount the share at different paths
+        items = ledger.initialize([image_path.name for image_path, _ in entries])
+        entry_metadata = {image_path.name: image_metadata for image_path, image_metadata in entries}
+        print(f"Node {ledger.node_id}: {len(items)} items in the ledger, {ledger.done_count()} already done")
+        
+        self._worker = self._start_worker()
+        ledger.start_heartbeat()
+        try:
+            while not self._stop_requested:
+                item = ledger.claim()
+                if item is None:
+                    if ledger.all_done():
+                        break
+                    # The rest is leased by other nodes; wait in case one of them dies
+                    time.sleep(settings.ledger_poll_interval)
+                    continue
+                
+                image_path = self.input_dir / item
+                item_results = []
+                try:
+                    if is_video(image_path):
+                        item_results = self.process_video(image_path)
+                    else:
+                        item_results = [self._analyze_file(image_path, entry_metadata.get(item))]
                 except Exception as e:
                     print(f"Error processing {image_path}: {str(e)}")
-                
-                progress.update(task, advance=1)
+                all_results.extend(item_results)
+                # Appended, so writing the node's results costs the same for every item
+                ledger.add_results(item_results)
+                ledger.complete(item)
+        except KeyboardInterrupt:
+            print(f"Interrupted; {len(all_results)} results of this node are kept")
+        finally:
+            self._stop_worker()
+            ledger.stop_heartbeat()
+            ledger.release_all()
+        
+        if self.time_debug:
+            self._update_timing_stats()
         
+        if not ledger.all_done():
+            print(f"Other nodes are still working ({ledger.status()}); summary.json is written by the last node")
+            return sorted(all_results, key=lambda x: x['score'], reverse=True)
+        
+        merged = ledger.merged_results()
+        with timing.span('write_summary'):
+            write_json_atomic(self.output_dir / "summary.json", merged)
+        return sorted(merged, key=lambda x: x['score'], reverse=True)
+
+    def rescore_directory(self):
+        """
+        Re-score the results of a previous run in the output directory for the
+        current desired emotion without running any detection models.
+        
+        Returns:
+            list: Results sorted by their new score (highest first)
+        """
+        self._open_memory_tracker()
+        try:
+            return self._rescore_directory()
+        finally:
+            self._close_memory_tracker()
+    
+    def _rescore_directory(self):
         summary_path = self.output_dir / "summary.json"
-        with open(summary_path, 'w') as f:
-            json.dump(all_results, f, indent=2)
-            
-        return sorted(all_results, key=lambda x: x['score'], reverse=True) 
\ No newline at end of file
+        if not summary_path.exists():
+            raise FileNotFoundError(f"No summary.json found in {self.output_dir}; run a full analysis first")
+        
+        with open(summary_path) as f:
+            all_results = json.load(f)
+        
+        # One vectorized pass over the whole archive instead of scoring image by image
+        with timing.span('score_batch', images=len(all_results)), memory.stage('scoring'):
+            self.scoring_engine().score_batch(all_results)
+        if self.time_debug:
+            self._update_timing_stats()
+        for results in all_results:
+            self.save_results(results)
+        
+        with timing.span('write_summary'):
+            write_json_atomic(summary_path, all_results)
+        
+        return sorted(all_results, key=lambda x: x['score'], reverse=True)
@@ -1,94 +1,283 @@
 import cv2
-import mediapipe as mp
 import numpy as np
-import pandas as pd
-from deepface import DeepFace
+import os
+from . import backends
+from . import model_store
+from .timing import span
+from .image_loader import load_image
 
-def detect_faces(image_path):
-    mp_face_detection = mp.solutions.face_detection
-    mp_face_mesh = mp.solutions.face_mesh
+# Loaded once per process and reused for every image
+_face_detector = None
+
+def load_face_detector():
+    """Load (once) and return the MediaPipe face detector."""
+    global _face_detector
+    if _face_detector is None:
+        # Imported here so that the OpenCV DNN face backend doesn't need MediaPipe
+        import mediapipe as mp
+        with span('model_load'):
+            _face_detector = mp.solutions.face_detection.FaceDetection(
+                model_selection=1, min_detection_confidence=0.5
+            )
+    return _face_detector
+
+def load_models():
+    """Load the face detector and the emotion model up front."""
+    backends.load('face')
+    backends.load('emotion')
+
+class MediaPipeFaceDetector:
+    """Face backend (see src.backends) using MediaPipe's full-range face detector."""
+    
+    def load(self):
+        self.detector = load_face_detector()
+    
+    def locate(self, image):
+        return [box for box, _ in self.locate_with_keypoints(image)]
     
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Could not read image at {image_path}")
+    def locate_with_keypoints(self, image):
+        with span('inference'):
+            results = self.detector.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        faces = []
+        for detection in results.detections or []:
+            bbox = detection.location_data.relative_bounding_box
+            # MediaPipe's first four keypoints: right eye, left eye, nose tip, mouth center
+            keypoints = [(point.x, point.y) for point in detection.location_data.relative_keypoints[:4]]
+            faces.append(((bbox.xmin, bbox.ymin, bbox.width, bbox.height), keypoints if len(keypoints) == 4 else None))
+        return faces
+
+class DeepFaceEmotionClassifier:
+    """Emotion backend (see src.backends) using DeepFace's Keras model."""
+    
+    def load(self):
+        # DeepFace reads its weights from the models directory instead of fetching them into ~/.deepface
+        os.environ['DEEPFACE_HOME'] = str(model_store.deepface_home())
+        model_store.resolve(model_store.DEEPFACE_EMOTION_WEIGHTS)
+        # Deferred: importing DeepFace loads TensorFlow
+        from deepface import DeepFace
+        self.deepface = DeepFace
+        with span('model_load'):
+            # Analyzing a blank patch builds and caches DeepFace's emotion model
+            DeepFace.analyze(np.zeros((48, 48, 3), dtype=np.uint8), actions=['emotion'], enforce_detection=False)
     
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def classify(self, face_img):
+        analysis = self.deepface.analyze(face_img, actions=['emotion'], enforce_detection=False)
+        return analysis[0]['dominant_emotion']
+
+def locate_faces(image):
+    """
+    Run only the face detector (no emotion), for cheap proxies.
+    
+    Returns:
+        list: (x, y, w, h) boxes relative to the image size (0-1)
+    """
+    return backends.get('face').locate(load_image(image))
+
+def locate_with_keypoints(image):
+    """
+    Face boxes with their eye, nose and mouth keypoints, for aligning faces.
+    
+    Returns:
+        list: ((x, y, w, h), keypoints) relative to the image size, keypoints
+              None when the face backend doesn't provide them
+    """
+    detector = backends.get('face')
+    if hasattr(detector, 'locate_with_keypoints'):
+        return detector.locate_with_keypoints(image)
+    return [(box, None) for box in detector.locate(image)]
+
+def locate_faces_batch(images):
+    """
+    locate_faces() for several decoded images, in one pass where the backend supports batching.
+    
+    Returns:
+        list: For each image, its relative (x, y, w, h) boxes
+    """
+    detector = backends.get('face')
+    if hasattr(detector, 'locate_batch'):
+        return detector.locate_batch(images)
+    return [detector.locate(image) for image in images]
+
+def detect_faces(image, max_emotion_faces=None, embed=False):
+    """
+    Detect faces, rate their quality and classify their emotion.
+    
+    Args:
+        image: Path to the input image, or an already decoded BGR image
+        max_emotion_faces (int): Only classify the emotion of the largest N
+            faces; the others get 'unknown'. None classifies every face.
+        embed (bool): Also add an identity 'embedding' to every face (see src.face_identity)
+        
+    Returns:
+        list: List of dictionaries with 'box', 'emotion', 'is_partial',
+              'face_completeness', 'face_quality' and 'face_size_ratio'
+    """
+    image = load_image(image)
     height, width, _ = image.shape
     
+    candidates = []
+    
+    for (xmin, ymin, box_width, box_height), keypoints in locate_with_keypoints(image):
+        x = int(xmin * width)
+        y = int(ymin * height)
+        w = int(box_width * width)
+        h = int(box_height * height)
+        
+        # Calculate face quality metrics
+        face_quality = 1.0
+        face_completeness = 1.0
+        is_partial = False
+        
+        # Check if face is cut off at image boundaries
+        if x < 0 or y < 0 or x + w > width or y + h > height:
+            is_partial = True
+            # Calculate how much of the face is visible (0.0-1.0)
+            visible_x = max(0, min(width, x + w)) - max(0, x)
+            visible_y = max(0, min(height, y + h)) - max(0, y)
+            visible_area = visible_x * visible_y
+            total_area = w * h
+            face_completeness = visible_area / total_area if total_area > 0 else 0
+            # Penalize cut-off faces
+            face_quality *= face_completeness
+        
+        # Adjust coordinates to be within image boundaries
+        x = max(0, x)
+        y = max(0, y)
+        w = min(w, width - x)
+        h = min(h, height - y)
+        
+        # Skip faces that are too small or barely visible
+        if w < 20 or h < 20 or face_completeness < 0.5:
+            continue
+        
+        if keypoints is not None:
+            keypoints = [(px * width, py * height) for px, py in keypoints]
+        candidates.append(((x, y, x+w, y+h), is_partial, face_completeness, face_quality, keypoints))
+    
+    # Emotion is the expensive stage, so it can be limited to the largest faces
+    classified = range(len(candidates))
+    if max_emotion_faces is not None:
+        def area(i):
+            x1, y1, x2, y2 = candidates[i][0]
+            return (x2 - x1) * (y2 - y1)
+        classified = set(sorted(range(len(candidates)), key=area, reverse=True)[:max_emotion_faces])
+    
     face_results = []
+    face_keypoints = []
+    for i, (box, is_partial, face_completeness, face_quality, keypoints) in enumerate(candidates):
+        face = analyze_face(image, box, is_partial, face_completeness, face_quality, classify_emotion=i in classified)
+        if face is not None:
+            face_results.append(face)
+            face_keypoints.append(keypoints)
     
-    with mp_face_detection.FaceDetection(
-        model_selection=1, min_detection_confidence=0.5
-    ) as face_detection:
-        results = face_detection.process(image_rgb)
+    if embed:
+        from .face_identity import embed_faces
+        embed_faces(image, face_results, face_keypoints)
+    
+    return face_results
+
+def analyze_face(image, box, is_partial=False, face_completeness=1.0, face_quality=1.0, classify_emotion=True):
+    """
+    Classify the emotion of a face at a known position and finish its quality rating.
+    
+    Args:
+        image (numpy.ndarray): BGR image
+        box (tuple): Face bounding box (x1, y1, x2, y2) within the image
+        is_partial (bool): Whether the face is cut off at the image border
+        face_completeness (float): Visible fraction of the face (0.0-1.0)
+        face_quality (float): Quality before the size adjustment
+        classify_emotion (bool): If False, skip DeepFace and report 'unknown'
         
-        if results.detections:
-            for detection in results.detections:
-                bbox = detection.location_data.relative_bounding_box
-                x = int(bbox.xmin * width)
-                y = int(bbox.ymin * height)
-                w = int(bbox.width * width)
-                h = int(bbox.height * height)
-                
-                # Calculate face quality metrics
-                face_quality = 1.0
-                face_completeness = 1.0
-                is_partial = False
-                
-                # Check if face is cut off at image boundaries
-                if x < 0 or y < 0 or x + w > width or y + h > height:
-                    is_partial = True
-                    # Calculate how much of the face is visible (0.0-1.0)
-                    visible_x = max(0, min(width, x + w)) - max(0, x)
-                    visible_y = max(0, min(height, y + h)) - max(0, y)
-                    visible_area = visible_x * visible_y
-                    total_area = w * h
-                    face_completeness = visible_area / total_area if total_area > 0 else 0
-                    # Penalize cut-off faces
-                    face_quality *= face_completeness
-                
-                # Adjust coordinates to be within image boundaries
-                x = max(0, x)
-                y = max(0, y)
-                w = min(w, width - x)
-                h = min(h, height - y)
-                
-                # Skip faces that are too small or barely visible
-                if w < 20 or h < 20 or face_completeness < 0.5:
-                    continue
-                
-                face_img = image[y:y+h, x:x+w]
-                if face_img.size == 0:
-                    continue
-                    
-                try:
-                    emotion = DeepFace.analyze(face_img, actions=['emotion'], enforce_detection=False)
-                    emotion = emotion[0]['dominant_emotion']
-                except:
-                    emotion = "unknown"
-                
-                # Calculate face size relative to image (0.0-1.0)
-                face_size_ratio = (w * h) / (width * height)
-                
-                # Adjust quality based on face size
-                # Penalize very small faces
-                if face_size_ratio < 0.01:
-                    face_quality *= 0.5
-                # Slightly boost medium-sized faces that are the focus
-                elif 0.05 <= face_size_ratio <= 0.3:
-                    face_quality *= 1.2
-                
-                face_results.append({
-                    'box': (x, y, x+w, y+h),
-                    'emotion': emotion,
-                    'is_partial': is_partial,
-                    'face_completeness': face_completeness,
-                    'face_quality': min(face_quality, 1.0),  # Cap at 1.0
-                    'face_size_ratio': face_size_ratio
-                })
+    Returns:
+        dict: Face result, or None if the box is empty
+    """
+    height, width = image.shape[:2]
+    x1, y1, x2, y2 = box
+    w, h = x2 - x1, y2 - y1
     
+    face_img = image[y1:y2, x1:x2]
+    if face_img.size == 0:
+        return None
+        
+    if not classify_emotion:
+        emotion = "unknown"
+    else:
+        try:
+            # The first face loads the emotion backend (TensorFlow for DeepFace)
+            classifier = backends.get('emotion')
+            with span('emotion'):
+                emotion = classifier.classify(face_img)
+        except:
+            emotion = "unknown"
+    
+    # Calculate face size relative to image (0.0-1.0)
+    face_size_ratio = (w * h) / (width * height)
+    
+    # Adjust quality based on face size
+    # Penalize very small faces
+    if face_size_ratio < 0.01:
+        face_quality *= 0.5
+    # Slightly boost medium-sized faces that are the focus
+    elif 0.05 <= face_size_ratio <= 0.3:
+        face_quality *= 1.2
+    
+    return {
+        'box': (x1, y1, x2, y2),
+        'emotion': emotion,
+        'is_partial': is_partial,
+        'face_completeness': face_completeness,
+        'face_quality': min(face_quality, 1.0),  # Cap at 1.0
+        'face_size_ratio': face_size_ratio
+    }
+
+def analyze_faces_in_regions(image, previous_faces, embed=False, max_emotion_faces=None):
+    """
+    Re-run only the per-face stages (emotion, quality) on the faces found in the
+    previous frame, skipping face detection. Used for near-identical consecutive frames.
+    
+    Args:
+        image: Path to the input image, or an already decoded BGR image
+        previous_faces (list): Face results of the previous frame, with boxes in `image` coordinates
+        embed (bool): Keep the previous frame's identity embeddings, computing
+            only the missing ones
+        max_emotion_faces (int): Only classify the emotion of the largest N
+            faces, as in detect_faces()
+        
+    Returns:
+        list: Face results in the same format as detect_faces()
+    """
+    image = load_image(image)
+    height, width = image.shape[:2]
+    classified = range(len(previous_faces))
+    if max_emotion_faces is not None:
+        def area(i):
+            x1, y1, x2, y2 = previous_faces[i]['box']
+            return (x2 - x1) * (y2 - y1)
+        classified = set(sorted(range(len(previous_faces)), key=area, reverse=True)[:max_emotion_faces])
+    face_results = []
+    for i, previous in enumerate(previous_faces):
+        x1, y1, x2, y2 = previous['box']
+        box = (max(0, x1), max(0, y1), min(width, x2), min(height, y2))
+        is_partial = previous.get('is_partial', False)
+        face_completeness = previous.get('face_completeness', 1.0)
+        face_quality = face_completeness if is_partial else 1.0
+        face = analyze_face(image, box, is_partial, face_completeness, face_quality, classify_emotion=i in classified)
+        if face is not None:
+            # The same face in a near-identical frame: its identity doesn't change
+            if embed and previous.get('embedding'):
+                face['embedding'] = previous['embedding']
+            face_results.append(face)
+    if embed and any('embedding' not in face for face in face_results):
+        from .face_identity import embed_faces
+        embed_faces(image, [face for face in face_results if 'embedding' not in face])
     return face_results
 
 def predict_identity(face_img):
-    pass
-    
\ No newline at end of file
+    """
+    Identity embedding of one face crop, with the configured identity backend.
+    
+    Returns:
+        numpy.ndarray: L2-normalized vector; the dot product of two is their cosine similarity
+    """
+    return backends.get('identity').embed([face_img])[0]
+    
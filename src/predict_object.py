@@ -1,21 +1,29 @@
-def detect_objects(image_path):
-    """
-    Detect objects in an image and return their coordinates and labels.
-    
-    Args:
-        image_path (str): Path to the input image
-        
-    Returns:
-        list: List of dictionaries, each containing:
-              - 'label': The detected object class name
-              - 'confidence': Detection confidence score
-              - 'box': Bounding box coordinates (x1, y1, x2, y2)
-    """
-    try:
+from . import backends
+from . import model_store
+from .timing import span
+from .image_loader import load_image
+
+# Loaded once per process and reused for every image
+_model = None
+
+def load_model():
+    """Load (once) and return the YOLO object detection model."""
+    global _model
+    if _model is None:
         from ultralytics import YOLO
-        import cv2
-        model = YOLO('yolov8n.pt')  # n (nano) for speed, you can use 's', 'm', 'l', or 'x' for better accuracy
-        results = model(image_path)
+        with span('model_load'):
+            _model = YOLO(str(model_store.resolve('yolov8n.pt')))  # n (nano) for speed, you can use 's', 'm', 'l', or 'x' for better accuracy
+    return _model
+
+class UltralyticsObjectDetector:
+    """Object backend (see src.backends) running YOLOv8 through ultralytics/PyTorch."""
+    
+    def load(self):
+        self.model = load_model()
+    
+    def detect(self, image):
+        with span('inference'):
+            results = self.model(image)
         detections = []
         for r in results:
             boxes = r.boxes
@@ -31,6 +39,23 @@ def detect_objects(image_path):
                     'box': (x1, y1, x2, y2)
                 })
         return detections
+
+def detect_objects(image):
+    """
+    Detect objects in an image and return their coordinates and labels.
+    
+    Args:
+        image: Path to the input image, or an already decoded BGR image
+        
+    Returns:
+        list: List of dictionaries, each containing:
+              - 'label': The detected object class name
+              - 'confidence': Detection confidence score
+              - 'box': Bounding box coordinates (x1, y1, x2, y2)
+    """
+    try:
+        detector = backends.get('object')
+        return detector.detect(load_image(image))
     except Exception as e:
         print(f"Error detecting objects: {str(e)}")
         return []
@@ -4,38 +4,77 @@ import cv2
 import mediapipe as mp
 import numpy as np
 import pandas as pd
+from .timing import span
+from .image_loader import load_image
 
-def detect_multiple_poses(image_path):
+# Pose models keyed by (model_complexity, min_detection_confidence). They run in
+# static image mode, so one instance can safely be reused for unrelated images.
+_pose_models = {}
+
+def load_pose_model(model_complexity=2, min_detection_confidence=0.1):
+    """Load (once) and return a MediaPipe pose model with the given settings."""
+    key = (model_complexity, min_detection_confidence)
+    if key not in _pose_models:
+        with span('model_load'):
+            _pose_models[key] = mp.solutions.pose.Pose(
+                static_image_mode=True,
+                model_complexity=model_complexity,
+                enable_segmentation=False,
+                min_detection_confidence=min_detection_confidence,
+                min_tracking_confidence=0.1
+            )
+    return _pose_models[key]
+
+def load_models(model_complexities=(2,), region_complexities=(2,)):
+    """
+    Load the full-image and per-region pose models up front.
+    
+    Args:
+        model_complexities: Complexities of the full-image pass (confidence 0.1)
+        region_complexities: Complexities of the region sweep and of the
+            per-person pass on tracked frames (confidence 0.3)
+    """
+    for model_complexity in region_complexities:
+        load_pose_model(model_complexity, 0.3)
+    for model_complexity in model_complexities:
+        load_pose_model(model_complexity, 0.1)
+
+class MediaPipePoseDetector:
+    """Pose backend (see src.backends) built on MediaPipe Pose."""
+    
+    def load(self, model_complexities=(2,), region_complexities=(2,)):
+        load_models(model_complexities, region_complexities)
+    
+    def detect(self, image, model_complexity=2, region_sweep=True):
+        return detect_multiple_poses(image, model_complexity, region_sweep)
+
+def detect_multiple_poses(image, model_complexity=2, region_sweep=True):
     """
     Detects poses of multiple people in an image and returns their landmark coordinates.
     
     Args:
-        image_path (str): Path to the input image
+        image: Path to the input image, or an already decoded BGR image
+        model_complexity (int): MediaPipe pose model (0 lite, 1 full, 2 heavy)
+        region_sweep (bool): Also look for further people in five sub-regions
         
     Returns:
         list: List of pandas DataFrames, where each DataFrame contains pose landmarks 
              for a single person (x, y, z, visibility)
     """
-    mp_pose = mp.solutions.pose
-    pose = mp_pose.Pose(
-        static_image_mode=True,
-        model_complexity=2,
-        enable_segmentation=False,
-        min_detection_confidence=0.1,
-        min_tracking_confidence=0.1
-    )
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Could not read image at {image_path}")
+    pose = load_pose_model(model_complexity, 0.1)
+    image = load_image(image)
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     height, width, _ = image.shape
-    results = pose.process(image_rgb)
+    with span('inference'):
+        results = pose.process(image_rgb)
     pose_results = []
     if results.pose_landmarks:
         df = pd.DataFrame(columns=['landmark_id', 'x', 'y', 'z', 'visibility'])
         for idx, landmark in enumerate(results.pose_landmarks.landmark):
             df.loc[idx] = [idx, landmark.x * width, landmark.y * height, landmark.z, landmark.visibility]
         pose_results.append(df)
+    if not region_sweep:
+        return pose_results
     regions = [
         (0, 0, width//2, height//2),           # Top-left
         (width//2, 0, width, height//2),       # Top-right
@@ -43,16 +82,14 @@ def detect_multiple_poses(image_path):
         (width//2, height//2, width, height),  # Bottom-right
         (width//4, height//4, 3*width//4, 3*height//4)  # Center
     ]
-    for xmin, ymin, xmax, ymax in regions:
-        if xmax - xmin < 100 or ymax - ymin < 100:
-            continue
-        region_img = image_rgb[ymin:ymax, xmin:xmax]
-        with mp_pose.Pose(
-            static_image_mode=True, 
-            model_complexity=2, 
-            min_detection_confidence=0.3
-        ) as region_pose:
-            region_results = region_pose.process(region_img)
+    with span('region_sweep'):
+        for xmin, ymin, xmax, ymax in regions:
+            if xmax - xmin < 100 or ymax - ymin < 100:
+                continue
+            region_img = image_rgb[ymin:ymax, xmin:xmax]
+            region_pose = load_pose_model(model_complexity, 0.3)
+            with span('inference'):
+                region_results = region_pose.process(region_img)
             if region_results.pose_landmarks:
                 person_df = pd.DataFrame(columns=['landmark_id', 'x', 'y', 'z', 'visibility'])
                 for idx, landmark in enumerate(region_results.pose_landmarks.landmark):
@@ -61,7 +98,44 @@ def detect_multiple_poses(image_path):
                     person_df.loc[idx] = [idx, x, y, landmark.z, landmark.visibility]
                 if not any_similar_pose(person_df, pose_results, threshold=50):
                     pose_results.append(person_df)
-    pose.close()
+    return pose_results
+
+def detect_poses_in_regions(image, boxes, margin=0.2, model_complexity=2):
+    """
+    Runs single-person pose estimation inside known person boxes, e.g. the people
+    found in the previous frame, instead of the full multi-person region sweep.
+    
+    Args:
+        image: Path to the input image, or an already decoded BGR image
+        boxes (list): Person bounding boxes (x1, y1, x2, y2)
+        margin (float): Fraction of the box size added on every side to allow for movement
+        model_complexity (int): MediaPipe pose model (0 lite, 1 full, 2 heavy)
+        
+    Returns:
+        list: List of pandas DataFrames in the same format as detect_multiple_poses()
+    """
+    image = load_image(image)
+    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    height, width, _ = image.shape
+    region_pose = load_pose_model(model_complexity, 0.3)
+    pose_results = []
+    for x1, y1, x2, y2 in boxes:
+        pad_x = int((x2 - x1) * margin)
+        pad_y = int((y2 - y1) * margin)
+        xmin, ymin = max(0, int(x1) - pad_x), max(0, int(y1) - pad_y)
+        xmax, ymax = min(width, int(x2) + pad_x), min(height, int(y2) + pad_y)
+        if xmax - xmin < 32 or ymax - ymin < 32:
+            continue
+        with span('inference'):
+            region_results = region_pose.process(image_rgb[ymin:ymax, xmin:xmax])
+        if region_results.pose_landmarks:
+            person_df = pd.DataFrame(columns=['landmark_id', 'x', 'y', 'z', 'visibility'])
+            for idx, landmark in enumerate(region_results.pose_landmarks.landmark):
+                x = landmark.x * (xmax - xmin) + xmin
+                y = landmark.y * (ymax - ymin) + ymin
+                person_df.loc[idx] = [idx, x, y, landmark.z, landmark.visibility]
+            if not any_similar_pose(person_df, pose_results, threshold=50):
+                pose_results.append(person_df)
     return pose_results
 
 def any_similar_pose(new_pose_df, existing_poses, threshold=0):
@@ -0,0 +1,215 @@
+"""
+Int8 quantization of the ONNX object detector and emotion classifier for
+CPU-only ingest machines.
+
+calibrate() runs ONNX Runtime's static quantization (QDQ, int8 weights per
+channel, uint8 activations). The activation ranges come from a local folder of
+our own images, preprocessed exactly as the backends do it. compare() then
+scores a test set with the float and the int8 models and reports the speedup
+next to how much the ranking changes, so the trade-off can be decided per
+shoot. Select the result with --backend object=onnx_int8 --backend emotion=onnx_int8.
+"""
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from . import settings
+from . import backends
+from .image_loader import SUPPORTED_FORMATS, load_image
+
+QUANTIZABLE_STAGES = ('object', 'emotion')
+
+
+def _image_paths(image_dir, limit=None):
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in SUPPORTED_FORMATS)
+    return paths[:limit] if limit else paths
+
+
+def _face_crops(image):
+    """Faces found by the configured face backend, as crops for the emotion model."""
+    height, width = image.shape[:2]
+    crops = []
+    for xmin, ymin, box_width, box_height in backends.get('face').locate(image):
+        x1, y1 = max(0, int(xmin * width)), max(0, int(ymin * height))
+        x2, y2 = min(width, int((xmin + box_width) * width)), min(height, int((ymin + box_height) * height))
+        if x2 - x1 >= 20 and y2 - y1 >= 20:
+            crops.append(image[y1:y2, x1:x2])
+    return crops
+
+
+def calibration_inputs(stage, float_backend, image_dir, limit):
+    """
+    Yield preprocessed model inputs for calibration, decoding one image at a time.
+
+    Object calibration uses whole images, emotion calibration the faces in them;
+    `limit` caps the number of inputs either way.
+    """
+    produced = 0
+    for path in _image_paths(image_dir):
+        if produced >= limit:
+            return
+        try:
+            image = load_image(path)
+        except Exception as e:
+            print(f"Skipping {path.name}: {str(e)}")
+            continue
+        if stage == 'object':
+            samples = [float_backend.preprocess(image)[0]]
+        else:
+            samples = [float_backend.preprocess(face) for face in _face_crops(image)]
+        for sample in samples[:limit - produced]:
+            produced += 1
+            yield sample
+
+
+def _data_reader(input_name, make_inputs):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.count = 0
+            self.rewind()
+
+        def get_next(self):
+            sample = next(self._inputs, None)
+            if sample is None:
+                return None
+            self.count += 1
+            return {input_name: sample}
+
+        def rewind(self):
+            self._inputs = make_inputs()
+
+    return Reader()
+
+
+def calibrate(stage, image_dir, limit=None):
+    """
+    Build the int8 model of `stage` from its float ONNX model.
+
+    Args:
+        stage (str): 'object' or 'emotion'
+        image_dir: Folder of representative images from our own shoots
+        limit (int): Calibration inputs to use (default: settings.calibration_images)
+
+    Returns:
+        Path: The quantized model (settings.onnx_quantized_models)
+    """
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from .onnx_backend import OnnxEmotionClassifier, OnnxObjectDetector, model_path
+    if stage not in QUANTIZABLE_STAGES:
+        raise ValueError(f"Only {', '.join(QUANTIZABLE_STAGES)} can be quantized")
+    limit = limit or settings.calibration_images
+    float_backend = OnnxObjectDetector() if stage == 'object' else OnnxEmotionClassifier()
+    float_backend.load()
+    source = model_path(stage)
+    target = model_path(stage, quantized=True, must_exist=False)
+
+    reader = _data_reader(float_backend.input_name,
+                          lambda: calibration_inputs(stage, float_backend, image_dir, limit))
+    with tempfile.TemporaryDirectory() as tmp:
+        model_input = source
+        try:
+            # Shape inference and graph cleanup make more of the graph quantizable
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            model_input = Path(tmp) / 'preprocessed.onnx'
+            quant_pre_process(str(source), str(model_input), skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"Pre-processing {source.name} failed ({str(e)}); quantizing it as is")
+            model_input = source
+        quantize_static(str(model_input), str(target), reader,
+                        quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8,
+                        per_channel=True,
+                        calibrate_method=CalibrationMethod.MinMax)
+    if not reader.count:
+        target.unlink(missing_ok=True)
+        raise ValueError(f"No calibration inputs for {stage} found in {image_dir}")
+    # A new calibration replaces the file, so its checksum is pinned again
+    from . import model_store
+    model_store.pin(settings.onnx_quantized_models[stage])
+    print(f"Calibrated {stage} on {reader.count} input(s): {target}")
+    return target
+
+
+def compare(image_dir, desired_emotion, top=20, limit=None):
+    """
+    Score a test set with the float and the int8 ONNX models.
+
+    Returns:
+        dict: Per-variant timings (ms per image for objects and faces including
+              emotion) and the agreement of the int8 results with the float ones:
+              Spearman rank correlation of the scores, overlap of the top N,
+              object F1 and the share of faces with the same emotion
+    """
+    from .agreement import match_f1, rank_correlation, top_overlap
+    from .pipeline import ImageProcessor
+    from .predict_face import detect_faces
+    from .predict_object import detect_objects
+
+    variants = {
+        'float': {'object': 'onnx', 'emotion': 'onnx'},
+        'int8': {'object': 'onnx_int8', 'emotion': 'onnx_int8'},
+    }
+    previous = {stage: backends.selected(stage) for stage in QUANTIZABLE_STAGES}
+    processor = ImageProcessor(None, None, desired_emotion)
+    runs = {name: {'scores': [], 'objects': [], 'emotions': [], 'object_ms': [], 'face_ms': []} for name in variants}
+    names = []
+    try:
+        for variant, choices in variants.items():
+            backends.select(choices)
+            for stage in QUANTIZABLE_STAGES:
+                backends.load(stage)
+        for path in _image_paths(image_dir, limit):
+            try:
+                image = load_image(path)
+            except Exception as e:
+                print(f"Skipping {path.name}: {str(e)}")
+                continue
+            names.append(path.name)
+            for variant, choices in variants.items():
+                backends.select(choices)
+                run = runs[variant]
+                start = time.perf_counter()
+                objects = detect_objects(image)
+                run['object_ms'].append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                faces = detect_faces(image)
+                run['face_ms'].append((time.perf_counter() - start) * 1000)
+                results = {'image_name': path.name, 'poses': [], 'objects': objects, 'faces': faces}
+                run['scores'].append(processor.score_image(results))
+                run['objects'].append([(obj['label'], obj['box']) for obj in objects])
+                run['emotions'].append([face['emotion'] for face in faces])
+    finally:
+        backends.select(previous)
+    if not names:
+        raise ValueError(f"No readable images in {image_dir}")
+
+    reference, candidate = runs['float'], runs['int8']
+    same_emotion = [a == b for ref, cand in zip(reference['emotions'], candidate['emotions'])
+                    for a, b in zip(ref, cand)]
+    return {
+        'images': len(names),
+        'timing': {
+            variant: {
+                'object_ms': round(statistics.median(run['object_ms']), 2),
+                'face_ms': round(statistics.median(run['face_ms']), 2),
+            }
+            for variant, run in runs.items()
+        },
+        'speedup': {
+            key: round(statistics.median(reference[key]) / max(statistics.median(candidate[key]), 1e-9), 2)
+            for key in ('object_ms', 'face_ms')
+        },
+        'rank_correlation': round(rank_correlation(reference['scores'], candidate['scores']), 4),
+        'top_overlap': round(top_overlap(reference['scores'], candidate['scores'], top), 4),
+        'top': top,
+        'object_f1': round(statistics.mean(match_f1(a, b) for a, b in zip(reference['objects'], candidate['objects'])), 4),
+        'emotion_agreement': round(sum(same_emotion) / len(same_emotion), 4) if same_emotion else None,
+        'changed': [
+            {'image_name': name, 'float_score': round(a, 4), 'int8_score': round(b, 4)}
+            for name, a, b in zip(names, reference['scores'], candidate['scores']) if abs(a - b) > 1e-6
+        ],
+    }
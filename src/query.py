@@ -0,0 +1,229 @@
+"""
+Inverted index and query language over the results of a run.
+
+QueryIndex is built once from summary.json: posting lists (sorted arrays of
+result ids) per object label, per face emotion and per face-count bucket,
+plus the scores sorted once, so a score range is two binary searches. A query
+is a list of conditions that must all hold, evaluated by intersecting their
+posting lists, smallest first:
+
+    emotion=happy faces>=3 object=dog score>1.5 order by score limit 50
+
+Conditions:
+    emotion=happy,surprise    a face with one of these emotions (!= for none)
+    object=dog                an object with this label (!= for none)
+    faces>=3                  number of faces (=, !=, <, <=, >, >=)
+    score>1.5                 score (=, !=, <, <=, >, >=)
+    name=IMG_12*              image name, shell-style wildcards (!= to exclude)
+
+followed by an optional `order by score|faces|name [asc|desc]` and `limit N`.
+"""
+import fnmatch
+import json
+import re
+from pathlib import Path
+
+from .timing import span
+
+# Faces per image get their own bucket up to this count; more share the last one
+FACE_BUCKETS = 5
+FIELDS = ('emotion', 'object', 'faces', 'score', 'name')
+ORDER_FIELDS = ('score', 'faces', 'name')
+
+_CONDITION = re.compile(r'^(?P<field>[A-Za-z_]+)(?P<op>>=|<=|!=|==|=|<|>)(?P<value>.+)$')
+_TOKEN = re.compile(r'(?:[^\s"]+|"[^"]*")+')
+
+
+class QueryError(ValueError):
+    """A query that can't be parsed or refers to an unknown field."""
+
+
+def parse(text):
+    """
+    Parse a query into its conditions, ordering and limit.
+
+    Returns:
+        dict: {'conditions': [(field, op, value)], 'order': (field, descending) or None, 'limit': int or None}
+    """
+    tokens = [token.replace('"', '') for token in _TOKEN.findall(text)]
+    query = {'conditions': [], 'order': None, 'limit': None}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        lowered = token.lower()
+        if lowered == 'order':
+            if i + 2 >= len(tokens) or tokens[i + 1].lower() != 'by':
+                raise QueryError("Expected `order by <field>`")
+            field = tokens[i + 2].lower()
+            if field not in ORDER_FIELDS:
+                raise QueryError(f"Can't order by {field!r}; choose from {', '.join(ORDER_FIELDS)}")
+            # Scores and face counts are best high, names read alphabetically
+            descending = field != 'name'
+            i += 3
+            if i < len(tokens) and tokens[i].lower() in ('asc', 'desc'):
+                descending = tokens[i].lower() == 'desc'
+                i += 1
+            query['order'] = (field, descending)
+            continue
+        if lowered == 'limit':
+            if i + 1 >= len(tokens) or not tokens[i + 1].isdigit():
+                raise QueryError("Expected `limit <number>`")
+            query['limit'] = int(tokens[i + 1])
+            i += 2
+            continue
+        match = _CONDITION.match(token)
+        if not match:
+            raise QueryError(f"Can't parse {token!r}; conditions look like emotion=happy or faces>=3")
+        field, op, value = match.group('field').lower(), match.group('op'), match.group('value')
+        op = '=' if op == '==' else op
+        if field not in FIELDS:
+            raise QueryError(f"Unknown field {field!r}; choose from {', '.join(FIELDS)}")
+        if field in ('emotion', 'object', 'name') and op not in ('=', '!='):
+            raise QueryError(f"{field} only supports = and !=")
+        if field in ('faces', 'score'):
+            try:
+                value = int(value) if field == 'faces' else float(value)
+            except ValueError:
+                raise QueryError(f"{field} needs a number, not {value!r}")
+        query['conditions'].append((field, op, value))
+        i += 1
+    return query
+
+
+class QueryIndex:
+    """
+    Posting lists over a list of results.
+
+    Args:
+        all_results (list): Results as in summary.json (each with a 'score')
+    """
+
+    def __init__(self, all_results):
+        import numpy as np
+        self.results = all_results
+        self.names = [results['image_name'] for results in all_results]
+        self.face_counts = np.array([len(results['faces']) for results in all_results], dtype=np.int64)
+        self.scores = np.array([results.get('score', 0.0) for results in all_results], dtype=np.float64)
+
+        with span('build_query_index', results=len(all_results)):
+            emotions, labels = {}, {}
+            for doc, results in enumerate(all_results):
+                for emotion in {face['emotion'].lower() for face in results['faces']}:
+                    emotions.setdefault(emotion, []).append(doc)
+                for label in {obj['label'].lower() for obj in results['objects']}:
+                    labels.setdefault(label, []).append(doc)
+            # Ids are appended in increasing order, so every posting list is sorted
+            self.emotions = {key: np.array(docs, dtype=np.int64) for key, docs in emotions.items()}
+            self.labels = {key: np.array(docs, dtype=np.int64) for key, docs in labels.items()}
+            buckets = np.minimum(self.face_counts, FACE_BUCKETS)
+            self.face_buckets = [np.flatnonzero(buckets == bucket) for bucket in range(FACE_BUCKETS + 1)]
+            self.score_order = np.argsort(self.scores, kind='stable')
+            self.sorted_scores = self.scores[self.score_order]
+        self.all = np.arange(len(all_results), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.results)
+
+    @classmethod
+    def open(cls, output_dir, desired_emotion=None):
+        """
+        Index the summary.json of an output directory.
+
+        Args:
+            desired_emotion (str): Re-score the results for this emotion first
+                                   (in memory only; see --rescore to keep it)
+        """
+        summary_path = Path(output_dir) / 'summary.json'
+        if not summary_path.exists():
+            raise FileNotFoundError(f"No summary.json found in {output_dir}; run a full analysis first")
+        with open(summary_path) as f:
+            all_results = json.load(f)
+        if desired_emotion:
+            from .scoring import ScoringEngine
+            ScoringEngine(desired_emotion).score_batch(all_results)
+        return cls(all_results)
+
+    def _union(self, postings, keys):
+        import numpy as np
+        lists = [postings[key] for key in keys if key in postings]
+        if not lists:
+            return np.zeros(0, dtype=np.int64)
+        return lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+
+    def _faces(self, op, value):
+        import numpy as np
+        wanted = {'=': lambda c: c == value, '!=': lambda c: c != value, '<': lambda c: c < value,
+                  '<=': lambda c: c <= value, '>': lambda c: c > value, '>=': lambda c: c >= value}[op]
+        docs = []
+        for bucket, posting in enumerate(self.face_buckets):
+            if bucket < FACE_BUCKETS:
+                if wanted(bucket):
+                    docs.append(posting)
+            elif len(posting):
+                # The last bucket mixes counts, so it is checked per result
+                docs.append(posting[wanted(self.face_counts[posting])])
+        return np.unique(np.concatenate(docs)) if docs else np.zeros(0, dtype=np.int64)
+
+    def _score(self, op, value):
+        import numpy as np
+        sorted_scores = self.sorted_scores
+        if op == '!=':
+            return np.setdiff1d(self.all, self._score('=', value), assume_unique=True)
+        low, high = {
+            '=': (np.searchsorted(sorted_scores, value, 'left'), np.searchsorted(sorted_scores, value, 'right')),
+            '<': (0, np.searchsorted(sorted_scores, value, 'left')),
+            '<=': (0, np.searchsorted(sorted_scores, value, 'right')),
+            '>': (np.searchsorted(sorted_scores, value, 'right'), len(sorted_scores)),
+            '>=': (np.searchsorted(sorted_scores, value, 'left'), len(sorted_scores)),
+        }[op]
+        return np.sort(self.score_order[low:high])
+
+    def _name(self, pattern):
+        import numpy as np
+        pattern = pattern.lower()
+        return np.array([doc for doc, name in enumerate(self.names) if fnmatch.fnmatchcase(name.lower(), pattern)],
+                        dtype=np.int64)
+
+    def postings(self, field, op, value):
+        """Sorted ids of the results that satisfy one condition."""
+        import numpy as np
+        if field in ('faces', 'score'):
+            return self._faces(op, value) if field == 'faces' else self._score(op, value)
+        if field == 'name':
+            docs = self._name(value)
+        else:
+            keys = [key.strip().lower() for key in value.split(',') if key.strip()]
+            docs = self._union(self.emotions if field == 'emotion' else self.labels, keys)
+        return np.setdiff1d(self.all, docs, assume_unique=True) if op == '!=' else docs
+
+    def search(self, text):
+        """
+        Evaluate a query.
+
+        Returns:
+            list: The matching results, ordered and limited as the query asks
+                  (by score, highest first, by default)
+        """
+        import numpy as np
+        query = parse(text) if isinstance(text, str) else text
+        with span('query'):
+            matches = None
+            # Intersecting the shortest lists first keeps every step small
+            for docs in sorted((self.postings(*condition) for condition in query['conditions']), key=len):
+                matches = docs if matches is None else np.intersect1d(matches, docs, assume_unique=True)
+                if not len(matches):
+                    break
+            if matches is None:
+                matches = self.all
+
+            field, descending = query['order'] or ('score', True)
+            if field == 'name':
+                ordered = sorted(matches.tolist(), key=lambda doc: self.names[doc], reverse=descending)
+            else:
+                keys = (self.scores if field == 'score' else self.face_counts)[matches]
+                # Stable, so ties keep the order of the results
+                order = np.argsort(-keys if descending else keys, kind='stable')
+                ordered = matches[order].tolist()
+        if query['limit'] is not None:
+            ordered = ordered[:query['limit']]
+        return [self.results[doc] for doc in ordered]
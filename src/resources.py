@@ -0,0 +1,236 @@
+"""
+Central CPU thread budget for every library the pipeline loads.
+
+TensorFlow (DeepFace), PyTorch (ultralytics), OpenCV, MediaPipe and the BLAS
+libraries behind NumPy each default to a thread pool as large as the machine.
+configure() splits a single thread budget between the workers and sets the
+environment variables the libraries read when they are first imported.
+apply_library_limits() then uses each library's own setter once it has been
+imported. Call configure() before importing the detectors.
+
+Worker processes adopt the budget in their initializer (init_worker(), or
+pool_initializer() for a process pool), which with affinity 'auto' also pins
+each worker to its own slice of the CPUs.
+"""
+import multiprocessing
+import os
+import sys
+
+# Read by OpenMP, OpenBLAS, MKL, Accelerate, numexpr and TensorFlow at import time
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+_config = None
+_applied = set()
+
+
+def available_cpus():
+    """CPUs this process may run on (respects affinity masks and container limits)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(value):
+    """Parse '0-3,8,10-11' into [0, 1, 2, 3, 8, 10, 11]."""
+    cpus = []
+    for part in str(value).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    if not cpus:
+        raise ValueError(f"Empty CPU list {value!r}")
+    return sorted(set(cpus))
+
+
+def worker_cpus(worker_index, workers, cpus=None):
+    """The slice of `cpus` that worker `worker_index` of `workers` is pinned to."""
+    cpus = cpus or available_cpus()
+    per_worker = max(1, len(cpus) // max(1, workers))
+    start = (worker_index * per_worker) % len(cpus)
+    return cpus[start:start + per_worker] or cpus
+
+
+def configure(threads=None, workers=1, affinity=None):
+    """
+    Set the thread budget for this process.
+
+    Args:
+        threads (int): Total threads for all workers together (default: available CPUs)
+        workers (int): Number of parallel workers sharing the budget
+        affinity (str): None, 'auto' (pin each worker to its own slice of the
+            available CPUs, see init_worker()) or a CPU list such as '0-7' to
+            restrict the whole run to
+
+    Returns:
+        dict: The effective configuration
+    """
+    global _config
+    cpus = available_cpus()
+    if affinity and affinity != 'auto':
+        cpus = parse_cpu_list(affinity)
+        if set_affinity(cpus):
+            cpus = available_cpus()
+    workers = max(1, workers or 1)
+    threads = max(1, threads or len(cpus))
+    per_worker = max(1, threads // workers)
+
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(per_worker)
+    # TensorFlow reads these when it initializes its runtime
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(per_worker)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(min(2, per_worker))
+
+    _config = {
+        'cpus': len(cpus),
+        'threads': threads,
+        'workers': workers,
+        'threads_per_worker': per_worker,
+        'inter_op_threads': min(2, per_worker),
+        'affinity': affinity,
+        # Workers are pinned within the CPUs of the whole run, not of the process that starts them
+        'cpu_ids': cpus,
+    }
+    _applied.clear()
+    apply_library_limits()
+    return _config
+
+
+def get_config():
+    return _config
+
+
+def set_affinity(cpus):
+    """Pin this process to `cpus`; returns False where affinity isn't supported."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def pin_worker(worker_index):
+    """Pin the calling worker process to its slice of CPUs when affinity is 'auto'."""
+    if _config is None or _config['affinity'] != 'auto':
+        return None
+    cpus = worker_cpus(worker_index, _config['workers'], _config['cpu_ids'])
+    return cpus if set_affinity(cpus) else None
+
+
+def init_worker(config, index=0, setup=None):
+    """
+    Run at the start of a worker process: adopt the parent's budget and pin
+    the worker to its CPUs.
+
+    Args:
+        config (dict): The parent's get_config(); None leaves the worker unconfigured
+        index (int or multiprocessing.Value): Worker index, or a shared counter
+            that hands out consecutive indexes to the workers of a pool
+        setup (callable): Called first, e.g. to import the libraries the
+            worker uses so that their limits are applied too
+
+    Returns:
+        list: The CPUs the worker was pinned to, or None
+    """
+    global _config
+    if setup is not None:
+        setup()
+    if config is None:
+        return None
+    if not isinstance(index, int):
+        counter = index
+        with counter.get_lock():
+            index = counter.value
+            counter.value += 1
+    _config = dict(config)
+    _applied.clear()
+    apply_library_limits()
+    return pin_worker(index)
+
+
+def pool_initializer(setup=None, first_index=0, context=None):
+    """
+    initializer and initargs for a ProcessPoolExecutor whose workers share the budget.
+
+    Args:
+        setup (callable): See init_worker(); must be picklable (a module-level function)
+        first_index (int): Index of the pool's first worker, for pools that
+            run next to other workers of the same run
+        context: The multiprocessing context of the pool (default: the default context)
+
+    Returns:
+        tuple: (initializer, initargs)
+    """
+    counter = (context or multiprocessing.get_context()).Value('i', first_index)
+    return init_worker, (_config, counter, setup)
+
+
+def pool_size():
+    """Number of worker processes configured for this run, None when unconfigured."""
+    return _config['workers'] if _config is not None else None
+
+
+def apply_library_limits():
+    """
+    Apply the thread budget through the setters of every library imported so far.
+    Cheap to call repeatedly; each library is configured once.
+    """
+    if _config is None:
+        return
+    threads = _config['threads_per_worker']
+    inter_op = _config['inter_op_threads']
+
+    if 'cv2' in sys.modules and 'cv2' not in _applied:
+        sys.modules['cv2'].setNumThreads(threads)
+        _applied.add('cv2')
+
+    if 'torch' in sys.modules and 'torch' not in _applied:
+        torch = sys.modules['torch']
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # Only allowed before the first parallel work; the env vars cover that case
+            pass
+        _applied.add('torch')
+
+    if 'tensorflow' in sys.modules and 'tensorflow' not in _applied:
+        tf = sys.modules['tensorflow']
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+        except (RuntimeError, AttributeError):
+            # Already initialized: TF_NUM_INTRAOP_THREADS / TF_NUM_INTEROP_THREADS applied instead
+            pass
+        _applied.add('tensorflow')
+
+
+def report():
+    """Effective thread settings as reported by each imported library."""
+    if _config is None:
+        return None
+    libraries = {}
+    if 'cv2' in sys.modules:
+        libraries['opencv'] = sys.modules['cv2'].getNumThreads()
+    if 'torch' in sys.modules:
+        torch = sys.modules['torch']
+        libraries['torch'] = f"{torch.get_num_threads()} intra / {torch.get_num_interop_threads()} inter"
+    if 'tensorflow' in sys.modules:
+        threading = sys.modules['tensorflow'].config.threading
+        intra = threading.get_intra_op_parallelism_threads() or os.environ['TF_NUM_INTRAOP_THREADS']
+        inter = threading.get_inter_op_parallelism_threads() or os.environ['TF_NUM_INTEROP_THREADS']
+        libraries['tensorflow'] = f"{intra} intra / {inter} inter"
+    if 'mediapipe' in sys.modules:
+        # MediaPipe's solutions API has no thread setting; affinity bounds it
+        libraries['mediapipe'] = 'not configurable (bounded by affinity)'
+    affinity = available_cpus()
+    return {
+        **{key: value for key, value in _config.items() if key != 'cpu_ids'},
+        'effective_affinity': f"{len(affinity)} CPUs" if len(affinity) > 8 else ','.join(map(str, affinity)),
+        'env': {name: os.environ.get(name) for name in THREAD_ENV_VARS[:1] + ['TF_NUM_INTRAOP_THREADS']},
+        'libraries': libraries,
+    }
@@ -0,0 +1,101 @@
+"""
+Anytime scheduling: analyze the images most likely to rank well first.
+
+A proxy score is computed on a small preview (JPEG reduced decode or the
+preview embedded in RAW files): the number and size of faces found by the
+face detector alone, and how sharp the largest face (or the whole frame) is.
+The full pipeline then runs in descending proxy order, so stopping early
+still leaves the likely winners analyzed.
+"""
+from . import settings
+from .timing import span
+
+
+def sharpness(gray):
+    """Variance of the Laplacian, a standard focus measure."""
+    import cv2
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def proxy_features(path, max_side=None):
+    """
+    Cheap features of an image computed on a reduced decode.
+
+    Returns:
+        dict: 'faces' (count), 'face_area' (summed face area as a fraction of
+              the image) and 'sharpness' (Laplacian variance of the largest
+              face, or of the whole preview when there is no face)
+    """
+    from .image_loader import load_preview
+    from .predict_face import locate_faces
+    preview = load_preview(path, max_side or settings.proxy_preview_size)
+    return preview_features(preview, locate_faces(preview))
+
+
+def preview_features(preview, boxes):
+    """proxy_features() of a decoded preview and the face boxes found on it."""
+    import cv2
+    gray = cv2.cvtColor(preview, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    region = gray
+    if boxes:
+        x, y, w, h = max(boxes, key=lambda box: box[2] * box[3])
+        x1, y1 = max(0, int(x * width)), max(0, int(y * height))
+        x2, y2 = min(width, int((x + w) * width)), min(height, int((y + h) * height))
+        if x2 - x1 >= 8 and y2 - y1 >= 8:
+            region = gray[y1:y2, x1:x2]
+
+    return {
+        'faces': len(boxes),
+        'face_area': round(sum(max(0.0, w) * max(0.0, h) for _, _, w, h in boxes), 4),
+        'sharpness': round(sharpness(region), 2),
+    }
+
+
+def proxy_score(features):
+    """Combine proxy features into one number; only the order matters."""
+    # Images with people rank higher than empty ones, bigger faces higher than tiny ones
+    face_score = min(features['faces'], 10) + 5.0 * min(features['face_area'], 0.5)
+    sharp = min(features['sharpness'] / settings.proxy_sharpness_reference, 1.0)
+    return round((face_score + 0.1) * (0.5 + 0.5 * sharp), 4)
+
+
+def prioritize(entries):
+    """
+    Order (path, metadata) entries by descending proxy score.
+
+    Entries whose proxy can't be computed (videos, unreadable files) go last
+    in their original order.
+
+    Returns:
+        tuple: (ordered entries, {path: proxy dict with 'score' and the features})
+    """
+    from .video import is_video
+    from .image_loader import load_preview
+    from .predict_face import locate_faces_batch
+    proxies = {}
+    paths = [path for path, _ in entries if not is_video(path)]
+    # Previews go through the face detector in batches (one forward pass with batching backends)
+    for start in range(0, len(paths), settings.face_batch_size):
+        previews = {}
+        for path in paths[start:start + settings.face_batch_size]:
+            with span('proxy_decode', file=path.name):
+                try:
+                    previews[path] = load_preview(path, settings.proxy_preview_size)
+                except Exception as e:
+                    print(f"Could not compute proxy for {path}: {str(e)}")
+        if not previews:
+            continue
+        try:
+            with span('proxy_faces'):
+                batch_boxes = locate_faces_batch(list(previews.values()))
+        except Exception as e:
+            print(f"Could not compute proxies for {len(previews)} file(s): {str(e)}")
+            continue
+        for (path, preview), boxes in zip(previews.items(), batch_boxes):
+            features = preview_features(preview, boxes)
+            proxies[path] = {'score': proxy_score(features), **features}
+
+    # sorted() is stable, so ties and entries without a proxy keep the capture time order
+    ordered = sorted(entries, key=lambda entry: -proxies[entry[0]]['score'] if entry[0] in proxies else float('inf'))
+    return ordered, proxies
@@ -0,0 +1,152 @@
+"""
+Scoring of detection results, compiled once from settings.
+
+ScoringEngine turns settings.image_raw_bias_settings into a label -> weight
+lookup, so an object costs one dict lookup instead of a scan of all bias
+entries. score() rates one image (used while analyzing). score_batch() rates a
+whole result set with NumPy (used when rescoring archives). Both give exactly
+the same numbers as each other: the per-image sums are accumulated in
+detection order with np.bincount, which adds its weights sequentially, so
+float rounding matches the scalar loop.
+"""
+from . import settings
+
+
+def quality_factor(face):
+    """Weight of a face by how much of it is in the frame."""
+    if not face.get('is_partial', False):
+        return 1.0
+    completeness = face.get('face_completeness', 0.5)
+    # Only count partial faces that are mostly visible; heavily penalize the others
+    return completeness if completeness >= 0.7 else 0.3
+
+
+class ScoringEngine:
+    """
+    Scores results for one desired emotion.
+
+    Args:
+        desired_emotion (str): Emotion faces are rewarded for
+        bias_settings (list): Object biases (default: settings.image_raw_bias_settings)
+    """
+
+    def __init__(self, desired_emotion, bias_settings=None):
+        self.desired_emotion = desired_emotion.lower()
+        bias_settings = settings.image_raw_bias_settings if bias_settings is None else bias_settings
+        # The first entry of a name wins, like the scan it replaces
+        self.object_weights = {}
+        for bias in bias_settings:
+            self.object_weights.setdefault(bias['name'].lower(), bias['biasamount'])
+
+    def has_bias(self, label):
+        """Whether objects with this label affect the score."""
+        return label.lower() in self.object_weights
+
+    def score(self, results):
+        """
+        Score one image and store the components in results['score_components'].
+
+        Returns:
+            float: The final score
+        """
+        emotion_score = 0
+        object_score = 0
+        face_quality_score = 0
+
+        faces = results['faces']
+        for face in faces:
+            weight = face.get('face_quality', 1.0) * quality_factor(face)
+            if face['emotion'].lower() == self.desired_emotion:
+                emotion_score += weight
+            face_quality_score += weight
+
+        if faces:
+            # Mild bonus for images with several good quality faces
+            if len(faces) > 1 and face_quality_score / len(faces) > 0.8:
+                face_quality_score *= 1.2
+        else:
+            # Penalize images with no faces at all
+            face_quality_score = -1
+
+        for obj in results['objects']:
+            bias = self.object_weights.get(obj['label'].lower())
+            if bias is not None:
+                object_score += emotion_score * bias
+
+        final_score = emotion_score + object_score
+        # Face quality multiplier (neutral at 1.0, can go higher for good faces)
+        if faces and face_quality_score > 0:
+            final_score *= (0.5 + 0.5 * min(face_quality_score, 2.0))
+
+        results['score_components'] = {
+            'emotion_score': emotion_score,
+            'object_score': object_score,
+            'face_quality_score': face_quality_score,
+            'final_score': final_score
+        }
+        return final_score
+
+    def score_batch(self, all_results):
+        """
+        Score many images at once; same results as score() on each of them.
+
+        Sets results['score'] and results['score_components'] on every entry.
+
+        Returns:
+            numpy.ndarray: Final scores in the order of `all_results`
+        """
+        import numpy as np
+        count = len(all_results)
+
+        # One row per face / relevant object, with the index of its image
+        face_owner, face_weight, face_match = [], [], []
+        object_owner, object_bias = [], []
+        object_weights, desired_emotion = self.object_weights, self.desired_emotion
+        for index, results in enumerate(all_results):
+            for face in results['faces']:
+                face_owner.append(index)
+                face_weight.append(face.get('face_quality', 1.0) * quality_factor(face))
+                face_match.append(face['emotion'].lower() == desired_emotion)
+            for obj in results['objects']:
+                bias = object_weights.get(obj['label'].lower())
+                if bias is not None:
+                    object_owner.append(index)
+                    object_bias.append(bias)
+        face_owner = np.array(face_owner, dtype=np.intp)
+        face_weight = np.array(face_weight, dtype=np.float64)
+        face_match = np.array(face_match, dtype=bool)
+        object_owner = np.array(object_owner, dtype=np.intp)
+        object_bias = np.array(object_bias, dtype=np.float64)
+
+        face_count = np.bincount(face_owner, minlength=count)
+        matched_count = np.bincount(face_owner[face_match], minlength=count)
+        emotion_score = np.bincount(face_owner[face_match], weights=face_weight[face_match], minlength=count)
+        face_quality = np.bincount(face_owner, weights=face_weight, minlength=count)
+        has_faces = face_count > 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bonus = (face_count > 1) & (face_quality / face_count > 0.8)
+        face_quality = np.where(bonus, face_quality * 1.2, face_quality)
+        face_quality = np.where(has_faces, face_quality, -1.0)
+
+        object_count = np.bincount(object_owner, minlength=count)
+        object_score = np.bincount(object_owner, weights=emotion_score[object_owner] * object_bias, minlength=count)
+
+        final_score = emotion_score + object_score
+        boosted = has_faces & (face_quality > 0)
+        final_score = np.where(boosted, final_score * (0.5 + 0.5 * np.minimum(face_quality, 2.0)), final_score)
+
+        # Components with no contributions stay integers, as in score()
+        columns = zip(all_results, emotion_score.tolist(), object_score.tolist(), face_quality.tolist(),
+                      final_score.tolist(), (matched_count > 0).tolist(), (object_count > 0).tolist(),
+                      has_faces.tolist(), boosted.tolist())
+        for results, emotion, objects, quality, final, matched, relevant, faces, adjusted in columns:
+            final = final if matched or relevant or adjusted else 0
+            results['score_components'] = {
+                'emotion_score': emotion if matched else 0,
+                'object_score': objects if relevant else 0,
+                'face_quality_score': quality if faces else -1,
+                'final_score': final
+            }
+            results['score'] = final
+        return final_score
@@ -0,0 +1,353 @@
+"""
+Long-lived scoring server that keeps the detection models warm.
+
+Every `python3 -m main` invocation is a fresh process that has to import
+TensorFlow, PyTorch, MediaPipe and YOLO again. The server loads them once and
+then scores images on request, so automation clients (AppleScript, shell
+scripts, ...) only pay for the inference itself.
+
+Protocol: one JSON object per line over a Unix domain socket (or a localhost
+TCP port), answered by one JSON object per line. Requests carry a "command":
+
+    {"command": "score", "path": "<file or folder>", "output": "<dir>",
+     "desired_emotion": "happy", "wait": true, "top": 20}
+    {"command": "rescore", "output": "<dir>", "desired_emotion": "sad"}
+    {"command": "status"}                   # server state, or {"job_id": ...}
+    {"command": "cancel", "job_id": 3}
+    {"command": "shutdown"}
+
+Jobs run one at a time on a single worker thread (the models are not thread
+safe); connections are handled concurrently and queue their jobs.
+
+Jobs write files wherever the request says, so only the user running the
+server may connect: the socket is created with mode 0600, by default in a
+0700 directory under $XDG_RUNTIME_DIR (or the temp directory). A server never
+takes over a socket another server is still listening on.
+"""
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from . import timing
+
+
+def _default_socket():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, 'fast-goggles', 'server.sock')
+    user = os.getuid() if hasattr(os, 'getuid') else 'user'
+    return os.path.join(tempfile.gettempdir(), f"fast-goggles-{user}", 'server.sock')
+
+
+DEFAULT_SOCKET = _default_socket()
+JOB_COMMANDS = ('score', 'rescore')
+KEEP_FINISHED_JOBS = 20   # finished jobs kept for status; older ones are forgotten
+
+
+class SocketInUse(RuntimeError):
+    """The socket path belongs to a running server, or to something that isn't ours to replace."""
+
+
+def _private_directory(path):
+    """Create `path` with mode 0700, refusing an existing one that another user controls."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or (hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+        raise SocketInUse(f"{path} is not a directory owned by you; pass --socket to use another path")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+
+
+def _claim_socket(socket_path):
+    """Remove a socket left behind by a server that died; refuse one a server still answers on."""
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode):
+        raise SocketInUse(f"{socket_path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(1)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Nobody listens any more
+        os.unlink(socket_path)
+        return
+    except OSError:
+        # Busy or not ours to probe: not safe to remove either way
+        pass
+    finally:
+        probe.close()
+    raise SocketInUse(f"A server is already listening on {socket_path}")
+
+
+class Job:
+    def __init__(self, job_id, request):
+        self.id = job_id
+        self.request = request
+        self.status = 'queued'       # queued -> running -> done / failed / cancelled
+        self.response = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.processor = None
+        self.done = threading.Event()
+
+    def describe(self):
+        info = {
+            'job_id': self.id,
+            'command': self.request['command'],
+            'path': self.request.get('path') or self.request.get('output'),
+            'status': self.status,
+        }
+        if self.started:
+            info['queued_seconds'] = round(self.started - self.submitted, 3)
+        if self.started and self.finished:
+            info['run_seconds'] = round(self.finished - self.started, 3)
+        return info
+
+
+class ScoringServer:
+    """
+    Owns the warm models, the job queue and the worker thread.
+
+    Args:
+        output_dir (str): Default output directory for jobs that don't name one
+        desired_emotion (str): Default emotion for jobs that don't name one
+        time_debug (bool): Collect timing spans for every job
+    """
+
+    def __init__(self, output_dir=None, desired_emotion='happy', time_debug=False):
+        self.output_dir = output_dir
+        self.desired_emotion = desired_emotion
+        self.time_debug = time_debug
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.current_job = None
+        self.started = time.time()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run_jobs, name='scoring-worker', daemon=True)
+        self._server = None
+        self._socket_path = None
+
+    def load_models(self):
+        from .pipeline import ImageProcessor
+        ImageProcessor(None, tempfile.gettempdir(), self.desired_emotion).load_models()
+
+    def _make_processor(self, request):
+        from .pipeline import ImageProcessor
+        output_dir = request.get('output') or self.output_dir
+        if not output_dir:
+            raise ValueError("No output directory given and the server has no default (--output)")
+        path = request.get('path')
+        input_dir = Path(path) if path and Path(path).is_dir() else None
+        return ImageProcessor(input_dir, output_dir, request.get('desired_emotion') or self.desired_emotion,
+                              time_debug=self.time_debug, priority=bool(request.get('priority')))
+
+    def _execute(self, job):
+        request = job.request
+        processor = job.processor = self._make_processor(request)
+        top = request.get('top', 20)
+
+        if request['command'] == 'rescore':
+            results = processor.rescore_directory()
+        else:
+            path = Path(request.get('path', ''))
+            if path.is_dir():
+                results = processor.process_directory()
+            elif path.is_file():
+                return {'results': [processor.process_file(path)]}
+            else:
+                raise FileNotFoundError(f"No such file or folder: {path}")
+
+        ranking = [{'image_name': r['image_name'], 'score': r['score']} for r in results]
+        return {
+            'count': len(results),
+            'ranking': ranking[:top] if top else ranking,
+            'output': str(processor.output_dir),
+        }
+
+    def _run_jobs(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            if job.status == 'cancelled':
+                job.finished = time.time()
+                with self._lock:
+                    self._prune_jobs()
+                job.done.set()
+                continue
+
+            with self._lock:
+                self.current_job = job
+                job.status = 'running'
+                job.started = time.time()
+            try:
+                with timing.span('job', command=job.request['command']):
+                    response = self._execute(job)
+                job.response = dict(response, ok=True, job_id=job.id)
+                job.status = 'cancelled' if job.status == 'cancelled' else 'done'
+            except Exception as e:
+                job.response = {'ok': False, 'job_id': job.id, 'error': str(e)}
+                job.status = 'failed'
+            finally:
+                job.finished = time.time()
+                job.processor = None
+                with self._lock:
+                    self.current_job = None
+                    self._prune_jobs()
+                job.done.set()
+
+    def _prune_jobs(self):
+        """Forget the oldest finished jobs beyond KEEP_FINISHED_JOBS; call with the lock held."""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished is not None]
+        for job_id in finished[:-KEEP_FINISHED_JOBS]:
+            del self.jobs[job_id]
+
+    def submit(self, request):
+        job = Job(next(self._ids), request)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return {'ok': False, 'error': f"Unknown job {job_id}"}
+            if job.status == 'queued':
+                job.status = 'cancelled'
+            elif job.status == 'running':
+                # Folder jobs stop after the current image; single images just finish
+                job.status = 'cancelled'
+                if job.processor is not None:
+                    job.processor.request_stop()
+            return {'ok': True, **job.describe()}
+
+    def status(self, job_id=None):
+        with self._lock:
+            if job_id is not None:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return {'ok': False, 'error': f"Unknown job {job_id}"}
+                response = {'ok': True, **job.describe()}
+                if job.done.is_set() and job.response:
+                    response['result'] = job.response
+                elif job.processor is not None and job.processor.input_dir is not None:
+                    # Best-so-far ranking of a folder that is still being scored
+                    response['provisional'] = job.processor.provisional_ranking(top=job.request.get('top', 20))
+                return response
+            return {
+                'ok': True,
+                'pid': os.getpid(),
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'queued': sum(1 for job in self.jobs.values() if job.status == 'queued'),
+                'current_job': self.current_job.describe() if self.current_job else None,
+                'jobs': [job.describe() for job in list(self.jobs.values())[-KEEP_FINISHED_JOBS:]],
+            }
+
+    def handle_request(self, request):
+        command = request.get('command')
+        if command in JOB_COMMANDS:
+            job = self.submit(request)
+            if not request.get('wait', True):
+                return {'ok': True, **job.describe()}
+            job.done.wait()
+            return job.response
+        if command == 'status':
+            return self.status(request.get('job_id'))
+        if command == 'cancel':
+            return self.cancel(request.get('job_id'))
+        if command == 'shutdown':
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {'ok': True, 'status': 'shutting down'}
+        return {'ok': False, 'error': f"Unknown command: {command!r}"}
+
+    def listen(self, socket_path=None, port=None, host='127.0.0.1'):
+        """
+        Open the socket (or localhost TCP port) that serve() answers on.
+
+        Raises:
+            SocketInUse: Another server is listening on the socket path
+        """
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        response = server.handle_request(json.loads(line))
+                    except Exception as e:
+                        response = {'ok': False, 'error': str(e)}
+                    self.wfile.write((json.dumps(response) + '\n').encode())
+                    self.wfile.flush()
+
+        if port is not None:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+            self._socket_path = None
+        else:
+            socket_path = socket_path or DEFAULT_SOCKET
+            if socket_path == DEFAULT_SOCKET:
+                _private_directory(os.path.dirname(socket_path))
+            _claim_socket(socket_path)
+            # Created 0600 from the start, so no other user can connect in between
+            umask = os.umask(0o177)
+            try:
+                self._server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+            finally:
+                os.umask(umask)
+            self._socket_path = socket_path
+        self._server.daemon_threads = True
+
+    def serve(self, socket_path=None, port=None, host='127.0.0.1'):
+        """Start the worker and serve requests until shutdown() is called (listens first if needed)."""
+        if self._server is None:
+            self.listen(socket_path, port, host)
+
+        self._worker.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if self._socket_path and os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+    def shutdown(self):
+        self.queue.put(None)
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def send_request(request, socket_path=None, port=None, host='127.0.0.1', timeout=None):
+    """
+    Send one request to a running server and return its decoded response.
+    Only needs the standard library, so clients start instantly.
+    """
+    if port is not None:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path or DEFAULT_SOCKET)
+    with sock:
+        sock.sendall((json.dumps(request) + '\n').encode())
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Server closed the connection without answering")
+    return json.loads(line)
@@ -1,6 +1,93 @@
 # Thresholds
 object_confidence_threshhold = 0.45 # Out of 1
 pose_visibility_threshhold = 0.45 # Out of 1
+# Video ingest
+video_sample_interval = 1.0 # Seconds between frames sampled from a clip
+video_scene_threshold = 0.25 # Frame difference (0-1) that counts as a scene change and is sampled immediately
+video_min_difference = 0.02 # Sampled frames closer than this (0-1) to the last analyzed frame are skipped
+# Temporal coherence (--temporal-coherence): reuse the previous frame's face and person boxes
+temporal_full_every = 10 # Run a full detection at least every this many frames
+temporal_max_difference = 0.08 # Frame difference (0-1) to the last full detection that forces a new one
+# Bursts: consecutive shots from the same camera at most this many seconds apart are grouped
+burst_max_gap = 1.0
+# Priority scheduling (--priority): a cheap proxy score decides which images are analyzed first
+proxy_preview_size = 512 # Longest side of the preview the proxy is computed on
+proxy_sharpness_reference = 200.0 # Laplacian variance (on the preview) that counts as fully sharp
+provisional_publish_interval = 5.0 # Seconds between provisional summary.json / ranking.json updates
+# Time budget (--time-budget): quality tiers from best to fastest. 'cost' is the expected time
+# per image relative to the first tier, used until a tier's real throughput has been measured.
+# max_side: working resolution (longest side, None = original); emotion_faces: classify only the largest N faces
+quality_tiers = [
+    {'name': 'full', 'pose_complexity': 2, 'region_sweep': True, 'max_side': None, 'emotion_faces': None, 'cost': 1.0},
+    {'name': 'no_sweep', 'pose_complexity': 2, 'region_sweep': False, 'max_side': None, 'emotion_faces': None, 'cost': 0.5},
+    {'name': 'medium', 'pose_complexity': 1, 'region_sweep': False, 'max_side': 1920, 'emotion_faces': 6, 'cost': 0.3},
+    {'name': 'fast', 'pose_complexity': 0, 'region_sweep': False, 'max_side': 1280, 'emotion_faces': 3, 'cost': 0.18},
+    {'name': 'fastest', 'pose_complexity': 0, 'region_sweep': False, 'max_side': 960, 'emotion_faces': 1, 'cost': 0.1},
+]
+budget_safety_margin = 0.9 # Plan to use only this fraction of the remaining time
+# Decoding ahead and the memory budget (--max-memory)
+decode_lookahead = 2 # Images decoded ahead of the one being analyzed
+decode_workers = 2 # Threads decoding ahead
+raw_decode_bytes_per_pixel = 16 # Peak while developing a RAW file: sensor data, 16-bit working image, output and copies
+image_decode_bytes_per_pixel = 6 # Peak while decoding a JPEG/PNG, including the detectors' RGB copies
+default_frame_pixels = 24000000 # Assumed frame size when the header has no dimensions
+# Distributed mode (--distributed): lease-based job ledger on the shared output directory
+ledger_lease_seconds = 120 # A claim expires this long after its last renewal (renewed every third of it)
+ledger_lock_seconds = 10 # An items.lock this old without items.json was left by a node that died while publishing
+ledger_clock_skew = 30 # Extra seconds before an expired lease is reclaimed, for clocks that differ between machines
+ledger_poll_interval = 5 # Seconds between checks for reclaimable work while other nodes finish
+# Per-file isolation (--isolate): each file is analyzed in a worker process that is restarted on a hang or crash
+file_timeout = 300 # Seconds one file may take (decode plus detection) before its worker is killed
+worker_start_timeout = 600 # Seconds a fresh worker may take to load the models
+isolation_retries = 1 # Retries of a failed file, using only its reduced-resolution preview
+degraded_preview_size = 1600 # Longest side of the preview analyzed on a retry
+dcraw_timeout = 120 # Seconds before the dcraw fallback for RAW files is abandoned
+# Detector backends per stage (see src/backends.py). 'onnx' needs onnxruntime and the exported models
+backends = {'object': 'ultralytics', 'pose': 'mediapipe', 'face': 'mediapipe', 'emotion': 'deepface', 'identity': 'sface'}
+models_dir = 'models' # Every model file is loaded from here (see src/model_store.py); a relative path is relative to the repository
+# Files fetched by `main models prefetch`; ONNX exports and int8 models are created locally instead
+model_downloads = {
+    'yolov8n.pt': 'https://github.com/ultralytics/assets/releases/download/v0.0.0/yolov8n.pt',
+    'deepface/.deepface/weights/facial_expression_model_weights.h5': 'https://github.com/serengil/deepface_models/releases/download/v1.0/facial_expression_model_weights.h5',
+    'deploy.prototxt': 'https://raw.githubusercontent.com/opencv/opencv/4.10.0/samples/dnn/face_detector/deploy.prototxt',
+    'res10_300x300_ssd_iter_140000.caffemodel': 'https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel',
+    'face_recognition_sface_2021dec.onnx': 'https://github.com/opencv/opencv_zoo/raw/refs/heads/main/models/face_recognition_sface/face_recognition_sface_2021dec.onnx',
+}
+# SHA-256 enforced on download and load. Files not listed are pinned in models/manifest.json on first download or use
+model_checksums = {
+    'deploy.prototxt': 'dcd661dc48fc9de0a341db1f666a2164ea63a67265c7f779bc12d6b3f2fa67e9',
+    'res10_300x300_ssd_iter_140000.caffemodel': '2a56a11a57a4a295956b0660b4a3d76bbdca2206c4961cea8efe7d95c7cb2f2d',
+}
+model_auto_fetch = True # Download a missing file on first use; set to False on air-gapped machines to fail fast instead
+model_warmup = False # Run one inference on a blank frame when the models load (--warm-up)
+onnx_models = {'object': 'yolov8n.onnx', 'emotion': 'emotion.onnx'}
+onnx_quantized_models = {'object': 'yolov8n.int8.onnx', 'emotion': 'emotion.int8.onnx'} # Built by `main quantize calibrate`
+calibration_images = 64 # Images (object) or faces (emotion) used to calibrate the int8 models
+onnx_graph_optimization = 'all' # disabled, basic, extended or all
+onnx_threads = None # Intra-op threads per session; None follows the thread budget (--threads)
+object_confidence = 0.25 # Minimum class score of an ONNX object detection (ultralytics' default)
+object_iou = 0.7 # IoU above which overlapping boxes of the same class are suppressed
+face_dnn_files = {'config': 'deploy.prototxt', 'weights': 'res10_300x300_ssd_iter_140000.caffemodel'} # face=opencv_dnn, fetched by prep.py
+face_dnn_confidence = 0.5 # Minimum confidence of an OpenCV DNN face detection (as MediaPipe's min_detection_confidence)
+face_batch_size = 16 # Previews per face detector pass in the --priority pre-pass (batching backends only)
+debug_render_size = 1600 # Longest side of the images drawn by debug_data.py (0 for full resolution)
+debug_jpeg_quality = 90 # JPEG quality of the debug images
+# Contact sheets (`main contact-sheet`, see src/contact_sheet.py)
+contact_sheet_columns = 6
+contact_sheet_rows = 5
+contact_sheet_tile_size = 320 # Longest side of a thumbnail in pixels
+contact_sheet_gap = 8 # Pixels between thumbnails
+contact_sheet_quality = 88 # JPEG quality of the pages
+contact_sheet_encoders = 2 # Pages encoded in parallel
+# Face identity (see src/face_identity.py)
+face_embeddings = False # Add an identity embedding to every face during analysis (--embed-faces)
+identity_model = 'face_recognition_sface_2021dec.onnx' # OpenCV SFace model in models_dir
+identity_batch_size = 32 # Faces per forward pass of the identity model
+identity_margin = 0.1 # Border added around a face box before embedding it, relative to the box size
+identity_threshold = 0.363 # Cosine similarity from which two faces count as the same person (SFace's value for aligned faces; backends without keypoints give box crops, which score lower)
+identity_weight = 0.5 # Share of the similarity in the find-person ranking; the rest is the normalized score
+face_index_ivf_min = 20000 # Indexed faces from which find-person searches the approximate (IVF) index
+face_index_probe = 8 # IVF clusters compared per reference face
 # Configure the biases for the images recommendation
 image_raw_bias_settings = [   
     {'biasamount': 0.1, 'id': 0, 'name': 'person'},
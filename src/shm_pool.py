@@ -0,0 +1,225 @@
+"""
+Shared-memory frame transport between decoder processes and the analysis process.
+
+Pickling a full-resolution frame through a pipe costs about as much as
+decoding it. Instead, a FramePool owns a fixed set of shared-memory slots:
+a decoder process copies its frame into a free slot and only sends back a
+small FrameHandle, and the analysis process gets a zero-copy NumPy view of
+the slot. A slot returns to the pool when every stage holding it has
+released it. Handles carry a generation number, so a view requested after
+the slot was recycled fails loudly instead of showing another frame.
+close() reports slots that were never released.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+from . import resources
+
+LABEL_SIZE = 96
+SHM_DIR = '/dev/shm'
+
+FrameHandle = namedtuple('FrameHandle', ['slot', 'generation', 'shape', 'dtype', 'label'])
+
+
+class FramePool:
+    """
+    Fixed pool of shared-memory frame slots, usable from several processes.
+
+    The pool is created in the main process and handed to worker processes
+    when they start (e.g. as an initializer argument); they attach lazily.
+
+    Args:
+        slots (int): Number of frames that can be in flight at once
+        slot_bytes (int): Size of each slot; larger frames are refused by put()
+        context: multiprocessing context used for the shared bookkeeping
+    """
+
+    def __init__(self, slots, slot_bytes, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self.slot_bytes = slot_bytes
+        self._segments = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+        self.names = [segment.name for segment in self._segments]
+        self._free = context.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        # Reference counts, generations and labels live in shared memory too
+        self._refs = context.Array('i', slots)
+        self._generations = context.Array('i', slots, lock=False)
+        self._labels = context.Array('c', slots * LABEL_SIZE, lock=False)
+        self._owner = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_segments'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._owner = False
+        self._segments = [None] * len(self.names)
+
+    def _buffer(self, slot):
+        if self._segments[slot] is None:
+            if sys.version_info >= (3, 13):
+                self._segments[slot] = shared_memory.SharedMemory(name=self.names[slot], track=False)
+            else:
+                self._segments[slot] = shared_memory.SharedMemory(name=self.names[slot])
+        return self._segments[slot].buf
+
+    def put(self, image, label='', stages=1, timeout=None):
+        """
+        Copy `image` into a free slot, waiting for one if necessary.
+
+        Args:
+            image (numpy.ndarray): Frame to share
+            label (str): Shown in leak reports (e.g. the file name)
+            stages (int): Number of release() calls before the slot is reused
+
+        Returns:
+            FrameHandle, or None if the frame doesn't fit in a slot
+        """
+        import numpy as np
+        if image.nbytes > self.slot_bytes:
+            return None
+        slot = self._free.get(timeout=timeout)
+        with self._refs.get_lock():
+            self._refs[slot] = stages
+            self._generations[slot] += 1
+            generation = self._generations[slot]
+        encoded = label.encode('utf-8', 'replace')[:LABEL_SIZE].ljust(LABEL_SIZE, b'\0')
+        self._labels[slot * LABEL_SIZE:(slot + 1) * LABEL_SIZE] = encoded
+        view = np.ndarray(image.shape, dtype=image.dtype, buffer=self._buffer(slot))
+        view[...] = image
+        return FrameHandle(slot, generation, tuple(image.shape), image.dtype.str, label)
+
+    def view(self, handle):
+        """Zero-copy NumPy view of the frame behind `handle`."""
+        import numpy as np
+        with self._refs.get_lock():
+            if self._generations[handle.slot] != handle.generation or self._refs[handle.slot] <= 0:
+                raise ValueError(f"Stale frame handle for slot {handle.slot} ({handle.label})")
+        return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=self._buffer(handle.slot))
+
+    def release(self, handle):
+        """Drop one stage's hold on a frame; the slot is reused after the last one."""
+        with self._refs.get_lock():
+            if self._generations[handle.slot] != handle.generation or self._refs[handle.slot] <= 0:
+                raise ValueError(f"Frame handle for slot {handle.slot} ({handle.label}) released twice")
+            self._refs[handle.slot] -= 1
+            freed = self._refs[handle.slot] == 0
+        if freed:
+            self._free.put(handle.slot)
+
+    def in_use(self):
+        """(slot, label) of every slot that is still held."""
+        held = []
+        with self._refs.get_lock():
+            for slot in range(len(self.names)):
+                if self._refs[slot] > 0:
+                    label = bytes(self._labels[slot * LABEL_SIZE:(slot + 1) * LABEL_SIZE]).rstrip(b'\0')
+                    held.append((slot, label.decode('utf-8', 'replace')))
+        return held
+
+    def close(self):
+        """
+        Detach (and, in the creating process, free) the shared memory.
+
+        Returns:
+            list: (slot, label) of frames that were never released, i.e. leaks
+        """
+        leaks = self.in_use()
+        for segment in self._segments:
+            if segment is None:
+                continue
+            try:
+                segment.close()
+            except BufferError:
+                # A view is still alive somewhere; the mapping goes away with it
+                pass
+            if self._owner:
+                segment.unlink()
+        self._segments = [None] * len(self.names)
+        return leaks
+
+
+def shared_memory_available():
+    """Free bytes in the shared-memory filesystem, or None where that can't be determined."""
+    if not os.path.isdir(SHM_DIR):
+        return None
+    stats = os.statvfs(SHM_DIR)
+    return stats.f_bavail * stats.f_frsize
+
+
+_worker_pool = None
+
+
+def _init_decoder(pool, resource_config, counter):
+    # Decoder processes take the indexes after the analysis worker's (0) for --cpu-affinity auto
+    global _worker_pool
+    _worker_pool = pool
+    resources.init_worker(resource_config, counter)
+
+
+def _decode_into_pool(path):
+    from .image_loader import load_image
+    image = load_image(path)
+    handle = _worker_pool.put(image, Path(path).name)
+    # Frames larger than a slot fall back to being pickled
+    return handle if handle is not None else image
+
+
+class ProcessDecoder:
+    """
+    Decodes images in separate processes and hands them over through a FramePool.
+
+    Args:
+        processes (int): Number of decoder processes
+        slots (int): Frames in flight (decoded ahead plus the one being analyzed)
+        slot_bytes (int): Largest decoded frame expected
+    """
+
+    def __init__(self, processes, slots, slot_bytes):
+        available = shared_memory_available()
+        if available is not None and slots * slot_bytes > available:
+            raise MemoryError(f"Not enough shared memory in {SHM_DIR} for {slots} frames "
+                              f"of {slot_bytes} bytes ({available} bytes free)")
+        context = multiprocessing.get_context('spawn')
+        self.pool = FramePool(slots, slot_bytes, context)
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_decoder,
+                                             initargs=(self.pool, resources.get_config(), context.Value('i', 1)))
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """Decode `path` in a worker process and return a view of the frame."""
+        result = self._executor.submit(_decode_into_pool, str(path)).result()
+        if not isinstance(result, FrameHandle):
+            return result
+        with self._lock:
+            self._handles[str(path)] = result
+        return self.pool.view(result)
+
+    def release(self, path):
+        """Return the slot of `path` to the pool once the frame has been analyzed."""
+        with self._lock:
+            handle = self._handles.pop(str(path), None)
+        if handle is not None:
+            self.pool.release(handle)
+
+    def release_all(self):
+        """Release frames that were decoded ahead but will not be analyzed (early stop)."""
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), {}
+        for handle in handles:
+            self.pool.release(handle)
+
+    def close(self):
+        """Stop the decoder processes and free the pool; returns leaked (slot, label) pairs."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        return self.pool.close()
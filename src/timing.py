@@ -0,0 +1,228 @@
+"""
+Lightweight hierarchical span timing for the processing pipeline.
+
+Spans are opened with ``span(name)`` anywhere in the code base. While no
+SpanTimer is active the call returns a shared no-op context manager, so the
+instrumentation costs a single global lookup when timing is disabled.
+When a timer is active, spans nest per thread (e.g. ``process_image/face_detection/emotion``),
+durations are measured with ``time.perf_counter_ns`` and aggregated per span
+path, and every span can be exported as a Chrome trace / Perfetto JSON file.
+"""
+import json
+import os
+import threading
+import time
+
+_active_timer = None
+
+
+class _NullSpan:
+    """Span returned while timing is disabled; does nothing."""
+    elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('timer', 'name', 'args', 'path', 'start_ns', 'elapsed')
+
+    def __init__(self, timer, name, args):
+        self.timer = timer
+        self.name = name
+        self.args = args
+        self.path = None
+        self.start_ns = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        stack = self.timer._stack()
+        self.path = f"{stack[-1]}/{self.name}" if stack else self.name
+        stack.append(self.path)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        self.timer._stack().pop()
+        self.elapsed = duration_ns / 1e9
+        self.timer._record(self, duration_ns)
+        return False
+
+
+class SpanStats:
+    """Aggregated durations for one span path."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.samples = []
+        # Log2 histogram: bucket b holds durations in [2**(b-1), 2**b) nanoseconds
+        self.buckets = {}
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        self.min_ns = duration_ns if self.min_ns is None else min(self.min_ns, duration_ns)
+        self.samples.append(duration_ns)
+        bucket = duration_ns.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, q):
+        """Return the q-th percentile (0-100) in seconds using linear interpolation."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = (len(ordered) - 1) * q / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        value = ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+        return value / 1e9
+
+    def histogram(self):
+        """Return a list of (lower_seconds, upper_seconds, count) buckets in ascending order."""
+        return [
+            ((1 << (bucket - 1)) / 1e9 if bucket else 0.0, (1 << bucket) / 1e9, count)
+            for bucket, count in sorted(self.buckets.items())
+        ]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total_ns / 1e9,
+            'mean': self.total_ns / self.count / 1e9 if self.count else 0.0,
+            'min': (self.min_ns or 0) / 1e9,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max_ns / 1e9,
+        }
+
+
+class SpanTimer:
+    """
+    Collects nested timing spans.
+
+    Args:
+        record_events (bool): Keep every individual span so it can be exported
+            as a Chrome trace. Aggregated statistics are always kept.
+    """
+
+    def __init__(self, record_events=True):
+        self.record_events = record_events
+        self.stats = {}
+        self.events = []
+        self._origin_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span, duration_ns):
+        with self._lock:
+            stats = self.stats.get(span.path)
+            if stats is None:
+                stats = self.stats[span.path] = SpanStats()
+            stats.add(duration_ns)
+            if self.record_events:
+                self.events.append((span.name, span.path, span.start_ns, duration_ns,
+                                    threading.get_ident(), span.args))
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def drain(self):
+        """Remove and return the events recorded so far, resetting the statistics (see add_events())."""
+        with self._lock:
+            events, self.events, self.stats = self.events, [], {}
+        return events
+
+    def add_events(self, events):
+        """
+        Record spans measured by another timer, e.g. drained in the isolated
+        worker process. They keep their own paths; start times are comparable
+        because perf_counter_ns is the system's monotonic clock.
+        """
+        with self._lock:
+            for event in events:
+                path, duration_ns = event[1], event[3]
+                stats = self.stats.get(path)
+                if stats is None:
+                    stats = self.stats[path] = SpanStats()
+                stats.add(duration_ns)
+                if self.record_events:
+                    self.events.append(tuple(event))
+
+    def total(self, path):
+        """Total seconds spent in the span with the given path."""
+        stats = self.stats.get(path)
+        return stats.total_ns / 1e9 if stats else 0.0
+
+    def summary(self):
+        """Return {span_path: statistics dict} ordered so children follow their parent."""
+        return {path: self.stats[path].to_dict() for path in sorted(self.stats)}
+
+    def chrome_trace(self):
+        """Build a Chrome trace (``chrome://tracing`` / Perfetto) compatible dictionary."""
+        pid = os.getpid()
+        trace_events = []
+        for name, path, start_ns, duration_ns, tid, args in self.events:
+            event_args = {'path': path}
+            event_args.update({key: str(value) for key, value in args.items()})
+            trace_events.append({
+                'name': name,
+                'cat': path.split('/', 1)[0],
+                'ph': 'X',
+                'ts': (start_ns - self._origin_ns) / 1000,
+                'dur': duration_ns / 1000,
+                'pid': pid,
+                'tid': tid,
+                'args': event_args,
+            })
+        return {
+            'traceEvents': trace_events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'span_summary': self.summary()},
+        }
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+def set_active_timer(timer):
+    """Make `timer` receive all spans opened via span(); pass None to disable timing."""
+    global _active_timer
+    _active_timer = timer
+
+
+def get_active_timer():
+    return _active_timer
+
+
+def span(name, **args):
+    """
+    Open a timing span on the active timer.
+
+    Usage:
+        with span('face_detection'):
+            ...
+    """
+    timer = _active_timer
+    if timer is None:
+        return NULL_SPAN
+    return timer.span(name, **args)
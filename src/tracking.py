@@ -0,0 +1,74 @@
+"""
+Temporal coherence for time-ordered inputs (burst sequences, video frames).
+
+People barely move between consecutive frames, so after a full detection the
+next frames only re-run the cheap per-region stages (emotion on the previous
+face boxes, single-person pose inside the previous person boxes) and keep the
+previous objects. A full detection runs again every `full_every` frames, when
+the picture changed by more than `max_difference`, or when there was nobody
+to track.
+"""
+from . import settings
+from .video import frame_difference, frame_signature
+
+
+def pose_box(landmarks, min_visibility=0.3):
+    """Bounding box (x1, y1, x2, y2) of a pose given as a list of landmark dicts."""
+    points = [(l['x'], l['y']) for l in landmarks if l.get('visibility', 1.0) >= min_visibility]
+    if not points:
+        return None
+    xs, ys = zip(*points)
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def person_boxes(results):
+    """Person boxes of a frame: YOLO 'person' detections, or the pose extents if there are none."""
+    boxes = [obj['box'] for obj in results['objects'] if obj['label'] == 'person']
+    if not boxes:
+        boxes = [box for box in (pose_box(pose) for pose in results['poses']) if box is not None]
+    return boxes
+
+
+class FrameTracker:
+    """
+    Decides per frame whether a full detection is needed and remembers the last results.
+
+    Args:
+        full_every (int): Run a full detection at least every this many frames
+        max_difference (float): Frame difference (0-1) to the last fully detected
+            frame above which a full detection runs
+    """
+
+    def __init__(self, full_every=None, max_difference=None):
+        self.full_every = settings.temporal_full_every if full_every is None else full_every
+        self.max_difference = settings.temporal_max_difference if max_difference is None else max_difference
+        self.stats = {'full': 0, 'tracked': 0}
+        self.reset()
+
+    def reset(self):
+        """Forget the previous frame, e.g. when the next input is unrelated."""
+        self.previous = None
+        self.reference_signature = None
+        self.frames_since_full = 0
+
+    def needs_full_detection(self, image):
+        """Return True if `image` should get a full detection rather than tracking."""
+        self._signature = frame_signature(image)
+        if self.previous is None or self.reference_signature is None:
+            return True
+        if self.frames_since_full + 1 >= self.full_every:
+            return True
+        if not self.previous['faces'] and not person_boxes(self.previous):
+            return True
+        return frame_difference(self._signature, self.reference_signature) > self.max_difference
+
+    def update(self, results, full):
+        """Record the results of the frame that was just analyzed."""
+        self.previous = results
+        if full:
+            self.reference_signature = self._signature
+            self.frames_since_full = 0
+            self.stats['full'] += 1
+        else:
+            self.frames_since_full += 1
+            self.stats['tracked'] += 1
@@ -0,0 +1,101 @@
+"""
+Frame sampling for video clips.
+
+Frames are decoded sequentially with OpenCV. Only every `check_step`-th frame is
+converted and compared; a frame is sampled when `interval` seconds passed since
+the last sample or when the picture changed by more than `scene_threshold`
+(a scene change). Sampled frames that barely differ from the last analyzed
+frame are skipped, so a static shot is only analyzed once.
+"""
+from pathlib import Path
+
+from . import settings
+from .timing import span
+
+VIDEO_FORMATS = ['.mp4', '.mov', '.m4v', '.avi', '.mkv', '.mts', '.m2ts', '.webm']
+
+# Size of the grayscale thumbnail used to compare frames
+SIGNATURE_SIZE = (64, 36)
+
+
+def is_video(path):
+    return Path(path).suffix.lower() in VIDEO_FORMATS
+
+
+def frame_signature(frame):
+    """Small normalized grayscale thumbnail used to compare frames cheaply."""
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+
+def frame_difference(signature_a, signature_b):
+    """Mean absolute difference of two signatures (0.0 identical - 1.0 inverted)."""
+    import numpy as np
+    return float(np.mean(np.abs(signature_a - signature_b)))
+
+
+def sample_frames(video_path, interval=None, scene_threshold=None, min_difference=None, check_interval=0.25):
+    """
+    Decode a video and yield the frames worth analyzing.
+
+    Args:
+        video_path (str): Path to the video file
+        interval (float): Seconds between sampled frames (0 disables interval sampling)
+        scene_threshold (float): Difference to the previous checked frame that
+            triggers a sample (0 disables scene change detection)
+        min_difference (float): Sampled frames closer than this to the last
+            yielded frame are skipped
+        check_interval (float): Seconds between frames that are decoded and compared
+
+    Yields:
+        tuple: (timestamp in seconds, frame index, BGR frame)
+    """
+    import cv2
+    interval = settings.video_sample_interval if interval is None else interval
+    scene_threshold = settings.video_scene_threshold if scene_threshold is None else scene_threshold
+    min_difference = settings.video_min_difference if min_difference is None else min_difference
+
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {video_path}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        check_step = max(1, int(round(fps * check_interval)))
+        if interval:
+            check_step = min(check_step, max(1, int(round(fps * interval))))
+
+        frame_index = -1
+        last_checked = None
+        last_yielded = None
+        last_sample_time = None
+        while True:
+            # grab() skips the color conversion of frames that are never looked at
+            with span('video_decode'):
+                if not capture.grab():
+                    break
+            frame_index += 1
+            if frame_index % check_step:
+                continue
+            with span('video_decode'):
+                ok, frame = capture.retrieve()
+            if not ok:
+                break
+
+            timestamp = frame_index / fps
+            signature = frame_signature(frame)
+            due = last_sample_time is None or (interval and timestamp - last_sample_time >= interval)
+            scene_change = (scene_threshold and last_checked is not None
+                            and frame_difference(signature, last_checked) >= scene_threshold)
+            last_checked = signature
+            if not (due or scene_change):
+                continue
+
+            last_sample_time = timestamp
+            if last_yielded is not None and frame_difference(signature, last_yielded) < min_difference:
+                continue
+            last_yielded = signature
+            yield timestamp, frame_index, frame
+    finally:
+        capture.release()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Overlay placement test for the debug renderer.
+Checks that load_working_image() maps result coordinates onto the downscaled
+image correctly, including JPEGs whose EXIF orientation rotates them by 90
+degrees (decoders apply the rotation, the header keeps the stored size).
+
+Run directly (`python3 test_debug_data.py`) or through pytest.
+"""
+
+import struct
+import sys
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.metadata import read_metadata
+from src.overlays import load_working_image
+
+# Stored (unrotated) size of the test image, and the marker drawn on it
+WIDTH, HEIGHT = 800, 600
+MARKER = (600, 100, 700, 200)  # x1, y1, x2, y2 in stored pixels
+MAX_SIDE = 200
+
+# How each orientation turns the stored pixels into the displayed image
+ROTATIONS = {1: None, 3: cv2.ROTATE_180, 6: cv2.ROTATE_90_CLOCKWISE, 8: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+def jpeg_with_orientation(image, orientation):
+    """Encode `image` as a JPEG with an Exif APP1 segment holding only the Orientation tag."""
+    ok, data = cv2.imencode('.jpg', image)
+    assert ok
+    data = data.tobytes()
+    ifd = struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('<I', 0)
+    payload = b'Exif\0\0' + b'II*\0' + struct.pack('<I', 8) + ifd
+    app1 = b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+    return data[:2] + app1 + data[2:]
+
+
+def marker_box(orientation):
+    """The marker's box in the coordinates of the decoded (rotated) full image, as results store it."""
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    x1, y1, x2, y2 = MARKER
+    mask[y1:y2, x1:x2] = 255
+    if ROTATIONS[orientation] is not None:
+        mask = cv2.rotate(mask, ROTATIONS[orientation])
+    ys, xs = np.nonzero(mask)
+    return [int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1]
+
+
+def check_orientation(directory, orientation, with_metadata):
+    image = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    x1, y1, x2, y2 = MARKER
+    image[y1:y2, x1:x2] = 255
+    path = Path(directory) / f"oriented_{orientation}.jpg"
+    path.write_bytes(jpeg_with_orientation(image, orientation))
+
+    results = {'image_name': path.name}
+    if with_metadata:
+        results['metadata'] = read_metadata(path)
+    preview, scale = load_working_image(path, results, MAX_SIDE)
+
+    rotated = orientation in (5, 6, 7, 8)
+    full_width = HEIGHT if rotated else WIDTH
+    assert abs(scale - preview.shape[1] / full_width) < 1e-9, (
+        f"orientation {orientation}: scale {scale:.4f}, expected {preview.shape[1] / full_width:.4f}")
+
+    # The marker has to be where its scaled box says, with a pixel of slack for rounding
+    bx1, by1, bx2, by2 = (int(round(v * scale)) for v in marker_box(orientation))
+    inside = preview[by1 + 1:by2 - 1, bx1 + 1:bx2 - 1]
+    assert inside.size and inside.mean() > 200, f"orientation {orientation}: marker not under its box"
+    outside = preview.copy()
+    outside[max(by1 - 1, 0):by2 + 1, max(bx1 - 1, 0):bx2 + 1] = 0
+    assert outside.mean() < 5, f"orientation {orientation}: marker drawn outside its box"
+
+
+def test_scale_follows_exif_orientation():
+    with tempfile.TemporaryDirectory() as directory:
+        for orientation in ROTATIONS:
+            for with_metadata in (True, False):
+                check_orientation(directory, orientation, with_metadata)
+
+
+def test_full_resolution_is_unscaled():
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'rotated.jpg'
+        path.write_bytes(jpeg_with_orientation(np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8), 6))
+        image, scale = load_working_image(path, {'image_name': path.name}, 0)
+        assert scale == 1.0 and image.shape[:2] == (WIDTH, HEIGHT)
+
+
+def main():
+    failures = 0
+    for test in (test_scale_follows_exif_orientation, test_full_resolution_is_unscaled):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
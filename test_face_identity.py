@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests for the face identity index and face alignment.
+Checks that the approximate (IVF) search finds the same matches as the exact
+search, that FaceIndex.open() reuses the saved index until summary.json
+changes, and that aligned_face() moves the keypoints onto SFace's template.
+
+Run directly (`python3 test_face_identity.py`) or through pytest.
+"""
+
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src import settings
+from src.face_identity import ALIGNMENT_TEMPLATE, INDEX_DIR, FaceIndex, aligned_face, encode_embedding
+
+DIMENSIONS = 128
+PEOPLE = 40
+FACES_PER_PERSON = 50
+
+
+def _people(seed=0):
+    """Normalized embeddings of PEOPLE identities, FACES_PER_PERSON noisy faces each."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(PEOPLE, DIMENSIONS))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    faces = np.repeat(centers, FACES_PER_PERSON, axis=0) + rng.normal(scale=0.05, size=(PEOPLE * FACES_PER_PERSON, DIMENSIONS))
+    faces /= np.linalg.norm(faces, axis=1, keepdims=True)
+    return centers.astype(np.float32), faces.astype(np.float32)
+
+
+def _summary(faces, per_image=4):
+    """summary.json content with the embeddings spread over images of `per_image` faces."""
+    return [{'image_name': f"IMG_{start // per_image:04d}.jpg", 'score': 0.0, 'objects': [],
+             'faces': [{'box': [0, 0, 10, 10], 'emotion': 'happy', 'embedding': encode_embedding(vector)}
+                       for vector in faces[start:start + per_image]]}
+            for start in range(0, len(faces), per_image)]
+
+
+def test_ivf_search_agrees_with_exact_search():
+    centers, faces = _people()
+    index = FaceIndex(faces, [{}] * len(faces))
+    index.build_ivf()
+    for person in range(0, PEOPLE, 7):
+        queries = centers[person:person + 1]
+        exact_rows, exact_similarities = index.search(queries, approximate=False)
+        approx_rows, approx_similarities = index.search(queries, approximate=True)
+        assert len(approx_rows) < len(exact_rows), "the IVF search compared every face"
+        exact = set(exact_rows[exact_similarities >= settings.identity_threshold].tolist())
+        approx = set(approx_rows[approx_similarities >= settings.identity_threshold].tolist())
+        assert exact == set(range(person * FACES_PER_PERSON, (person + 1) * FACES_PER_PERSON)), f"person {person}"
+        assert approx == exact, f"person {person}: IVF missed {len(exact - approx)} match(es)"
+        # The rows both searches compared have the same similarity
+        by_row = dict(zip(exact_rows.tolist(), exact_similarities.tolist()))
+        assert all(abs(by_row[row] - similarity) < 1e-5
+                   for row, similarity in zip(approx_rows.tolist(), approx_similarities.tolist()))
+
+
+def test_index_is_rebuilt_when_summary_changes():
+    _, faces = _people()
+    ivf_min = settings.face_index_ivf_min
+    settings.face_index_ivf_min = 100
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            summary_path = Path(directory) / 'summary.json'
+            summary_path.write_text(json.dumps(_summary(faces[:400])))
+            index = FaceIndex.open(directory)
+            assert len(index) == 400 and index.centroids is not None
+            manifest_path = Path(directory) / INDEX_DIR / 'faces.json'
+            built = manifest_path.stat().st_mtime_ns
+
+            # Unchanged summary: the saved index is loaded, IVF included
+            reopened = FaceIndex.open(directory)
+            assert manifest_path.stat().st_mtime_ns == built
+            assert len(reopened) == 400 and reopened.centroids is not None
+            assert np.allclose(reopened.embeddings, index.embeddings, atol=1e-3)
+
+            # A new run writes another summary: the index follows it
+            time.sleep(0.01)
+            summary_path.write_text(json.dumps(_summary(faces[:60])))
+            rebuilt = FaceIndex.open(directory)
+            assert len(rebuilt) == 60, f"index still has {len(rebuilt)} faces"
+            assert rebuilt.centroids is None and not (Path(directory) / INDEX_DIR / 'ivf.npz').exists()
+            assert rebuilt.faces[-1]['image_name'] == 'IMG_0014.jpg'
+    finally:
+        settings.face_index_ivf_min = ivf_min
+
+
+def test_alignment_moves_keypoints_onto_template():
+    # Keypoint marks of a face twice the template size, tilted by 20 degrees and off-center
+    angle = np.radians(20)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    keypoints = [tuple(2 * rotation @ np.array(point) + (150, 90)) for point in ALIGNMENT_TEMPLATE]
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    for x, y in keypoints:
+        cv2.circle(image, (int(round(x)), int(round(y))), 4, (255, 255, 255), -1)
+
+    face = aligned_face(image, keypoints)
+    assert face.shape[:2] == (112, 112)
+    for x, y in ALIGNMENT_TEMPLATE:
+        x, y = int(round(x)), int(round(y))
+        assert face[y - 1:y + 2, x - 1:x + 2].mean() > 200, f"no keypoint at ({x}, {y}) after alignment"
+    assert aligned_face(image, [(10.0, 10.0)] * 4) is None
+
+
+def main():
+    failures = 0
+    for test in (test_ivf_search_agrees_with_exact_search, test_index_is_rebuilt_when_summary_changes,
+                 test_alignment_moves_keypoints_onto_template):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Failure handling of the isolated worker (--isolate, see src/isolation.py).
+Feeds files that can't be decoded through the worker process and checks that
+they are reported with an 'error' and the reasons of both attempts, the full
+decode and the degraded preview retry, instead of silently getting an empty
+result with a zero score, and that the worker's timing and memory records
+reach the parent's reports.
+
+Run directly (`python3 test_isolation.py`) or through pytest.
+"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from src import settings
+from src.pipeline import ImageProcessor
+
+CORRUPT_FILES = {
+    # A JPEG header followed by garbage: no decoder can make an image of it
+    'broken.jpg': b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + os.urandom(4096),
+    # Not a RAW file at all, whatever its extension says
+    'broken.nef': b'II*\x00' + os.urandom(4096),
+}
+
+
+def test_corrupt_files_fail_with_reason_and_preview_retry():
+    retries = settings.isolation_retries
+    settings.isolation_retries = 1
+    with tempfile.TemporaryDirectory() as directory:
+        input_dir, output_dir = Path(directory) / 'input', Path(directory) / 'output'
+        input_dir.mkdir()
+        for name, data in CORRUPT_FILES.items():
+            (input_dir / name).write_bytes(data)
+        processor = ImageProcessor(input_dir, output_dir, 'happy', isolate=True, file_timeout=120)
+        processor._worker = processor._start_worker()
+        try:
+            for name in CORRUPT_FILES:
+                results = processor._analyze_file(input_dir / name, {})
+                assert results.get('error'), f"{name}: no error recorded, got {results}"
+                failures = results['failures']
+                assert len(failures) == 2, f"{name}: expected the full decode and the preview retry, got {failures}"
+                assert not failures[0].startswith('preview: ') and failures[1].startswith('preview: '), failures
+                assert results['error'] == failures[-1]
+                assert results['faces'] == [] and results['objects'] == []
+                saved = json.loads((output_dir / f"{Path(name).stem}_results.json").read_text())
+                assert saved['error'] == results['error'], f"{name}: saved results have no error"
+            # Errors are reported by the running worker; it doesn't have to be restarted for them
+            assert processor._worker.restarts == 0
+        finally:
+            processor._stop_worker()
+            settings.isolation_retries = retries
+
+
+def test_worker_timing_and_memory_reach_the_parent():
+    with tempfile.TemporaryDirectory() as directory:
+        input_dir, output_dir = Path(directory) / 'input', Path(directory) / 'output'
+        input_dir.mkdir()
+        path = input_dir / 'broken.jpg'
+        path.write_bytes(CORRUPT_FILES['broken.jpg'])
+        processor = ImageProcessor(input_dir, output_dir, 'happy', isolate=True, file_timeout=120,
+                                   time_debug=True, memory_debug=True)
+        processor._worker = processor._start_worker()
+        try:
+            processor._analyze_file(path, {})
+        finally:
+            processor._stop_worker()
+            processor._close_memory_tracker()
+        # Spans measured in the worker, under their own paths: the full decode, then the preview retry
+        spans = processor.timer.stats
+        assert 'process_image/decode' in spans and 'preview_decode' in spans, sorted(spans)
+        assert spans['process_image'].count == 1
+        assert processor.timing_stats['file_times'][str(path)] > 0
+        stages = processor.memory_stats['stages']
+        assert stages['process_image']['count'] == 1, stages
+        assert stages['decode']['count'] == 1, stages
+        assert str(path) in processor.memory_stats['files']
+
+
+def main():
+    failures = 0
+    for test in (test_corrupt_files_fail_with_reason_and_preview_retry,
+                 test_worker_timing_and_memory_reach_the_parent):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
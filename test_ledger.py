@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Multi-process test for the distributed job ledger.
+Starts several node processes on one ledger directory, as distributed mode
+does on a NAS, and checks that every item is processed exactly once, that the
+leases of a node that died are reclaimed, that a node which stalled cannot
+overwrite a reclaimed lease, and that a stale items.lock doesn't block.
+
+Run directly (`python3 test_ledger.py`) or through pytest.
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src import settings
+from src.ledger import Ledger
+
+ITEMS = [f"IMG_{i:04d}.jpg" for i in range(60)]
+LEASE_SECONDS = 1.5
+
+
+def _fast_settings():
+    # Same machine, so no clock skew; short locks so the test doesn't wait
+    settings.ledger_clock_skew = 0
+    settings.ledger_lock_seconds = 0.5
+
+
+def run_node(directory, node_id, work_seconds=0.01, die_after=None):
+    """One node: claim, 'process' (record the item) and complete until nothing is left."""
+    _fast_settings()
+    ledger = Ledger(directory, node_id, lease_seconds=LEASE_SECONDS)
+    ledger.initialize(ITEMS)
+    ledger.start_heartbeat()
+    processed = 0
+    while True:
+        item = ledger.claim()
+        if item is None:
+            if ledger.all_done():
+                break
+            time.sleep(0.05)
+            continue
+        if die_after is not None and processed == die_after:
+            # Crash while holding a lease: no release, no completion
+            os._exit(1)
+        with open(Path(directory) / f"processed.{node_id}", 'a') as f:
+            f.write(item + '\n')
+        time.sleep(work_seconds)
+        ledger.add_results([{'image_name': item, 'faces': [], 'objects': [], 'score': 0.0}])
+        ledger.complete(item)
+        processed += 1
+    ledger.stop_heartbeat()
+    ledger.release_all()
+
+
+def _processed(directory):
+    counts = {}
+    for path in Path(directory).glob('processed.*'):
+        for item in path.read_text().split():
+            counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def _start(context, directory, node_id, **kwargs):
+    process = context.Process(target=run_node, args=(directory, node_id), kwargs=kwargs)
+    process.start()
+    return process
+
+
+def test_every_item_exactly_once():
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        nodes = [_start(context, directory, f"node{i}") for i in range(4)]
+        for process in nodes:
+            process.join(120)
+            assert process.exitcode == 0, f"node exited with {process.exitcode}"
+        counts = _processed(directory)
+        assert sorted(counts) == ITEMS, f"{len(ITEMS) - len(counts)} item(s) never processed"
+        twice = [item for item, count in counts.items() if count > 1]
+        assert not twice, f"processed more than once: {twice}"
+        merged = Ledger(directory, 'reader').merged_results()
+        assert sorted(results['image_name'] for results in merged) == ITEMS
+
+
+def test_dead_node_lease_is_reclaimed():
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        dead = _start(context, directory, 'dead', die_after=2)
+        dead.join(60)
+        assert dead.exitcode == 1
+        stranded = Ledger(directory, 'reader').status()
+        assert stranded['leased'] == 1 and stranded['nodes'] == ['dead'], stranded
+
+        started = time.monotonic()
+        nodes = [_start(context, directory, f"survivor{i}") for i in range(2)]
+        for process in nodes:
+            process.join(120)
+            assert process.exitcode == 0
+        counts = _processed(directory)
+        assert sorted(counts) == ITEMS
+        # Only the item the dead node was holding may have been started twice
+        twice = [item for item, count in counts.items() if count > 1]
+        assert len(twice) <= 1, f"processed more than once: {twice}"
+        assert Ledger(directory, 'reader').status()['leased'] == 0
+        assert time.monotonic() - started < 60
+
+
+def test_stalled_owner_cannot_overwrite_reclaimed_lease():
+    _fast_settings()
+    with tempfile.TemporaryDirectory() as directory:
+        slow = Ledger(directory, 'slow', lease_seconds=0.2)
+        fast = Ledger(directory, 'fast', lease_seconds=60)
+        slow.initialize(ITEMS[:1])
+        fast.initialize(ITEMS[:1])
+        assert slow.claim() == ITEMS[0]
+        time.sleep(0.4)
+        # The slow node's lease and heartbeat have expired
+        assert fast.claim() == ITEMS[0]
+        # Its heartbeat comes back late: that must not take the lease back
+        slow.renew()
+        slow.release(ITEMS[0])
+        lease = json.loads(fast._lease_path(ITEMS[0]).read_text())
+        assert lease['node'] == 'fast', f"lease now held by {lease['node']}"
+        third = Ledger(directory, 'third', lease_seconds=60)
+        third.initialize(ITEMS[:1])
+        assert third.claim() is None
+
+
+def test_stale_items_lock_is_taken_over():
+    _fast_settings()
+    with tempfile.TemporaryDirectory() as directory:
+        # A node created the lock and died before writing items.json
+        lock_path = Path(directory) / 'items.lock'
+        lock_path.write_text('')
+        past = time.time() - 60
+        os.utime(lock_path, (past, past))
+        started = time.monotonic()
+        items = Ledger(directory, 'late').initialize(ITEMS, timeout=10)
+        assert items == ITEMS
+        assert time.monotonic() - started < 5
+
+
+def main():
+    failures = 0
+    for test in (test_every_item_exactly_once, test_dead_node_lease_is_reclaimed,
+                 test_stalled_owner_cannot_overwrite_reclaimed_lease, test_stale_items_lock_is_taken_over):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
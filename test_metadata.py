@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Header parser tests for src/metadata.py.
+Checks that read_metadata() gets the size and orientation of a JPEG from its
+headers, and that corrupt or truncated JPEG headers give empty metadata
+without reading the rest of the file.
+
+Run directly (`python3 test_metadata.py`) or through pytest.
+"""
+
+import io
+import struct
+import sys
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src import metadata
+from src.metadata import read_metadata
+
+SOI = b'\xff\xd8'
+# One megabyte of scan data, which a header parser must never read
+PADDING = b'\x00' * (1 << 20)
+
+
+class CountingReader(io.BytesIO):
+    """A file that counts how many bytes were read from it."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def segment(code, payload, length=None):
+    """A JPEG marker segment; `length` overrides the length field."""
+    length = len(payload) + 2 if length is None else length
+    return b'\xff' + bytes([code]) + struct.pack('>H', length) + payload
+
+
+def exif_orientation(orientation):
+    ifd = struct.pack('<H', 1) + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('<I', 0)
+    return segment(0xE1, b'Exif\0\0' + b'II*\0' + struct.pack('<I', 8) + ifd)
+
+
+def parse(data):
+    reader = CountingReader(data)
+    info = {'_ifd0': {}, '_exif': {}, '_sizes': []}
+    metadata._read_jpeg(reader, info)
+    return info, reader.bytes_read
+
+
+def test_valid_jpeg_headers():
+    ok, encoded = cv2.imencode('.jpg', np.zeros((60, 80, 3), dtype=np.uint8))
+    assert ok
+    data = encoded.tobytes()
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'valid.jpg'
+        path.write_bytes(data[:2] + exif_orientation(6) + data[2:])
+        info = read_metadata(path)
+    assert (info['width'], info['height'], info['orientation']) == (80, 60, 6), info
+
+
+def test_corrupt_segment_length_stops_parsing():
+    for length in (0, 1):
+        for code in (0xE1, 0xE0, 0xC0):
+            info, bytes_read = parse(SOI + segment(code, b'', length=length) + b'Exif\0\0' + PADDING)
+            assert bytes_read < 64, f"length {length} of marker {code:#x}: read {bytes_read} bytes"
+            assert info['_sizes'] == [] and info['_ifd0'] == {}
+
+
+def test_truncated_jpeg_headers():
+    sof = struct.pack('>BHHB', 8, 600, 800, 3) + b'\x01\x22\x00' * 3
+    truncated = {
+        'SOI only': SOI,
+        'marker without length': SOI + b'\xff\xe1\x00',
+        'Exif cut short': SOI + segment(0xE1, b'Exif\0\0II*\0\x08\0\0\0', length=1000),
+        'TIFF header cut short': SOI + segment(0xE1, b'Exif\0\0II'),
+        'SOF cut short': SOI + segment(0xC0, sof)[:7],
+        'SOF shorter than its fields': SOI + segment(0xC0, b'\x08\x02', length=4) + PADDING,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name, data in truncated.items():
+            path = Path(directory) / 'truncated.jpg'
+            path.write_bytes(data)
+            info = read_metadata(path)
+            assert info['width'] is None and info['orientation'] is None, f"{name}: {info}"
+            assert info['time_source'] == 'mtime', name
+    # The complete SOF segment on its own does give the size
+    info, _ = parse(SOI + segment(0xC0, sof))
+    assert info['_sizes'] == [(800, 600)], info['_sizes']
+
+
+def main():
+    failures = 0
+    for test in (test_valid_jpeg_headers, test_corrupt_segment_length_stops_parsing, test_truncated_jpeg_headers):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Tests for the query language over the results of a run (src/query.py).
+Every condition is checked against a plain Python evaluation of the same
+results, including face counts above FACE_BUCKETS (which share one posting
+list), != on emotions and objects, ordering and limits, and intersections
+that come out empty.
+
+Run directly (`python3 test_query.py`) or through pytest.
+"""
+
+import sys
+
+from src.query import FACE_BUCKETS, QueryError, QueryIndex, parse
+
+EMOTIONS = ['happy', 'sad', 'neutral', 'surprise']
+LABELS = ['person', 'dog', 'cake']
+OPS = ['=', '!=', '<', '<=', '>', '>=']
+COMPARE = {'=': lambda a, b: a == b, '!=': lambda a, b: a != b, '<': lambda a, b: a < b,
+           '<=': lambda a, b: a <= b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+
+
+def make_results(count=48):
+    """Results with 0 to FACE_BUCKETS + 3 faces, repeated scores and mixed emotions and labels."""
+    all_results = []
+    for i in range(count):
+        faces = [{'box': [0, 0, 10, 10], 'emotion': EMOTIONS[(i + f) % len(EMOTIONS)]}
+                 for f in range(i % (FACE_BUCKETS + 4))]
+        objects = [{'label': label, 'confidence': 0.9, 'box': [0, 0, 5, 5]}
+                   for j, label in enumerate(LABELS) if (i >> j) & 1]
+        all_results.append({'image_name': f"IMG_{i:03d}.jpg", 'faces': faces, 'objects': objects,
+                            'score': (i * 7 % 11) / 4})
+    return all_results
+
+
+def names(results):
+    return [r['image_name'] for r in results]
+
+
+def expected(all_results, predicate):
+    """Names of the matching results in the default order (score, highest first, ties in result order)."""
+    matches = [r for r in all_results if predicate(r)]
+    return names(sorted(matches, key=lambda r: -r['score']))
+
+
+def _emotions(results):
+    return {face['emotion'] for face in results['faces']}
+
+
+def _labels(results):
+    return {obj['label'] for obj in results['objects']}
+
+
+def test_parse_errors():
+    for text in ('order score', 'order by', 'order by emotion', 'limit', 'limit ten', 'happy',
+                 'color=red', 'emotion>happy', 'object<=dog', 'name>IMG', 'faces>=many', 'score<high'):
+        try:
+            parse(text)
+        except QueryError:
+            continue
+        raise AssertionError(f"{text!r} parsed without an error")
+    query = parse('Emotion==happy faces>=3 score<1.5 order by name desc limit 7')
+    assert query == {'conditions': [('emotion', '=', 'happy'), ('faces', '>=', 3), ('score', '<', 1.5)],
+                     'order': ('name', True), 'limit': 7}, query
+    assert parse('order by faces asc')['order'] == ('faces', False)
+    assert parse('order by name')['order'] == ('name', False)
+
+
+def test_face_count_operators():
+    all_results = make_results()
+    index = QueryIndex(all_results)
+    assert max(len(r['faces']) for r in all_results) > FACE_BUCKETS
+    for op in OPS:
+        for value in range(0, FACE_BUCKETS + 5):
+            got = names(index.search(f"faces{op}{value}"))
+            want = expected(all_results, lambda r: COMPARE[op](len(r['faces']), value))
+            assert got == want, f"faces{op}{value}: {got} != {want}"
+
+
+def test_score_operators():
+    all_results = make_results()
+    index = QueryIndex(all_results)
+    for op in OPS:
+        # Scores present in the results (with ties), between them, and outside their range
+        for value in (0.0, 0.5, 1.0, 1.1, 2.5, -1.0, 10.0):
+            got = names(index.search(f"score{op}{value}"))
+            want = expected(all_results, lambda r: COMPARE[op](r['score'], value))
+            assert got == want, f"score{op}{value}: {got} != {want}"
+
+
+def test_emotion_and_object_conditions():
+    all_results = make_results()
+    index = QueryIndex(all_results)
+    cases = {
+        'emotion=happy': lambda r: 'happy' in _emotions(r),
+        'emotion=HAPPY,sad': lambda r: _emotions(r) & {'happy', 'sad'},
+        'emotion!=happy': lambda r: 'happy' not in _emotions(r),
+        'emotion!=happy,sad': lambda r: not _emotions(r) & {'happy', 'sad'},
+        'emotion!=angry': lambda r: True,
+        'object=dog': lambda r: 'dog' in _labels(r),
+        'object!=dog': lambda r: 'dog' not in _labels(r),
+        'object!=dog,cake': lambda r: not _labels(r) & {'dog', 'cake'},
+        'object!=dog emotion!=sad': lambda r: 'dog' not in _labels(r) and 'sad' not in _emotions(r),
+        'name=IMG_01*': lambda r: r['image_name'].startswith('IMG_01'),
+        'name!=IMG_0?0.jpg': lambda r: not (r['image_name'][:5] == 'IMG_0' and r['image_name'][6:] == '0.jpg'),
+    }
+    for text, predicate in cases.items():
+        got = names(index.search(text))
+        want = expected(all_results, predicate)
+        assert got == want, f"{text}: {got} != {want}"
+    # Results without faces have no emotion, so they match every !=
+    assert 'IMG_000.jpg' in names(index.search('emotion!=happy'))
+
+
+def test_order_and_limit():
+    all_results = make_results()
+    index = QueryIndex(all_results)
+    with_faces = [r for r in all_results if r['faces']]
+
+    assert names(index.search('faces>0 limit 5')) == expected(all_results, lambda r: r['faces'])[:5]
+    assert names(index.search('order by score asc')) == names(sorted(all_results, key=lambda r: r['score']))
+    assert names(index.search('faces>=1 order by faces')) == names(
+        sorted(with_faces, key=lambda r: -len(r['faces'])))
+    assert names(index.search('order by faces asc limit 3')) == names(
+        sorted(all_results, key=lambda r: len(r['faces'])))[:3]
+    assert names(index.search('order by name desc limit 4')) == sorted(names(all_results), reverse=True)[:4]
+    assert names(index.search('order by name')) == sorted(names(all_results))
+    assert index.search('limit 0') == []
+    assert len(index.search('')) == len(all_results)
+
+
+def test_empty_intersections():
+    all_results = make_results()
+    index = QueryIndex(all_results)
+    for text in ('object=unicorn', 'object=unicorn faces>=1', 'faces=0 emotion=happy',
+                 'score>100 object=dog', 'faces>=1 faces<1', 'emotion=happy emotion!=happy order by name limit 3'):
+        assert index.search(text) == [], f"{text} matched something"
+    assert QueryIndex([]).search('emotion=happy faces>2') == []
+    assert QueryIndex([]).search('') == []
+
+
+def main():
+    failures = 0
+    for test in (test_parse_errors, test_face_count_operators, test_score_operators,
+                 test_emotion_and_object_conditions, test_order_and_limit, test_empty_intersections):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
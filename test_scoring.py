@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Equivalence test for the scoring engine.
+Checks that ScoringEngine.score() and the vectorized score_batch() give exactly
+the same scores and components as the original per-image scoring loop, on
+randomly generated results.
+
+Run directly (`python3 test_scoring.py`) or through pytest.
+"""
+
+import copy
+import random
+import sys
+
+from src import settings
+from src.pipeline import ImageProcessor
+from src.scoring import ScoringEngine
+
+EMOTIONS = ['angry', 'disgust', 'fear', 'Happy', 'happy', 'sad', 'surprise', 'neutral']
+LABELS = [bias['name'] for bias in settings.image_raw_bias_settings] + ['Person', 'DOG', 'unknown thing', 'tree']
+
+
+def reference_score(results, desired_emotion):
+    """The per-image scoring as it was before the engine, kept verbatim as the reference."""
+    emotion_score = 0
+    object_score = 0
+    face_quality_score = 0
+
+    if results['faces']:
+        for face in results['faces']:
+            face_quality = face.get('face_quality', 1.0)
+            if face.get('is_partial', False):
+                completeness = face.get('face_completeness', 0.5)
+                if completeness >= 0.7:
+                    quality_factor = completeness
+                else:
+                    quality_factor = 0.3
+            else:
+                quality_factor = 1.0
+            if face['emotion'].lower() == desired_emotion.lower():
+                emotion_score += 1 * face_quality * quality_factor
+            face_quality_score += face_quality * quality_factor
+    else:
+        face_quality_score = -1
+
+    if results['faces']:
+        avg_face_quality = face_quality_score / len(results['faces'])
+        if len(results['faces']) > 1 and avg_face_quality > 0.8:
+            face_quality_score *= 1.2
+
+    for obj in results['objects']:
+        for bias in settings.image_raw_bias_settings:
+            if obj['label'].lower() == bias['name'].lower():
+                object_score += emotion_score * bias['biasamount']
+                break
+
+    final_score = emotion_score + object_score
+    if results['faces'] and face_quality_score > 0:
+        final_score *= (0.5 + 0.5 * min(face_quality_score, 2.0))
+
+    results['score_components'] = {
+        'emotion_score': emotion_score,
+        'object_score': object_score,
+        'face_quality_score': face_quality_score,
+        'final_score': final_score
+    }
+    return final_score
+
+
+def random_results(rng, index):
+    faces = []
+    for _ in range(rng.choice([0, 0, 1, 1, 2, 3, 6])):
+        face = {'emotion': rng.choice(EMOTIONS)}
+        if rng.random() < 0.9:
+            face['face_quality'] = rng.choice([rng.random(), 1.0, 0.95, 0.0])
+        if rng.random() < 0.3:
+            face['is_partial'] = True
+            if rng.random() < 0.8:
+                face['face_completeness'] = rng.choice([rng.random(), 0.7, 0.69])
+        faces.append(face)
+    objects = [{'label': rng.choice(LABELS)} for _ in range(rng.choice([0, 1, 3, 12]))]
+    return {'image_name': f'image_{index}.jpg', 'poses': [], 'faces': faces, 'objects': objects}
+
+
+def assert_same(expected_score, expected, actual_score, actual):
+    # Exact equality (and type), not approx: rankings must not change
+    assert actual_score == expected_score, (actual_score, expected_score)
+    for key, value in expected['score_components'].items():
+        got = actual['score_components'][key]
+        assert got == value and type(got) is type(value), (key, got, value, expected)
+
+
+def test_engine_matches_reference():
+    rng = random.Random(1234)
+    for desired_emotion in ('happy', 'SAD', 'neutral'):
+        engine = ScoringEngine(desired_emotion)
+        for i in range(2000):
+            results = random_results(rng, i)
+            expected = copy.deepcopy(results)
+            expected_score = reference_score(expected, desired_emotion)
+            assert_same(expected_score, expected, engine.score(results), results)
+
+
+def test_batch_matches_reference():
+    rng = random.Random(5678)
+    for desired_emotion in ('happy', 'surprise'):
+        all_results = [random_results(rng, i) for i in range(5000)]
+        expected = copy.deepcopy(all_results)
+        expected_scores = [reference_score(results, desired_emotion) for results in expected]
+        scores = ScoringEngine(desired_emotion).score_batch(all_results)
+        assert len(scores) == len(all_results)
+        for expected_score, reference, results, score in zip(expected_scores, expected, all_results, scores):
+            assert score == expected_score
+            assert_same(expected_score, reference, results['score'], results)
+    assert len(ScoringEngine('happy').score_batch([])) == 0
+
+
+def test_processor_uses_engine():
+    rng = random.Random(42)
+    processor = ImageProcessor(None, None, 'happy')
+    results = random_results(rng, 0)
+    results['faces'] = [{'emotion': 'happy', 'face_quality': 0.9}]
+    results['objects'] = [{'label': 'dog'}, {'label': 'cat'}]
+    assert processor.score_image(results) == reference_score(copy.deepcopy(results), 'happy')
+    processor.desired_emotion = 'sad'
+    assert processor.score_image(results) == reference_score(copy.deepcopy(results), 'sad')
+
+
+def main():
+    failures = 0
+    for test in (test_engine_matches_reference, test_batch_matches_reference, test_processor_uses_engine):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
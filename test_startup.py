@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Import-time budget test for the CLI.
+Checks that starting Fast Goggles does not import any heavy ML dependency and
+that `main --help` stays within the startup budget.
+
+Run directly (`python3 test_startup.py`) or through pytest.
+"""
+
+import statistics
+import sys
+
+from benchmark import STARTUP_COMMANDS, imported_heavy_modules, time_command
+
+# Seconds allowed for `python3 -m main --help`, on top of the bare interpreter start
+STARTUP_BUDGET = 1.0
+
+
+def test_no_heavy_imports_at_startup():
+    heavy = imported_heavy_modules('import main, src.pipeline')
+    assert not heavy, f"Heavy modules imported at startup: {', '.join(heavy)}"
+
+
+def test_help_within_budget():
+    baseline = statistics.median(time_command(STARTUP_COMMANDS['python (baseline)'], runs=3))
+    startup = statistics.median(time_command(STARTUP_COMMANDS['main --help'], runs=3))
+    assert startup - baseline < STARTUP_BUDGET, (
+        f"`main --help` took {startup:.2f}s ({startup - baseline:.2f}s over the interpreter start), "
+        f"budget is {STARTUP_BUDGET:.2f}s"
+    )
+
+
+def main():
+    failures = 0
+    for test in (test_no_heavy_imports_at_startup, test_help_within_budget):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAIL {test.__name__}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())